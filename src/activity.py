@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# %%  Toggle activity per signal and per module from a VCD/FST dump
+# Switching activity (toggles per bit per cycle) is what dynamic power goes
+# with, and the busiest registers are where to look for savings.  The dump is
+# streamed a line at a time, keeping only the last value of each signal, so
+# memory goes with the number of signals, not the length of the dump.  Big
+# dumps are split by time across processes (--jobs): each counts its own part,
+# and the toggles across the joins are added from the first/last values.
+# FST is read through gtkwave's fst2vcd (split with its --begin/--end, so
+# give --end with --jobs), and anything else that starts like a VCD is a VCD
+# (the sims here may write VCD into tb.fst).  Dump the workload with DUMP=all.
+#   ./activity.py                        # check against the model, compare workloads
+#   ./activity.py tb.fst --depth 2 --top 10 --save mac.json
+#   ./activity.py tb.fst --against mac.json    # against an earlier run
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Var:
+    scope: str  # dotted module path
+    name: str
+    width: int
+
+
+# Declared signals by id code (several vars can share one), and where the value changes start
+def header(f):
+    ids, scope, tokens = {}, [], []
+    for line in f:
+        tokens += line.split()
+        while b"$end" in tokens:
+            n = tokens.index(b"$end")
+            decl, tokens = tokens[:n], tokens[n + 1:]
+            if not decl:
+                continue
+            if decl[0] == b"$scope":
+                scope.append(decl[2].decode())
+            elif decl[0] == b"$upscope":
+                scope.pop()
+            elif decl[0] == b"$var":
+                name = " ".join(t.decode() for t in decl[4:6])
+                ids.setdefault(decl[3], []).append(Var(".".join(scope), name, int(decl[2])))
+            elif decl[0] == b"$enddefinitions":
+                return ids
+    raise ValueError("no $enddefinitions in the dump")
+
+
+# Value of a change as an int, or bytes with x/z in it
+def value(v):
+    try:
+        return int(v, 2)
+    except ValueError:
+        return v.lower()
+
+
+# Bits that differ between two values of a signal
+def toggles(a, b, width):
+    if isinstance(a, int) and isinstance(b, int):
+        return (a ^ b).bit_count()
+    pad = lambda v: (v if isinstance(v, bytes) else f"{v:b}".encode()).rjust(width, b"0")
+    return sum(x != y for x, y in zip(pad(a), pad(b)))
+
+
+# Counts from one part of a dump
+@dataclass
+class Part:
+    toggles: dict = field(default_factory=dict)  # by id code
+    changes: dict = field(default_factory=dict)
+    first: dict = field(default_factory=dict)  # (time, value, counted) of the first change per id
+    last: dict = field(default_factory=dict)  # value after the last change per id
+    start: int = None  # first and last time seen
+    end: int = None
+
+
+# Count the value changes in lines, for times in [begin, end) (None for no limit)
+def count(lines, widths, begin=None, end=None):
+    p = Part()
+    last, first, tog, chg = p.last, p.first, p.toggles, p.changes
+    t, counting, quiet = 0, begin is None, False  # quiet in $dumpvars/$dumpon/... where values are restated
+    for line in lines:
+        c = line[:1]
+        if c in b"01xzXZ":
+            v, i = value(line[:1]), line[1:].strip()
+        elif c in b"bB":
+            v, i = line[1:].split()
+            v = value(v)
+        elif c == b"#":
+            t = int(line[1:])
+            if end is not None and t >= end:
+                break
+            counting = begin is None or t >= begin
+            p.start = t if p.start is None else p.start
+            p.end = t
+            continue
+        elif c in b"rRsS":  # reals and strings just count as changes
+            v, i = line[1:].split()
+        elif c == b"$":
+            word = line.split()[0]
+            if word in (b"$dumpvars", b"$dumpon", b"$dumpoff", b"$dumpall"):
+                quiet = True
+            if line.rstrip().endswith(b"$end"):
+                quiet = False
+            continue
+        else:
+            continue
+        if i not in widths:
+            continue
+        old = last.get(i)
+        last[i] = v
+        if old is None:
+            first[i] = (t, v, counting and not quiet)
+        elif counting and not quiet and v != old:
+            chg[i] = chg.get(i, 0) + 1
+            if isinstance(v, (int, bytes)) and widths[i]:
+                tog[i] = tog.get(i, 0) + toggles(old, v, widths[i])
+    return p
+
+
+# Lines of the value changes in a VCD between two byte offsets
+def vcd_lines(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            pos += len(line)
+            yield line
+            if pos >= stop:
+                return
+
+
+def is_fst(path):
+    with open(path, "rb") as f:
+        return not f.read(64).lstrip().startswith(b"$")
+
+
+# fst2vcd of a time range, as a file of lines
+def fst2vcd(path, begin=None, end=None):
+    cmd = ["fst2vcd", path] + (["--begin", str(begin)] if begin is not None else []) + \
+        (["--end", str(end - 1)] if end is not None else [])
+    try:
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1 << 20)
+    except FileNotFoundError:
+        raise RuntimeError("reading FST needs fst2vcd (from gtkwave) on the PATH") from None
+
+
+# One part, in a worker: ("vcd", path, start byte, stop byte, begin, end) or
+# ("fst", path, begin, end) (which gets a header of its own)
+def work(args):
+    kind, path, *rest = args
+    if kind == "vcd":
+        start, stop, widths, begin, end = rest
+        return count(vcd_lines(path, start, stop), widths, begin, end)
+    begin, end = rest
+    proc = fst2vcd(path, begin, end)
+    widths = {i: vs[0].width for i, vs in header(proc.stdout).items()}
+    part = count(proc.stdout, widths, begin, end)
+    proc.stdout.close()
+    proc.wait()
+    return part
+
+
+# Byte offsets splitting the value changes of a VCD into n parts at time steps
+def splits(path, data, n):
+    size = os.path.getsize(path)
+    offsets = [data]
+    with open(path, "rb") as f:
+        for k in range(1, n):
+            f.seek(max(offsets[-1], data + (size - data) * k // n))
+            f.readline()
+            while (line := f.readline()) and not line.startswith(b"#"):
+                pass
+            if line:
+                offsets.append(f.tell() - len(line))
+    return sorted(set(offsets)) + [size]
+
+
+# Parts in time order added up, with the toggles across each join
+def merge(parts, widths):
+    total = Part()
+    for p in parts:
+        for i, (t, v, counted) in p.first.items():
+            old = total.last.get(i)
+            if old is not None and counted and v != old:
+                total.changes[i] = total.changes.get(i, 0) + 1
+                if isinstance(v, (int, bytes)) and widths[i]:
+                    total.toggles[i] = total.toggles.get(i, 0) + toggles(old, v, widths[i])
+        for d in ("toggles", "changes"):
+            for i, n in getattr(p, d).items():
+                getattr(total, d)[i] = getattr(total, d).get(i, 0) + n
+        total.last.update(p.last)
+        total.start = p.start if total.start is None else total.start
+        total.end = p.end if p.end is not None else total.end
+    return total
+
+
+@dataclass
+class Activity:
+    signals: dict  # "scope.name" -> (width, toggles, changes)
+    cycles: int
+
+    # Per module, including everything below it, down to depth below the top
+    # (a port is a signal at both ends, so a net counts in each module it's in)
+    def modules(self, depth=None):
+        out = {}
+        for path, (width, tog, _) in self.signals.items():
+            parts = path.split(".")[:-1]
+            for n in range(1, len(parts) + 1 if depth is None else min(len(parts), depth) + 1):
+                m = out.setdefault(".".join(parts[:n]), [0, 0, 0])
+                m[0], m[1], m[2] = m[0] + 1, m[1] + width, m[2] + tog
+        return out
+
+    def rate(self, toggles, bits):
+        return toggles / (bits * self.cycles) if bits and self.cycles else 0.
+
+    def table(self, depth=None, top=0, against=None):
+        ref = against.modules(depth) if against else {}
+        lines = [f"{self.cycles} cycles"]
+        lines.append(f"{'module':<40} {'signals':>7} {'bits':>6} {'toggles':>10} {'per cycle':>10} {'activity':>8}"
+                     + (f" {'vs before':>9}" if against else ""))
+        for path, (n, bits, tog) in sorted(self.modules(depth).items()):
+            row = (f"{path:<40} {n:>7} {bits:>6} {tog:>10} {tog / max(self.cycles, 1):>10.2f}"
+                   f" {self.rate(tog, bits):>8.4f}")
+            if against and path in ref:
+                r = against.rate(ref[path][2], ref[path][1])
+                row += f" {self.rate(tog, bits) / r:>8.2f}x" if r else f" {'-':>9}"
+            lines.append(row)
+        if top:
+            lines.append(f"busiest {top} signals (toggles per bit per cycle):")
+            busiest = sorted(self.signals.items(), key=lambda kv: -self.rate(kv[1][1], kv[1][0]))
+            lines += [f"  {path:<50} {self.rate(t, w):.4f}" for path, (w, t, _) in busiest[:top]]
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"cycles": self.cycles, "signals": self.signals}, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+        return cls({k: tuple(v) for k, v in d["signals"].items()}, d["cycles"])
+
+
+# Toggle counts of a dump, over times in [begin, end), in jobs processes, with
+# cycles counted on clock (rising edges, by dotted name, or any signal named clk)
+def analyze(path, begin=None, end=None, jobs=1, clock=None):
+    fst = is_fst(path)
+    if fst:
+        proc = fst2vcd(path)
+        ids = header(proc.stdout)
+        proc.kill()
+        proc.wait()
+        if jobs > 1 and end is None:
+            raise ValueError("give the end time to split an FST across jobs")
+        lo = begin or 0
+        edges = [lo + (end - lo) * k // jobs for k in range(jobs + 1)] if jobs > 1 else [begin, end]
+        tasks = [("fst", path, b, e) for b, e in zip(edges, edges[1:])]
+    else:
+        with open(path, "rb") as f:
+            ids = header(f)
+            data = f.tell()
+        widths = {i: vs[0].width for i, vs in ids.items()}
+        offsets = splits(path, data, jobs) if jobs > 1 else [data, os.path.getsize(path)]
+        tasks = [("vcd", path, a, b, widths, begin, end) for a, b in zip(offsets, offsets[1:])]
+    widths = {i: vs[0].width for i, vs in ids.items()}
+    if len(tasks) > 1:
+        with multiprocessing.get_context("fork").Pool(jobs) as pool:
+            parts = pool.map(work, tasks)
+    else:
+        parts = [work(tasks[0])]
+    total = merge(parts, widths)
+    signals = {f"{v.scope}.{v.name.split()[0]}": (v.width, total.toggles.get(i, 0), total.changes.get(i, 0))
+               for i, vs in ids.items() for v in vs}
+    clk = clock or next((p for p in signals if p.split(".")[-1] == "clk"), None)
+    cycles = signals[clk][1] // 2 if clk else 0
+    return Activity(signals, cycles)
+
+
+# A dump of the Python model running blocks, with its registers and pins,
+# and the toggles each signal should have (for checking, and to compare
+# workloads without a simulator)
+def model_vcd(path, blocks, period=20000):
+    from cosim import registers
+    from model import Tile
+
+    tile = Tile()
+    widths = {"count": 2, "Pipe0s": 34, "Pipe1s": 32, "Pipe2s": 40, "Pipe0Ss": 1, "Pipe1Ss": 1, "Pipe2Ss": 1,
+              "col_buf_in": 12, "row_buf_in": 12, "col_ctrl_buf_in": 3, "row_ctrl_buf_in": 3,
+              "col_ctrl_buf_out": 4, "row_ctrl_buf_out": 4}
+    top = {"clk": 1, "ui_in": 8, "uio_in": 8, "uo_out": 8, "uio_out": 8}
+    regs = {n: widths.get(n, 16) for n in registers(tile)}
+    code = {n: chr(33 + k) for k, n in enumerate(list(top) + list(regs))}
+    expect, prev = {n: 0 for n in code}, {}
+    with open(path, "w") as f:
+        f.write("$timescale 1ps $end\n$scope module tb $end\n")
+        f.writelines(f"$var wire {w} {code[n]} {n} $end\n" for n, w in top.items())
+        f.write("$scope module tt_um_machinaut_systolic $end\n")
+        f.writelines(f"$var wire {w} {code[n]} {n} $end\n" for n, w in regs.items())
+        f.write("$upscope $end\n$upscope $end\n$enddefinitions $end\n")
+
+        def change(t, values, first=False):
+            f.write(f"#{t}\n" + ("$dumpvars\n" if first else ""))
+            for n, v in values.items():
+                if prev.get(n) != v:
+                    if n in prev:
+                        expect[n] += (prev[n] ^ v).bit_count()
+                    prev[n] = v
+                    f.write(f"{v}{code[n]}\n" if n == "clk" else f"b{v:b} {code[n]}\n")
+            if first:
+                f.write("$end\n")
+
+        t = 0
+        for col, cc, row, rc in blocks:
+            for k in range(4):
+                ui = (((col >> (12 - 4 * k)) & 0xf) << 4) | ((row >> (12 - 4 * k)) & 0xf)
+                uio = (int(cc[k]) << 3) | (int(rc[k]) << 2)
+                uo, uio_out = tile.outputs()
+                change(t, {"clk": 0, "ui_in": ui, "uio_in": uio, "uo_out": uo, "uio_out": uio_out,
+                           **registers(tile)}, first=t == 0)
+                tile.clock(ui, uio)
+                change(t + period // 2, {"clk": 1, **registers(tile)})
+                t += period
+        change(t, {"clk": 0})
+    return {(f"tb.tt_um_machinaut_systolic.{n}" if n in regs else f"tb.{n}"): e for n, e in expect.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="toggle activity per signal and module from a VCD/FST dump")
+    parser.add_argument("dump", nargs="?", help="VCD or FST (otherwise check against the model)")
+    parser.add_argument("--begin", type=int, default=None, help="start time (in the dump's timescale)")
+    parser.add_argument("--end", type=int, default=None, help="end time (exclusive)")
+    parser.add_argument("--jobs", type=int, default=1, help="processes to split the dump across")
+    parser.add_argument("--clock", default=None, help="clock signal, dotted (default: any clk)")
+    parser.add_argument("--depth", type=int, default=None, help="module levels to show")
+    parser.add_argument("--top", type=int, default=10, help="busiest signals to show")
+    parser.add_argument("--save", default=None, help="write the counts as JSON")
+    parser.add_argument("--against", default=None, help="JSON from --save to compare with")
+    args = parser.parse_args()
+    if args.dump:
+        act = analyze(args.dump, args.begin, args.end, args.jobs, args.clock)
+        print(act.table(args.depth, args.top, Activity.load(args.against) if args.against else None))
+        if args.save:
+            act.save(args.save)
+        raise SystemExit
+    import random
+    import tempfile
+
+    from gemm import random_job
+    from tilesched import schedule, tile_stream
+
+    rs = random.Random(0)
+    mac = [b for b in tile_stream(schedule([random_job(rs, 2, 2, 8, C=True) for _ in range(20)],
+                                           expected=False).blocks)]
+    passthrough = [(rs.getrandbits(16), "0000", rs.getrandbits(16), "0000") for _ in range(len(mac))]
+    with tempfile.TemporaryDirectory() as d:
+        # Same counts as the model, whole or split, and a time window is a part of it
+        path = os.path.join(d, "mac.vcd")
+        expect = model_vcd(path, mac)
+        whole = analyze(path)
+        assert {p: s[1] for p, s in whole.signals.items()} == expect
+        assert whole.cycles == 4 * len(mac)
+        for jobs in (2, 3, 7):
+            assert analyze(path, jobs=jobs).signals == whole.signals, jobs
+        half = 2 * len(mac) * 20000
+        first, second = analyze(path, end=half), analyze(path, begin=half, jobs=3)
+        assert all(first.signals[p][1] + second.signals[p][1] == s[1] for p, s in whole.signals.items())
+        print("toggle counts match the model, whole, split, and over time windows")
+        # Dense MACs against passthrough
+        ref = os.path.join(d, "pass.vcd")
+        model_vcd(ref, passthrough)
+        print(f"passthrough:\n{analyze(ref).table(top=0)}")
+        print(f"dense MAC:\n{whole.table(top=5, against=analyze(ref))}")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# %%  Pick how to map a GEMM onto a grid of tiles, and remember the choice
+# The tiles hold accumulators but no operands, so a mapping comes down to:
+#   transpose: A down the columns and B along the rows (C = A * B), or B down
+#              the columns and A along the rows (C^T = B^T * A^T)
+#   rows/cols: the part of the grid used, which sets the output block (a
+#              panel of 2*cols x 2*rows of C) and so the padding, the waves
+#              of read-outs and the fill
+#   splits:    how many chunks of K are accumulated on the tiles before each
+#              read-out, from the fewest ksplit.py says is accurate enough up
+#              to K (one step each), the rest summed on the host
+#   order:     the host's loop nest over panel rows (i), panel columns (j)
+#              and chunks of K (k), outermost first
+# Every mapping is scored by the tiles' time (the estimate.py cost model)
+# against the host's: the operand and partial sum bytes it moves, with a
+# panel staying hot in its cache across the loops that don't index it only if
+# everything it touches in between fits, at its memory bandwidth.  The
+# defaults are a microcontroller-sized host, a few hundred KB of SRAM and
+# operands streamed from flash, where the host can easily be the bottleneck.
+# The best few are run on the vectorized emulation (emulate.py) to check they
+# compute the right thing, and the winner is cached per shape, grid and cost
+# parameters.
+#   ./autotune.py 100 30 4096 --grid 2x4 --cache mappings.json
+#   ./autotune.py --check
+import argparse
+import json
+import math
+import os
+from dataclasses import asdict, dataclass
+from itertools import permutations, product
+
+import numpy as np
+
+from emulate import decode16, emulate_matmul
+from estimate import clock_hz, estimate
+from ksplit import chunks, exact, rel_error, split_matmul
+from quant import quantize
+
+HOST_CACHE = 256 * 1024  # bytes
+HOST_BW = 25e6  # bytes/s
+
+
+@dataclass(frozen=True)
+class Mapping:
+    transpose: bool
+    rows: int
+    cols: int
+    splits: int
+    order: str  # "ijk", "kji", ...
+
+
+@dataclass
+class Score:
+    mapping: Mapping
+    cycles: int
+    host_bytes: int  # between the host's memory and its cache
+    seconds: float  # the slower of the tiles and the host
+    utilization: float  # of the whole grid
+
+    # Lower is better: time, then host traffic, tile cycles, fewer tiles and chunks
+    @property
+    def key(self):
+        m = self.mapping
+        return (self.seconds, self.host_bytes, self.cycles, m.rows * m.cols, m.splits)
+
+
+# Split counts from lo up to K that give different chunk lengths (the
+# longest chunk is what matters, more splits for the same one only cost)
+def split_counts(K, lo=1):
+    out, n = [], max(1, min(lo, K))
+    while n <= K:
+        out.append(n)
+        longest = -(-K // n)
+        n = -(-K // (longest - 1)) if longest > 1 else K + 1
+    return out
+
+
+def mappings(rows, cols, K, min_splits=1):
+    for transpose, r, c, n in product((False, True), range(1, rows + 1), range(1, cols + 1),
+                                      split_counts(K, min_splits)):
+        for order in ["".join(p) for p in permutations("ijk")] if n > 1 else ["ijk", "jik"]:
+            yield Mapping(transpose, r, c, n, order)
+
+
+# Bytes the host moves for a loop nest (order, outermost first) with trip
+# counts trips, for operand panels {name: (loops indexing it, bytes)}.  A
+# panel is loaded every time its index changes, except across an outer loop
+# that doesn't index it when all it touches inside that loop fits in cache.
+def traffic(order, trips, panels, cache):
+    total = 0
+    for idx, size in panels.values():
+        p = max(order.index(x) for x in idx)
+        loads = math.prod(trips[x] for x in order[:p + 1])
+        for q in range(p - 1, -1, -1):
+            if order[q] in idx:
+                continue
+            if size * math.prod(trips[x] for x in order[q + 1:p + 1] if x in idx) > cache:
+                break
+            loads //= trips[order[q]]
+        total += loads * size
+    return total
+
+
+def score(m, M, N, K, rows, cols, C=True, clock=None, host_cache=HOST_CACHE, host_bw=HOST_BW):
+    order = m.order
+    if m.transpose:
+        M, N = N, M
+        order = order.translate(str.maketrans("ij", "ji"))
+    e = estimate(M, N, K, m.rows, m.cols, C, clock, m.splits)
+    pm, pn, kc = 2 * m.cols, 2 * m.rows, -(-K // m.splits)
+    trips = {"i": -(-M // pm), "j": -(-N // pn), "k": m.splits}
+    # FP8 codes of A and B, C in and FP16 out, or float64 partial sums read
+    # and written every chunk when K is split
+    out = pm * pn * (2 * C + 2 if m.splits == 1 else 16)
+    host = traffic(order, trips, {"A": ("ik", pm * kc), "B": ("kj", kc * pn), "C": ("ij", out)}, host_cache)
+    seconds = max(e.seconds, host / host_bw)
+    return Score(m, e.cycles, host, seconds, e.macs / (e.cycles * rows * cols))
+
+
+# C + A * B as the mapping would run it, panel by panel in its loop order, in
+# float64 (chunks are summed on the host, and a single chunk reads out exactly
+# what the tiles do)
+def run(m, A, B, C=None, a_fmt=0, b_fmt=0):
+    if m.transpose:
+        t = lambda x: x if np.ndim(x) == 0 else np.transpose(x)
+        m = Mapping(False, m.rows, m.cols, m.splits, m.order.translate(str.maketrans("ij", "ji")))
+        return run(m, t(B), t(A), t(C) if C is not None else None, t(b_fmt), t(a_fmt)).T
+    (M, K), N = A.shape, B.shape[1]
+    pm, pn = 2 * m.cols, 2 * m.rows
+    ranges = {"i": range(0, M, pm), "j": range(0, N, pn), "k": range(m.splits)}
+    part = lambda x, r, c: x if np.ndim(x) == 0 else x[r, c]
+    out = np.zeros((M, N))
+    ks = chunks(K, m.splits)
+    with np.errstate(invalid='ignore'):  # inf - inf
+        for loop in product(*(ranges[x] for x in m.order)):
+            at = dict(zip(m.order, loop))
+            rs, cs, (start, stop) = slice(at["i"], at["i"] + pm), slice(at["j"], at["j"] + pn), ks[at["k"]]
+            kk = slice(start, stop)
+            D = emulate_matmul(A[rs, kk], B[kk, cs], C[rs, cs] if C is not None and at["k"] == 0 else None,
+                               part(a_fmt, rs, kk), part(b_fmt, kk, cs))
+            out[rs, cs] += decode16(D)
+    return out
+
+
+# Mappings that have been tuned, in a JSON file keyed by shape, grid and
+# everything else that changes the score
+class Cache:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(M, N, K, rows, cols, min_splits=1, C=True, clock=None, host_cache=HOST_CACHE, host_bw=HOST_BW):
+        return (f"{M}x{N}x{K} on {rows}x{cols}" + (f" splits>={min_splits}" if min_splits > 1 else "")
+                + f" {'with' if C else 'no'} C at {clock or clock_hz()} Hz,"
+                + f" host {host_cache} B cache {host_bw:.0f} B/s")
+
+    def get(self, *key, **kw):
+        entry = self.entries.get(self.key(*key, **kw))
+        return Mapping(**entry["mapping"]) if entry else None
+
+    def put(self, s, *key, **kw):
+        self.entries[self.key(*key, **kw)] = {"mapping": asdict(s.mapping), "cycles": s.cycles,
+                                              "host_bytes": s.host_bytes, "utilization": s.utilization}
+        if self.path:
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+# Every mapping's score, best first
+def ranked(M, N, K, rows, cols, C=True, min_splits=1, **kw):
+    return sorted((score(m, M, N, K, rows, cols, C, **kw) for m in mappings(rows, cols, K, min_splits)),
+                  key=lambda s: s.key)
+
+
+# Best mapping of C (M x N) + A (M x K) * B (K x N) on a rows x cols grid.  Scores every
+# mapping, then checks the top ones on the emulation with sample data (up to a
+# few panels of rows and columns, all of K) before taking the best that passes.
+def tune(M, N, K, rows, cols, C=True, min_splits=1, top=3, cache=None, rs=None, clock=None,
+         host_cache=HOST_CACHE, host_bw=HOST_BW):
+    kw = dict(clock=clock, host_cache=host_cache, host_bw=host_bw)
+    key = (M, N, K, rows, cols, min_splits, C)
+    if cache is not None:
+        m = cache.get(*key, **kw)
+        if m is not None:
+            return score(m, M, N, K, rows, cols, C, **kw)
+    scores = ranked(M, N, K, rows, cols, C, min_splits, **kw)
+    rs = rs or np.random.default_rng(0)
+    m, n = min(M, 3 * 2 * max(rows, cols)), min(N, 3 * 2 * max(rows, cols))
+    (A, a_fmt), (B, b_fmt) = quantize(rs.normal(0, 1, (m, K))), quantize(rs.normal(0, 1, (K, n)))
+    Cs = np.asarray(rs.normal(0, 4, (m, n)), dtype=np.float16).view(np.uint16) if C else None
+    ref, x = decode16(emulate_matmul(A, B, Cs, a_fmt, b_fmt)), exact(A, B, Cs, a_fmt, b_fmt)
+    for s in scores[:top]:
+        got = run(s.mapping, A, B, Cs, a_fmt, b_fmt)
+        if s.mapping.splits == 1:  # exactly what the tiles read out
+            ok = np.array_equal(got, ref)
+        else:  # summed on the host, no worse than all of K on the tiles
+            ok = rel_error(got, x) <= max(rel_error(ref, x), 2**-11)
+        if ok:
+            if cache is not None:
+                cache.put(s, *key, **kw)
+            return s
+    raise AssertionError(f"none of the top {top} mappings checked out: {scores[:top]}")
+
+
+# Any mapping computes what the tiles would with its chunks of K, tune picks
+# the cheapest, and the cache gives it back, but only for the same C and clock
+def check(n=20, seed=0):
+    import tempfile
+    rs = np.random.default_rng(seed)
+    for _ in range(n):
+        rows, cols, M, N, K = (int(x) for x in rs.integers(1, [4, 4, 20, 20, 40]))
+        A, B = rs.integers(0, 256, size=(M, K), dtype=np.uint8), rs.integers(0, 256, size=(K, N), dtype=np.uint8)
+        a_fmt, b_fmt = rs.integers(0, 2, size=(M, K)), rs.integers(0, 2, size=(K, N))
+        C = rs.integers(0, 2**16, size=(M, N), dtype=np.uint16)
+        ms = list(mappings(rows, cols, K))
+        for i in rs.choice(len(ms), size=min(len(ms), 8), replace=False):
+            m = ms[i]
+            ref = split_matmul(A, B, C, a_fmt, b_fmt, m.splits)
+            assert np.array_equal(run(m, A, B, C, a_fmt, b_fmt), ref, equal_nan=True), m
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "mappings.json")
+            s = tune(M, N, K, rows, cols, cache=Cache(path))
+            assert s.key == ranked(M, N, K, rows, cols)[0].key
+            assert Cache(path).get(M, N, K, rows, cols) == s.mapping
+            assert Cache(path).get(M, N, K, rows, cols, 1, False) is None
+            assert Cache(path).get(M, N, K, rows, cols, clock=1000) is None
+    # With panels of K too big for the host's cache, the loop order changes
+    # the traffic, and keeping less of K resident on the tiles wins
+    scores = ranked(512, 64, 8192, 2, 2)
+    same = [s for s in scores if s.mapping.splits == 8 and not s.mapping.transpose
+            and (s.mapping.rows, s.mapping.cols) == (2, 2)]
+    assert len({s.host_bytes for s in same}) > 1, same
+    assert scores[0].mapping.splits > 1, scores[0]
+    print(f"{n} shapes map and tune correctly")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="map a GEMM onto a grid of tiles")
+    parser.add_argument("shape", type=int, nargs="*", help="M N K, for A (M x K) * B (K x N), like estimate.py")
+    parser.add_argument("--grid", default="2x2", help="ROWSxCOLS")
+    parser.add_argument("--min-splits", type=int, default=1, help="from ksplit.py, for accuracy")
+    parser.add_argument("--no-c", action="store_true", help="no C to write in")
+    parser.add_argument("--host-cache", type=int, default=HOST_CACHE, help="bytes")
+    parser.add_argument("--host-bw", type=float, default=HOST_BW, help="bytes/s")
+    parser.add_argument("--top", type=int, default=10, help="mappings to show")
+    parser.add_argument("--cache", default=None, help="JSON file of tuned mappings")
+    parser.add_argument("--check", action="store_true", help="check the mappings on the emulation")
+    args = parser.parse_args()
+    if args.check:
+        return check()
+    rows, cols = (int(x) for x in args.grid.split("x"))
+    M, N, K = args.shape or (64, 64, 256)
+    kw = dict(host_cache=args.host_cache, host_bw=args.host_bw)
+    scores = ranked(M, N, K, rows, cols, not args.no_c, args.min_splits, **kw)
+    print(f"{len(scores)} mappings, best {args.top}:")
+    for s in scores[:args.top]:
+        print(f"  {s.mapping}: {s.seconds * 1e3:.2f} ms, {s.cycles} cycles, {100 * s.utilization:.1f}%,"
+              f" host {s.host_bytes} B")
+    s = tune(M, N, K, rows, cols, not args.no_c, args.min_splits, cache=Cache(args.cache), **kw)
+    print(f"best {s.mapping}: {s.seconds * 1e3:.2f} ms, {s.cycles} cycles, {100 * s.utilization:.1f}% utilization")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# %%  Batch small jobs from many callers into one tile stream
+# Every caller submits a 2xK * Kx2 job (a gemm.Job on one tile) and awaits its
+# C.  Run one at a time, like test_CABC (write C, K MACs, read out), each job
+# spends four blocks on accumulator I/O, but packed into one stream by
+# tilesched.schedule the read-out of each job is the write-in of the next, so
+# it's two.  Batcher holds jobs until max_jobs are waiting or the oldest has
+# waited max_delay seconds, runs them as one stream on a device, and hands
+# each caller its read-out.  A longer delay makes bigger batches, which is
+# less overhead per job and so more throughput, for more latency.
+# A device is anything with async run(blocks) -> blocks, in and out as
+# (col, col_ctrl, row, row_ctrl) like model.run_blocks.
+#   ./batch.py         # check read-outs, then sweep the delay on the model
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+from fp import FP16
+from gemm import same
+from model import Tile, run_blocks
+from tilesched import schedule, tile_stream
+
+
+# The Python tile model as a device, taking as long as the tile would at
+# clock_hz (or no time at all without one)
+class ModelTile:
+    def __init__(self, clock_hz=None):
+        self.tile = Tile()
+        self.clock_hz = clock_hz
+
+    async def run(self, blocks):
+        t = time.perf_counter()
+        out = run_blocks(self.tile, blocks)
+        if self.clock_hz:
+            await asyncio.sleep(max(0., 4 * len(blocks) / self.clock_hz - (time.perf_counter() - t)))
+        return out
+
+
+# C of each job in a schedule, from the blocks that came out of the device:
+# every read-out (the block after a read-write block) is C0 (col) and C1
+# (row), then C2 and C3, and the first one is the zeros from before if the
+# schedule starts with a write-in
+def readouts(sched, jobs, out):
+    rw = [b.get('a') in (6, 7) for b in sched.blocks]
+    reads = [(co, ro) for (co, _, ro, _), read in zip(out[1:], rw) if read]
+    reads = reads[len(reads) - 2 * len(sched.order):]
+    h = lambda x: FP16.fromh(f"{x:04x}")
+    results = [job.C or [[FP16.fromf(0.)] * 2 for _ in range(2)] for job in jobs]  # K=0 jobs aren't run
+    for n, i in enumerate(sched.order):
+        (C0, C1), (C2, C3) = reads[2 * n], reads[2 * n + 1]
+        results[i] = [[h(C0), h(C2)], [h(C1), h(C3)]]
+    return results
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    jobs: int = 0
+    blocks: int = 0
+    mac_blocks: int = 0
+    latency: list = field(default_factory=list)  # seconds from submit to result, per job
+
+    def __str__(self):
+        lat = sorted(self.latency)
+        pct = lambda p: 1e3 * lat[min(len(lat) - 1, int(p * len(lat)))] if lat else 0.
+        return (f"{self.jobs} jobs in {self.batches} batches ({self.jobs / max(self.batches, 1):.1f} per batch),"
+                f" {100 * self.mac_blocks / max(self.blocks, 1):.1f}% MAC blocks,"
+                f" latency {pct(.5):.1f} ms median, {pct(.95):.1f} ms p95")
+
+
+class Batcher:
+    def __init__(self, device, max_delay=1e-3, max_jobs=64, check=True):
+        self.device, self.max_delay, self.max_jobs, self.check = device, max_delay, max_jobs, check
+        self.queue = asyncio.Queue()
+        self.stats = BatchStats()
+        self.task = None
+
+    # C + A * B for a job, once its batch has run
+    async def submit(self, job):
+        if self.task is None:
+            self.task = asyncio.create_task(self.loop())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((job, future, time.perf_counter()))
+        return await future
+
+    # Run whatever is still waiting, then stop
+    async def close(self):
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def loop(self):
+        pending, closing = [], False
+        while not closing:
+            if not pending:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                pending.append(item)
+            # Fill up until the oldest has waited long enough
+            deadline = pending[0][2] + self.max_delay
+            while len(pending) < self.max_jobs:
+                try:
+                    if self.queue.empty():
+                        item = await asyncio.wait_for(self.queue.get(), deadline - time.perf_counter())
+                    else:
+                        item = self.queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                pending.append(item)
+            batch, pending = pending[:self.max_jobs], pending[self.max_jobs:]
+            await self.run(batch)
+        if pending:
+            await self.run(pending)
+
+    async def run(self, batch):
+        jobs = [job for job, _, _ in batch]
+        try:
+            sched = schedule(jobs, expected=self.check)
+            out = await self.device.run(tile_stream(sched.blocks))
+            results = readouts(sched, jobs, out)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        s = self.stats
+        s.batches, s.jobs = s.batches + 1, s.jobs + len(batch)
+        s.blocks, s.mac_blocks = s.blocks + sched.stream_blocks, s.mac_blocks + sched.mac_blocks
+        for (job, future, t), res, ref in zip(batch, results, sched.results):
+            if self.check and not all(same(a, b) for x, y in zip(res, ref) for a, b in zip(x, y)):
+                future.set_exception(AssertionError(f"read out {res}, expected {ref}"))
+            else:
+                future.set_result(res)
+            s.latency.append(time.perf_counter() - t)
+
+
+# Jobs arriving at random (rate per second) from separate callers, returning
+# their results in order and the batcher's stats
+async def serve(device, jobs, rate, max_delay, max_jobs=64, check=True):
+    batcher = Batcher(device, max_delay, max_jobs, check)
+    rs = random.Random(0)
+
+    async def caller(job, at):
+        await asyncio.sleep(at)
+        return await batcher.submit(job)
+
+    at = [0.]
+    for _ in jobs[1:]:
+        at.append(at[-1] + rs.expovariate(rate))
+    t = time.perf_counter()
+    results = await asyncio.gather(*(caller(job, a) for job, a in zip(jobs, at)))
+    await batcher.close()
+    return results, batcher.stats, time.perf_counter() - t
+
+
+if __name__ == "__main__":
+    from gemm import golden, random_job
+
+    rs = random.Random(0)
+    # Every caller gets its own job's result, off the model, whatever the batching
+    jobs = [random_job(rs, 2, 2, rs.randint(0, 8), C=rs.random() < 0.5) for _ in range(100)]
+    for max_delay, max_jobs in [(0., 1), (1e-3, 4), (1., 100)]:
+        results, stats, _ = asyncio.run(serve(ModelTile(), jobs, 1e4, max_delay, max_jobs))
+        for job, res in zip(jobs, results):
+            ref = golden(job) if job.K else job.C or [[FP16.fromf(0.)] * 2] * 2
+            assert all(same(a, b) for x, y in zip(ref, res) for a, b in zip(x, y))
+    print("every caller gets its own result")
+    # Throughput and latency against the delay, on a tile taking real time
+    clock, rate = 20000, 700  # Hz, jobs per second (more than one at a time keeps up with)
+    jobs = [random_job(rs, 2, 2, rs.randint(1, 8), C=True) for _ in range(400)]
+    print(f"{len(jobs)} jobs with C at {rate} jobs/s on a tile at {clock / 1e3:.0f} kHz:")
+    for max_delay, max_jobs in [(0., 1), (0., 64), (5e-3, 64), (20e-3, 64), (100e-3, 64)]:
+        _, stats, t = asyncio.run(serve(ModelTile(clock), jobs, rate, max_delay, max_jobs, check=False))
+        print(f"  delay {1e3 * max_delay:3.0f} ms, up to {max_jobs:2d} jobs: {len(jobs) / t:.0f} jobs/s, {stats}")
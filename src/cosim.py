@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# %%  Lockstep co-simulation of the DUT against the Python tile model
+# model.Tile is stepped with the same ui_in, uio_in as the DUT every cycle,
+# and checked on the falling edge (where test.py samples) before the inputs
+# change, so a mismatch stops the test on the cycle it happens, not when some
+# later block's outputs come out wrong.  It stops on the first divergence with
+# every signal that differs and the cycles leading up to it.
+# Each set of pins test.py drives (the tb, or each tile of multitb) gets its own
+# model, from its first cycle after reset.  gridtb isn't driven through test.py
+# a tile at a time, so it isn't checked.
+# Set from the environment, e.g. make SIM=verilator COSIM=regs
+#   COSIM=pins   - uo_out, uio_out
+#   COSIM=regs   - and the registers: count, in/out buffers, C0-C3, pipeline
+#                  (not with GATES=yes, the netlist has no register names)
+#   COSIM_HISTORY=N  - cycles of inputs/outputs to show before a divergence
+import os
+from collections import deque
+
+from model import Tile
+
+COSIM = os.environ.get("COSIM", "")
+COSIM_HISTORY = int(os.environ.get("COSIM_HISTORY", 8))
+assert COSIM in ("", "pins", "regs"), f"COSIM={COSIM!r}, expected pins or regs"
+
+
+# Model state by RTL register name (in tt_um_machinaut_systolic)
+def registers(tile):
+    (p0, s0), (p1, s1), (p2, s2) = tile.pipe
+    return {
+        "count": tile.count,
+        "col_buf_in": tile.col_buf_in, "col_ctrl_buf_in": tile.col_ctrl_buf_in,
+        "row_buf_in": tile.row_buf_in, "row_ctrl_buf_in": tile.row_ctrl_buf_in,
+        "col_buf_out": tile.col_buf_out, "col_ctrl_buf_out": tile.col_ctrl_buf_out,
+        "row_buf_out": tile.row_buf_out, "row_ctrl_buf_out": tile.row_ctrl_buf_out,
+        "C0": tile.C[0], "C1": tile.C[1], "C2": tile.C[2], "C3": tile.C[3],
+        "Pipe0s": p0, "Pipe0Ss": s0, "Pipe1s": p1, "Pipe1Ss": s1, "Pipe2s": p2, "Pipe2Ss": s2,
+    }
+
+
+# DUT value as hex, or its bits if any are X/Z
+def show(value, width):
+    return f"{value.integer:0{(width + 3) // 4}x}" if value.is_resolvable else value.binstr
+
+
+# First cycle where the DUT and the model disagree, as a table of signals
+class Divergence(AssertionError):
+    def __init__(self, cycle, diffs, history):
+        self.cycle, self.diffs, self.history = cycle, diffs, history
+        lines = [f"DUT diverged from model at cycle {cycle} (block {cycle // 4}, nibble {cycle % 4})",
+                 f"  {'signal':<18} {'dut':>10} {'model':>10}"]
+        lines += [f"  {name:<18} {d:>10} {m:>10}" for name, d, m in diffs]
+        lines += [f"  {'cycle':>7} {'ui_in':>6} {'uio_in':>6} {'uo_out':>6} {'uio_out':>7}"]
+        lines += [f"  {c:>7} {ui:>6} {uio:>6} {uo:>6} {uio_out:>7}" for c, ui, uio, uo, uio_out in history]
+        super().__init__("\n".join(lines))
+
+
+class Lockstep:
+    def __init__(self, dut, regs=False):
+        self.dut, self.tile, self.cycle = dut, Tile(), 0
+        self.history = deque(maxlen=COSIM_HISTORY)
+        self.pins = {"uo_out": dut.uo_out, "uio_out": dut.uio_out}
+        top = dut.tt_um_machinaut_systolic
+        self.regs = {name: getattr(top, name) for name in registers(self.tile)} if regs else {}
+
+    # Check the DUT against the model, then clock both (the caller drives the DUT)
+    def step(self, ui_in, uio_in):
+        uo, uio = self.tile.outputs()
+        expect = {"uo_out": uo, "uio_out": uio}
+        if self.regs:
+            expect.update(registers(self.tile))
+        diffs = []
+        for name, handle in {**self.pins, **self.regs}.items():
+            value = handle.value
+            if not value.is_resolvable or value.integer != expect[name]:
+                width = len(handle)
+                diffs.append((name, show(value, width), f"{expect[name]:0{(width + 3) // 4}x}"))
+        pins = [show(self.dut.uo_out.value, 8), show(self.dut.uio_out.value, 8)]
+        self.history.append((self.cycle, f"{ui_in:02x}", f"{uio_in:02x}", *pins))
+        if diffs:
+            raise Divergence(self.cycle, diffs, list(self.history))
+        self.tile.clock(ui_in, uio_in)
+        self.cycle += 1
+
+
+locksteps = {}  # by the pins they're stepped with
+
+
+# Start every model from reset along with the DUT (called by test.reset)
+def reset(dut):
+    locksteps.clear()
+
+
+# One cycle of inputs about to be driven on pins (the dut, or a multi.py Tile),
+# with the outputs settled
+def step(pins, ui_in, uio_in):
+    if COSIM:
+        if pins not in locksteps:
+            locksteps[pins] = Lockstep(pins, regs=COSIM == "regs")
+        locksteps[pins].step(ui_in, uio_in)
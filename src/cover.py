@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# %%  Functional coverage, and coverage-directed stimulus (see test_coverage)
+# Each bin is one bit of a bitmap, so shards merge by OR:
+#   op:FF:A:B       operand classes (zero/sub/norm/max/inf/nan) per A/B format
+#   prod:FF:R       how the product rounds to FP16, per A/B format
+#   sum:OP:R        how P + C rounds (add or sub of finite non-zero values)
+#   special:P:C     classes of the product and accumulator going into the add
+#   mode:X:Y        block mode transitions (pass/mac/rw0/rw1)
+# Only reachable op/prod bins exist (found by enumerating every FP8 pair), so
+# saturated coverage is 100%.
+#   ./cover.py                              # directed vs blind random, in python
+#   ./cover.py merge -o all.json a.json b.json
+#   ./cover.py report all.json
+import argparse
+import functools
+import hashlib
+import json
+import math
+import random
+from array import array
+
+from fp import E4M3, E5M2, FP16, fma
+
+FMTS = {0: E5M2, 1: E4M3}
+CLASSES16 = ['zero', 'sub', 'norm', 'inf', 'nan']
+MODES = ['pass', 'mac', 'rw0', 'rw1']
+# Read-write accumulator 1 right after a MAC would race the C2/C3 results
+TRANSITIONS = [(x, y) for x in MODES for y in MODES if (x, y) != ('mac', 'rw1')]
+SUMS = [(op, r) for op in ['add', 'sub'] for r in ['exact', 'down', 'up', 'tie_down', 'tie_up']]
+SUMS += [('add', 'overflow'), ('sub', 'cancel')]
+ADDR = {'pass': 0, 'rw0': 6, 'rw1': 7}  # test.py ADDR, MAC uses the format tuple
+
+
+@functools.lru_cache(maxsize=None)
+def decode8(fmt, code):
+    return FMTS[fmt].fromh(f"{code:02x}").f
+
+
+def class8(fmt, code):
+    mag = code & 0x7f
+    if fmt:
+        nan, inf, top, exp = mag == 0x7f, False, 0x7e, mag >> 3
+    else:
+        nan, inf, top, exp = mag > 0x7c, mag == 0x7c, 0x7b, mag >> 2
+    if nan or inf:
+        return 'nan' if nan else 'inf'
+    if mag == 0:
+        return 'zero'
+    return 'sub' if exp == 0 else 'max' if mag == top else 'norm'
+
+
+def class16(code):
+    exp, man = (code >> 10) & 0x1f, code & 0x3ff
+    if exp == 31:
+        return 'nan' if man else 'inf'
+    if exp == 0:
+        return 'sub' if man else 'zero'
+    return 'norm'
+
+
+# How the exact value x rounds to FP16, and the rounded magnitude
+def round16(x):
+    if x != x:
+        return 'nan', x
+    if x == 0:
+        return 'zero', 0.
+    ax = abs(x)
+    if ax == math.inf or ax >= 65520:
+        return 'inf' if ax == math.inf else 'overflow', math.inf
+    e = max(math.frexp(ax)[1] - 1, -14)
+    q = math.ldexp(ax, 10 - e)  # in units of the last place
+    fl = math.floor(q)
+    rem = q - fl
+    up = rem > 0.5 or (rem == 0.5 and fl % 2)
+    v = math.ldexp(fl + up, e - 10)
+    if rem == 0:
+        return 'exact', v
+    if v == 0:
+        return 'underflow', v
+    if rem == 0.5:
+        return 'tie_up' if up else 'tie_down', v
+    return 'up' if up else 'down', v
+
+
+# FP16 code for a value that is exactly representable
+def encode16(v):
+    sig = 0x8000 if math.copysign(1, v) < 0 else 0
+    v = abs(v)
+    if v < 2 ** -14:
+        return sig | int(math.ldexp(v, 24))
+    e = math.frexp(v)[1] - 1
+    return sig | ((e + 15) << 10) | int(math.ldexp(v, 10 - e) - 1024)
+
+
+# Exponent of the lowest set bit of a (finite non-zero) float
+def lsb(v):
+    n, d = abs(v).as_integer_ratio()
+    return ((n & -n).bit_length() - 1) - (d.bit_length() - 1)
+
+
+# Every FP8 pair, packed as (fa << 17 | fb << 16 | a << 8 | b), indexed by
+# op/prod bin, and by the class, lowest set bit and code of the FP16 product
+@functools.lru_cache(maxsize=None)
+def products():
+    index = {}
+    for fa in (0, 1):
+        for fb in (0, 1):
+            for a in range(256):
+                va, ca = decode8(fa, a), class8(fa, a)
+                for b in range(256):
+                    key = (fa << 17) | (fb << 16) | (a << 8) | b
+                    x = va * decode8(fb, b)
+                    r, v = round16(x)
+                    names = [f"op:{fa}{fb}:{ca}:{class8(fb, b)}", f"prod:{fa}{fb}:{r}"]
+                    if v != v:
+                        names.append("pclass:nan")
+                    elif v in (0., math.inf):
+                        names.append("pclass:zero" if v == 0 else "pclass:inf")
+                    else:
+                        code = encode16(math.copysign(v, x))
+                        names += [f"pclass:{class16(code)}", f"lsb:{lsb(v)}", f"p16:{code:04x}"]
+                    for name in names:
+                        index.setdefault(name, array('I')).append(key)
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def bins():
+    names = sorted(n for n in products() if n.startswith(('op:', 'prod:')))
+    names += [f"sum:{op}:{r}" for op, r in SUMS]
+    names += [f"special:{p}:{c}" for p in CLASSES16 for c in CLASSES16]
+    names += [f"mode:{x}:{y}" for x, y in TRANSITIONS]
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def index():
+    return {name: i for i, name in enumerate(bins())}
+
+
+# Identifies the bin layout, so only compatible bitmaps merge
+def signature():
+    return hashlib.sha1("\n".join(bins()).encode()).hexdigest()[:12]
+
+
+def unpack(key):
+    fa, fb, a, b = key >> 17, (key >> 16) & 1, (key >> 8) & 0xff, key & 0xff
+    return FMTS[fa].fromh(f"{a:02x}"), FMTS[fb].fromh(f"{b:02x}")
+
+
+def fmt(x):
+    return 1 if isinstance(x, E4M3) else 0
+
+
+# Sum bin for P + C, or None if the add isn't between finite non-zero values
+def sum_bin(P, C):
+    p, c = int(P.h, 16), int(C.h, 16)
+    if class16(p) not in ('sub', 'norm') or class16(c) not in ('sub', 'norm'):
+        return None
+    op = 'add' if (p >> 15) == (c >> 15) else 'sub'
+    x = P.f + C.f  # exact, both are FP16
+    r = 'cancel' if x == 0 else round16(x)[0]
+    return f"sum:{op}:{r}"
+
+
+class Coverage:
+    def __init__(self, bitmap=0):
+        self.bitmap = bitmap
+
+    def hit(self, name):
+        self.bitmap |= 1 << index()[name]
+
+    def is_hit(self, name):
+        return bool((self.bitmap >> index()[name]) & 1)
+
+    # One FMA, C + A * B, where C is the accumulator going in
+    def sample_fma(self, A, B, C):
+        fa, fb = fmt(A), fmt(B)
+        a, b = int(A.h, 16), int(B.h, 16)
+        self.hit(f"op:{fa}{fb}:{class8(fa, a)}:{class8(fb, b)}")
+        self.hit(f"prod:{fa}{fb}:{round16(decode8(fa, a) * decode8(fb, b))[0]}")
+        P = fma(A, B)
+        self.hit(f"special:{class16(int(P.h, 16))}:{class16(int(C.h, 16))}")
+        s = sum_bin(P, C)
+        if s is not None:
+            self.hit(s)
+
+    def sample_mode(self, prev, mode):
+        self.hit(f"mode:{prev}:{mode}")
+
+    def merge(self, other):
+        self.bitmap |= other.bitmap
+        return self
+
+    @property
+    def hits(self):
+        return bin(self.bitmap).count("1")
+
+    def saturated(self):
+        return self.hits == len(bins())
+
+    def missing(self, prefix=""):
+        return [name for name in bins() if name.startswith(prefix) and not self.is_hit(name)]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"signature": signature(), "bins": len(bins()), "bitmap": f"{self.bitmap:x}"}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+        assert d["signature"] == signature(), f"{path} has a different bin layout"
+        return cls(int(d["bitmap"], 16))
+
+    def __str__(self):
+        groups = {}
+        for name in bins():
+            g = groups.setdefault(name.split(":")[0], [0, 0])
+            g[0] += self.is_hit(name)
+            g[1] += 1
+        s = ", ".join(f"{g} {h}/{n}" for g, (h, n) in groups.items())
+        return f"coverage {self.hits}/{len(bins())} ({100 * self.hits / len(bins()):.1f}%): {s}"
+
+
+# Stimulus biased toward unhit bins, as test.py block sequences
+class Directed:
+    def __init__(self, cov, rs, explore=0.25):
+        self.cov = cov
+        self.rs = rs
+        self.explore = explore
+
+    def random_pair(self):
+        A = self.rs.choice([E5M2, E4M3]).fromh(f"{self.rs.getrandbits(8):02x}")
+        B = self.rs.choice([E5M2, E4M3]).fromh(f"{self.rs.getrandbits(8):02x}")
+        return A, B
+
+    def pick(self, name):
+        keys = products().get(name)
+        return unpack(self.rs.choice(keys)) if keys else None
+
+    # Operands for an FMA into accumulator C, aiming at an unhit bin
+    def pair(self, C):
+        rs = self.rs
+        if rs.random() < self.explore:
+            return self.random_pair()
+        c = int(C.h, 16)
+        targets = self.cov.missing("op:") + self.cov.missing("prod:")
+        targets += [n for n in self.cov.missing("special:") if n.endswith(f":{class16(c)}")]
+        if class16(c) in ('sub', 'norm'):
+            targets += self.cov.missing("sum:")
+        if not targets:
+            return self.random_pair()
+        name = rs.choice(targets)
+        if name.startswith(("op:", "prod:")):
+            return self.pick(name)
+        if name.startswith("special:"):
+            return self.pick(f"pclass:{name.split(':')[1]}") or self.random_pair()
+        return self.sum_pair(name, C) or self.random_pair()
+
+    # Search for operands whose product P makes P + C land in a sum bin
+    def sum_pair(self, name, C):
+        _, op, r = name.split(":")
+        e = max(math.frexp(abs(C.f))[1] - 1, -14)
+        for _ in range(200):
+            if r == 'cancel':
+                AB = self.pick(f"p16:{int(C.h, 16) ^ 0x8000:04x}")
+            elif r.startswith('tie'):  # lowest bit of P is half an ulp of the sum
+                AB = self.pick(f"lsb:{e - 11 + self.rs.randint(0, 1)}")
+            else:
+                AB = self.pick(self.rs.choice(["pclass:norm", "pclass:sub"]))
+            if AB is None:
+                return None
+            A, B = AB
+            # Flip the sign of A to get the add / sub we want
+            same = (A.sig != B.sig) == (C.sig == '1')
+            if same != (op == 'add'):
+                A = type(A).fromh(f"{int(A.h, 16) ^ 0x80:02x}")
+            if sum_bin(fma(A, B), C) == name:
+                return A, B
+        return None
+
+    # An accumulator value to write in, biased toward interesting ones
+    def accum(self):
+        rs = self.rs
+        r = rs.random()
+        if r < 0.1:
+            return FP16.fromh(rs.choice(["0000", "8000", "7c00", "fc00", "7fff", "7bff", "fbff"]))
+        if r < 0.2:
+            return FP16.fromh(f"{(rs.getrandbits(1) << 15) | rs.getrandbits(10):04x}")
+        if r < 0.4:  # a product, so it can cancel
+            return fma(*self.random_pair())
+        return FP16.fromh(f"{(rs.getrandbits(1) << 15) | (rs.randint(1, 30) << 10) | rs.getrandbits(10):04x}")
+
+    # Blocks for a random walk over the block modes, starting and ending with
+    # zero accumulators after a passthrough block (so chunks can be chained)
+    def chunk(self, n=16):
+        rs, cov = self.rs, self.cov
+        zero = FP16.fromf(0.)
+        acc = [zero] * 4
+        blocks, carry = [], {}
+        prev = 'pass'
+
+        def add(mode, block):
+            nonlocal prev
+            cov.sample_mode(prev, mode)
+            block.update(carry)
+            carry.clear()
+            blocks.append(block)
+            prev = mode
+
+        def rw(mode, C=None):
+            i = 0 if mode == 'rw0' else 2
+            C = C or [self.accum(), self.accum()]
+            add(mode, {'a': ADDR[mode], 'ci': C[0].h, 'ri': C[1].h})
+            carry.update({'co': acc[i], 'ro': acc[i + 1]})
+            acc[i], acc[i + 1] = C
+
+        for _ in range(n):
+            options = [y for x, y in TRANSITIONS if x == prev]
+            unhit = [y for y in options if not cov.is_hit(f"mode:{prev}:{y}")]
+            if unhit and rs.random() > self.explore:
+                mode = rs.choice(unhit)
+            else:
+                mode = rs.choices(options, weights=[4 if y == 'mac' else 1 for y in options])[0]
+            if mode == 'pass':
+                add(mode, {'ci': f"{rs.getrandbits(16):04x}", 'ri': f"{rs.getrandbits(16):04x}"})
+            elif mode == 'mac':
+                # C0 = A0 * B0 and C3 = A1 * B1 are independent, so aim both
+                A0, B0 = self.pair(acc[0])
+                A1, B1 = self.pair(acc[3])
+                for (A, B), C in zip([(A0, B0), (A1, B0), (A0, B1), (A1, B1)], acc):
+                    cov.sample_fma(A, B, C)
+                a = (fmt(A0), fmt(A1), fmt(B0), fmt(B1))
+                add(mode, {'a': a, 'ci': A0.h + A1.h, 'ri': B0.h + B1.h})
+                acc = [fma(A0, B0, acc[0]), fma(A1, B0, acc[1]), fma(A0, B1, acc[2]), fma(A1, B1, acc[3])]
+            else:
+                rw(mode)
+        # Read out (and zero) the accumulators
+        rw('rw0', [zero, zero])
+        rw('rw1', [zero, zero])
+        add('pass', {})
+        return blocks
+
+
+# Chunks until saturated, or nothing new for patience chunks
+def run(gen, max_chunks, patience=20):
+    chunks = stale = 0
+    while chunks < max_chunks and not gen.cov.saturated() and stale < patience:
+        before = gen.cov.hits
+        gen.chunk()
+        chunks += 1
+        stale = 0 if gen.cov.hits > before else stale + 1
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="functional coverage bitmaps")
+    sub = parser.add_subparsers(dest="cmd")
+    m = sub.add_parser("merge", help="merge coverage shards")
+    m.add_argument("-o", "--output", required=True)
+    m.add_argument("shards", nargs="+")
+    r = sub.add_parser("report", help="show coverage and missing bins")
+    r.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd is None:  # directed vs blind random, no simulator needed
+        for explore in [1.0, 0.25]:
+            gen = Directed(Coverage(), random.Random(0), explore=explore)
+            n = run(gen, 300, patience=300)
+            print(f"{'random' if explore == 1 else 'directed'}: {n} chunks, {gen.cov}")
+            print(f"  missing {gen.cov.missing()[:10]}")
+        return
+    cov = Coverage()
+    for path in (args.shards if args.cmd == "merge" else args.files):
+        cov.merge(Coverage.load(path))
+    print(cov)
+    if args.cmd == "merge":
+        cov.save(args.output)
+    else:
+        for name in cov.missing():
+            print(f"  missing {name}")
+
+
+if __name__ == "__main__":
+    main()
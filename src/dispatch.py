@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# %%  Run a GEMM across several tile devices at once
+# C + A * B (FP8 codes, FP16 codes for C, like emulate.py) is split into 2x2
+# blocks of C, each a 2xK * Kx2 job for one tile.  Chunks of jobs are packed
+# into block streams (tilesched.schedule) and handed to whichever device is free,
+# with up to depth streams in flight on each so none of them waits on the
+# host, and the read-outs are put back together into C.
+# A device (backend) is anything with async run(blocks) -> blocks, in and out
+# as (col, col_ctrl, row, row_ctrl) like model.run_blocks, and async close():
+#   batch.ModelTile  the Python tile model, in this process
+#   ProcessTile      a separate process speaking JSON lines on stdin/stdout,
+#                    by default this file with --serve (the Python model), but
+#                    a simulator or a board behind a serial link can stand in
+#   ./dispatch.py                  # check against the emulation, time 1-4 processes
+#   ./dispatch.py --serve          # be a device on stdin/stdout
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from batch import ModelTile, readouts
+from fp import FP16
+from gemm import Job
+from model import Tile, run_blocks
+from quant import fp8s
+from tilesched import schedule, tile_stream
+from weights import pad
+
+
+# A device in another process: each call writes one line of blocks, and the
+# replies come back one line each, in order, so several can be in flight.
+# Once the process has exited (or said something out of turn) every call fails.
+class ProcessTile:
+    def __init__(self, cmd=None):
+        self.cmd = cmd or [sys.executable, os.path.abspath(__file__), "--serve"]
+        self.proc = None
+        self.replies = []  # futures for requests in flight, oldest first
+        self.error = None  # why the replies stopped, once they have
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.lock:
+            if self.proc is None:
+                self.proc = await asyncio.create_subprocess_exec(*self.cmd, stdin=asyncio.subprocess.PIPE,
+                                                                 stdout=asyncio.subprocess.PIPE, limit=2**26)
+                self.error = None
+                self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        try:
+            while line := await self.proc.stdout.readline():
+                if not self.replies:
+                    raise RuntimeError(f"{self.cmd} replied with nothing in flight: {line[:80]!r}")
+                self.replies.pop(0).set_result([tuple(b) for b in json.loads(line)])
+            error = EOFError(f"{self.cmd} exited with {await self.proc.wait()}")
+        except Exception as e:  # out of step with the requests from here on
+            if self.proc.returncode is None:
+                self.proc.kill()
+            error = e
+        self.error = error
+        for future in self.replies:
+            future.set_exception(error)
+        self.replies.clear()
+
+    async def run(self, blocks):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        async with self.lock:  # requests go out whole, in the order replies come back
+            if self.error is not None:
+                raise self.error
+            self.replies.append(future)
+            self.proc.stdin.write(json.dumps(blocks).encode() + b"\n")
+            try:
+                await self.proc.stdin.drain()
+            except ConnectionError:  # it's gone, and read() fails the future with why
+                pass
+        return await future
+
+    async def close(self):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            await self.proc.wait()
+            await self.reader
+            self.proc = None
+
+
+# The other end of ProcessTile, with the Python model
+def serve(inp=sys.stdin, out=sys.stdout):
+    tile = Tile()
+    for line in inp:
+        out.write(json.dumps(run_blocks(tile, [tuple(b) for b in json.loads(line)])) + "\n")
+        out.flush()
+
+
+@dataclass
+class DeviceStats:
+    name: str
+    streams: int = 0
+    jobs: int = 0
+    blocks: int = 0
+    first: float = None  # perf_counter when the first stream went in
+    last: float = None  # and the last one came out
+
+    @property
+    def seconds(self):
+        return self.last - self.first if self.streams else 0.
+
+    def __str__(self):
+        return (f"{self.name}: {self.jobs} jobs in {self.streams} streams, {self.blocks} blocks,"
+                f" {self.blocks / self.seconds if self.seconds else 0.:.0f} blocks/s")
+
+
+# The 2x2 jobs of C + A * B, padded to even sizes, as ((i, j), gemm.Job)
+def split(A, B, C=None, a_fmt=0, b_fmt=0):
+    (Ap, fa), (Bp, fb) = pad(A, a_fmt, 2, 0), pad(B, b_fmt, 2, 1)
+    Cp = np.zeros((len(Ap), Bp.shape[1]), dtype=np.uint16)
+    if C is not None:
+        Cp[:len(A), :B.shape[1]] = C
+    fp16 = lambda x: [[FP16.fromh(f"{v:04x}") for v in row] for row in x]
+    return [((i, j), Job(fp8s(Ap[i:i + 2], fa[i:i + 2]), fp8s(Bp[:, j:j + 2], fb[:, j:j + 2]),
+                         fp16(Cp[i:i + 2, j:j + 2]) if C is not None else None))
+            for i in range(0, len(Ap), 2) for j in range(0, Bp.shape[1], 2)]
+
+
+# C + A * B as FP16 codes, chunk jobs to a stream, across the devices with up
+# to depth streams in flight on each.  With check, every read-out is checked
+# against the golden C (which is slow, see gemm.grid_streams).
+async def dispatch(devices, A, B, C=None, a_fmt=0, b_fmt=0, chunk=8, depth=2, check=False):
+    M, N = len(A), np.shape(B)[1]
+    jobs = split(A, B, C, a_fmt, b_fmt)
+    out = np.zeros((M + M % 2, N + N % 2), dtype=np.uint16)
+    queue = asyncio.Queue()
+    for n in range(0, len(jobs), chunk):
+        queue.put_nowait(jobs[n:n + chunk])
+    stats = [DeviceStats(f"{type(d).__name__} {n}") for n, d in enumerate(devices)]
+
+    async def worker(device, s):
+        while not queue.empty():
+            batch = queue.get_nowait()
+            sched = schedule([job for _, job in batch], expected=check)
+            s.first = s.first or time.perf_counter()
+            results = readouts(sched, [job for _, job in batch], await device.run(tile_stream(sched.blocks)))
+            s.last = time.perf_counter()
+            s.streams, s.jobs, s.blocks = s.streams + 1, s.jobs + len(batch), s.blocks + sched.stream_blocks
+            for ((i, j), _), res, ref in zip(batch, results, sched.results):
+                if check:
+                    assert all(a.h == b.h for x, y in zip(res, ref) for a, b in zip(x, y)), (i, j, res, ref)
+                out[i:i + 2, j:j + 2] = [[int(v.h, 16) for v in row] for row in res]
+
+    await asyncio.gather(*(worker(d, s) for d, s in zip(devices, stats) for _ in range(depth)))
+    return out[:M, :N], stats
+
+
+async def main(args):
+    from emulate import emulate_matmul, random8
+
+    rs = np.random.default_rng(0)
+    # Same C as the emulation on any mix of devices, checked against golden
+    for devices in [[ModelTile()], [ModelTile(), ProcessTile()], [ProcessTile() for _ in range(3)]]:
+        M, K, N = (int(x) for x in rs.integers(1, 12, size=3))
+        A, a_fmt = random8(rs, (M, K))
+        B, b_fmt = random8(rs, (K, N))
+        C = rs.integers(0, 2**16, size=(M, N), dtype=np.uint16)
+        got, _ = await dispatch(devices, A, B, C, a_fmt, b_fmt, chunk=3, check=True)
+        assert (got == emulate_matmul(A, B, C, a_fmt, b_fmt)).all()
+        for d in devices:
+            if isinstance(d, ProcessTile):
+                await d.close()
+    print("C matches the emulation on any mix of devices")
+    # A device that exits, or replies out of turn, fails what's in flight and every call after
+    for cmd in ["import sys; sys.stdin.readline(); sys.exit(3)", "print('[]'); import time; time.sleep(10)"]:
+        d = ProcessTile([sys.executable, "-c", cmd])
+        await d.start()
+        await asyncio.sleep(0.5)  # for the reply out of turn to come before any request
+        for _ in range(2):
+            try:
+                await asyncio.wait_for(d.run([(0, "0000", 0, "0000")]), 5)
+            except (EOFError, RuntimeError) as e:
+                print(f"  {type(e).__name__}: {e}")
+            else:
+                raise AssertionError(f"{cmd} ran")
+        await d.close()
+    # Throughput on 1 to 4 processes
+    M, K, N = args.shape
+    A, a_fmt = random8(rs, (M, K))
+    B, b_fmt = random8(rs, (K, N))
+    ref = emulate_matmul(A, B, None, a_fmt, b_fmt)
+    for n in args.processes:
+        devices = [ProcessTile() for _ in range(n)]
+        for d in devices:
+            await d.start()
+        t = time.perf_counter()
+        got, stats = await dispatch(devices, A, B, None, a_fmt, b_fmt, args.chunk, args.depth)
+        t = time.perf_counter() - t
+        assert (got == ref).all()
+        for d in devices:
+            await d.close()
+        blocks = sum(s.blocks for s in stats)
+        print(f"{M}x{K} * {K}x{N} on {n} processes: {t:.2f} s, {blocks / t:.0f} blocks/s")
+        for s in stats:
+            print(f"  {s}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a GEMM across several tile devices")
+    parser.add_argument("shape", type=int, nargs="*", default=[32, 64, 32], help="M K N to time")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="devices to time on")
+    parser.add_argument("--chunk", type=int, default=8, help="jobs per stream")
+    parser.add_argument("--depth", type=int, default=2, help="streams in flight per device")
+    parser.add_argument("--serve", action="store_true", help="be a device on stdin/stdout")
+    args = parser.parse_args()
+    if args.serve:
+        serve()
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,85 @@
+// Waveform dumping for the Verilator builds of tb.v / pipetb.v, switched by dump_en
+// Verilator ignores $dumpon/$dumpoff, so the testbenches call dump_switch instead,
+// which keeps its own dumper through the public VerilatedContext::trace and dumps
+// once each time step has settled (the VPI read-only callback), only while on.
+// Without tracing compiled in (DUMP=none) it does nothing.
+#include "svdpi.h"
+#include "verilated.h"
+#include "verilated_vpi.h"
+
+#if VM_TRACE
+#include <memory>
+#include <string>
+
+#if VM_TRACE_FST
+#include "verilated_fst_c.h"
+using Dumper = VerilatedFstC;
+#else
+#include "verilated_vcd_c.h"
+using Dumper = VerilatedVcdC;
+#endif
+
+static std::unique_ptr<Dumper> dumper;
+static bool dumping = false;  // between dump_switch on and off
+static bool scheduled = false;  // a read-only callback is coming for this or the next step
+
+static void at(PLI_INT32 reason, PLI_INT32 (*routine)(p_cb_data)) {
+    s_vpi_time time{vpiSimTime, 0, 0, 0};
+    s_cb_data cb{};
+    cb.reason = reason;
+    cb.cb_rtn = routine;
+    cb.time = &time;
+    vpi_release_handle(vpi_register_cb(&cb));
+}
+
+static PLI_INT32 settled(p_cb_data);
+
+static PLI_INT32 next_step(p_cb_data) {
+    at(cbReadOnlySynch, settled);
+    return 0;
+}
+
+// Dump this time step, and come back for the next one while still on
+static PLI_INT32 settled(p_cb_data) {
+    scheduled = false;
+    if (!dumping) return 0;
+    s_vpi_time time{vpiSimTime, 0, 0, 0};
+    vpi_get_time(nullptr, &time);
+    dumper->dump((uint64_t(time.high) << 32) | time.low);
+    at(cbNextSimTime, next_step);
+    scheduled = true;
+    return 0;
+}
+
+// Close it while the model is still there
+static PLI_INT32 finish(p_cb_data) {
+    dumping = false;
+    if (dumper) dumper->close();
+    dumper.reset();
+    return 0;
+}
+
+// The first time on opens the file (.vcd instead of .fst if that's what's compiled in)
+extern "C" void dump_switch(const char* file, svBit on) {
+    Verilated::traceEverOn(true);
+    if (on && !dumper) {
+        std::string name{file};
+#if !VM_TRACE_FST
+        if (name.size() > 4 && name.compare(name.size() - 4, 4, ".fst") == 0)
+            name.replace(name.size() - 4, 4, ".vcd");
+#endif
+        dumper.reset(new Dumper);
+        Verilated::threadContextp()->trace(dumper.get(), 99);
+        dumper->open(name.c_str());
+        at(cbEndOfSimulation, finish);
+    }
+    if (on && !scheduled) {
+        at(cbReadOnlySynch, settled);
+        scheduled = true;
+    }
+    if (!on && dumping) dumper->flush();
+    dumping = on && dumper != nullptr;
+}
+#else
+extern "C" void dump_switch(const char*, svBit) {}
+#endif
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# %%  Bit-exact emulation of the tile arithmetic over whole numpy matrices
+# Every output is fp.fma applied in order of K, like mul22 in test.py:
+#   C = FP16(FP16(A[i, k] * B[k, j]) + C)  for k = 0 .. K-1
+# FP8 products are exact in float32 and FP16 sums are exact in float64, so
+# numpy's (round to nearest even) casts to float16 round exactly once, like
+# FP16.fromf.  NaNs come out as the hardware's 7fff.  Vectorized across all
+# the outputs, only the K steps are sequential (this one needs numpy).
+# emulate_npy does the same out of core, on memory mapped .npy files.
+#   ./emulate.py                   # check against fp.fma
+#   ./emulate.py 1024 1024 1024    # time an M x K * K x N matmul
+#   ./emulate.py --npy A.npy B.npy C.npy --panel 256   # C = A * B, out of core
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from fp import E4M3, E5M2, FP16, fma
+
+# FP8 code to value, for each format (0 = E5M2, 1 = E4M3, like the ctrl bits)
+FP8 = np.array([[cls.fromh(f"{i:02x}").f for i in range(256)] for cls in (E5M2, E4M3)], dtype=np.float32)
+NAN16 = np.uint16(0x7fff)
+
+
+# Values of FP8 codes, fmt is 0 (E5M2) or 1 (E4M3), or an array of them
+def decode8(codes, fmt=0):
+    return FP8[np.asarray(fmt, dtype=np.intp), np.asarray(codes, dtype=np.uint8)]
+
+
+# FP16 codes to values and back
+def decode16(codes):
+    return np.asarray(codes, dtype=np.uint16).view(np.float16)
+
+
+def encode16(x):
+    codes = np.asarray(x, dtype=np.float16).view(np.uint16).copy()
+    codes[np.isnan(x)] = NAN16
+    return codes
+
+
+# Values rounded to FP8 codes, like E5M2.fromf / E4M3.fromf: nearest, ties to
+# even, E5M2 overflows to inf and E4M3 saturates at 448, NaN is 7f.  fmt is
+# 0 (E5M2) or 1 (E4M3), or an array of them.
+def encode8(x, fmt=0):
+    x = np.asarray(x)
+    mag = np.abs(x).astype(np.float64)
+    out = []
+    for f, top, over in [(0, 0x7b, 61440.), (1, 0x7e, 448.)]:  # top is the largest finite code
+        vals = FP8[f, :top + 1].astype(np.float64)
+        hi = np.clip(np.searchsorted(vals, mag), 1, top)
+        lo = hi - 1
+        with np.errstate(invalid='ignore'):  # inf - inf, overflows anyway
+            dlo, dhi = mag - vals[lo], vals[hi] - mag
+        code = np.where((dhi < dlo) | ((dhi == dlo) & (hi % 2 == 0)), hi, lo)
+        out.append(np.where(mag >= over, 0x7c if f == 0 else 0x7e, code))
+    code = np.where(np.asarray(fmt, dtype=bool), out[1], out[0]) | (np.signbit(x) << 7)
+    return np.where(np.isnan(x), 0x7f, code).astype(np.uint8)
+
+
+# FP16 codes requantized to FP8 codes
+def quantize8(codes, fmt=0):
+    return encode8(decode16(codes), fmt)
+
+
+# Accumulate a (M x K values) * b (K x N values) into acc (M x N float16), in
+# place, one K step at a time
+def accumulate(acc, a, b):
+    P = np.empty(acc.shape, dtype=np.float32)
+    S = np.empty(acc.shape, dtype=np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):  # NaN and inf are expected
+        for k in range(a.shape[1]):
+            np.multiply(a[:, k, None], b[None, k, :], out=P)
+            np.add(P.astype(np.float16), acc, out=S, dtype=np.float64)
+            acc[...] = S
+    return acc
+
+
+# C + A * B for FP8 codes A (M x K) and B (K x N) and FP16 codes C (M x N),
+# returns the FP16 codes the tiles would read out.  a_fmt and b_fmt are 0 for
+# E5M2 or 1 for E4M3, for the whole matrix or per element.
+def emulate_matmul(A, B, C=None, a_fmt=0, b_fmt=0):
+    A, B = np.asarray(A, dtype=np.uint8), np.asarray(B, dtype=np.uint8)
+    (M, K), (K2, N) = A.shape, B.shape
+    assert K == K2, f"A is {M}x{K} but B is {K2}x{N}"
+    if C is None:
+        acc = np.zeros((M, N), dtype=np.float16)
+    else:
+        assert np.shape(C) == (M, N), f"C is {np.shape(C)}, not {M}x{N}"
+        acc = decode16(C).copy()
+    if K == 0:  # nothing to do, C comes back out as it went in
+        return acc.view(np.uint16)
+    return encode16(accumulate(acc, decode8(A, a_fmt), decode8(B, b_fmt)))
+
+
+# Out of core: A and B (and C, and formats that are per element) are .npy
+# files, memory mapped and read in panel x panel blocks, and the result is
+# written to a memory mapped .npy at out_path.  Each output panel accumulates
+# over K a block at a time, so outputs still see K in order, and the working
+# memory is a few panel x panel arrays whatever the size of the matrices.
+def emulate_npy(a_path, b_path, out_path, c_path=None, a_fmt=0, b_fmt=0, panel=256):
+    load = lambda x: np.load(x, mmap_mode='r') if isinstance(x, (str, os.PathLike)) else x
+    A, B, C, a_fmt, b_fmt = load(a_path), load(b_path), load(c_path), load(a_fmt), load(b_fmt)
+    (M, K), (K2, N) = A.shape, B.shape
+    assert K == K2, f"A is {M}x{K} but B is {K2}x{N}"
+    assert C is None or C.shape == (M, N), f"C is {C.shape}, not {M}x{N}"
+    block = lambda x, i, j: x if np.ndim(x) == 0 else x[i:i + panel, j:j + panel]
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint16, shape=(M, N))
+    for i in range(0, M, panel):
+        for j in range(0, N, panel):
+            if C is None:
+                acc = np.zeros(out[i:i + panel, j:j + panel].shape, dtype=np.float16)
+            else:
+                acc = decode16(C[i:i + panel, j:j + panel]).copy()
+            for k in range(0, K, panel):
+                accumulate(acc, decode8(block(A, i, k), block(a_fmt, i, k)),
+                           decode8(block(B, k, j), block(b_fmt, k, j)))
+            out[i:i + panel, j:j + panel] = encode16(acc) if K else acc.view(np.uint16)
+    out.flush()
+    return out
+
+
+# Random FP8 codes, mostly in range but with all the special ones
+def random8(rs, shape):
+    codes = rs.integers(0, 256, size=shape, dtype=np.uint8)
+    fmt = rs.integers(0, 2, size=shape)
+    # Mostly exponents around 1, so sums stay interesting
+    exp = rs.integers(-3, 3, size=shape) + np.where(fmt, 7, 15)
+    man = rs.integers(0, 8, size=shape)
+    small = (codes & 0x80) | np.where(fmt, (exp << 3) | man, (exp << 2) | (man & 3))
+    codes = np.where(rs.random(shape) < 0.8, small, codes).astype(np.uint8)
+    return codes, fmt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="check or time emulate_matmul")
+    parser.add_argument("shape", type=int, nargs="*", help="M K N to time")
+    parser.add_argument("--npy", nargs=3, metavar=("A", "B", "OUT"), help="out of core, from .npy files")
+    parser.add_argument("--c", default=None, help=".npy of FP16 codes to accumulate onto")
+    parser.add_argument("--a-fmt", default=0, help="0 (E5M2), 1 (E4M3), or a .npy per element")
+    parser.add_argument("--b-fmt", default=0, help="0 (E5M2), 1 (E4M3), or a .npy per element")
+    parser.add_argument("--panel", type=int, default=256)
+    args = parser.parse_args()
+    rs = np.random.default_rng(0)
+    if args.npy:
+        fmt = lambda f: int(f) if str(f) in "01" else f
+        t = time.perf_counter()
+        out = emulate_npy(*args.npy, args.c, fmt(args.a_fmt), fmt(args.b_fmt), args.panel)
+        print(f"wrote {out.shape[0]}x{out.shape[1]} to {args.npy[2]} in {time.perf_counter() - t:.2f} s")
+    elif args.shape:
+        M, K, N = args.shape
+        A = rs.integers(0, 256, size=(M, K), dtype=np.uint8)
+        B = rs.integers(0, 256, size=(K, N), dtype=np.uint8)
+        t = time.perf_counter()
+        emulate_matmul(A, B, a_fmt=0, b_fmt=1)
+        t = time.perf_counter() - t
+        print(f"{M}x{K} * {K}x{N}: {t:.2f} s, {M * N * K / t / 1e6:.1f} MMAC/s")
+    else:
+        # Every FP8 pair, one K step onto a random C, with a quarter of the
+        # A codes in each combination of formats
+        codes = np.arange(256, dtype=np.uint8)
+        cls = {0: E5M2, 1: E4M3}
+        for n, (af, bf) in enumerate([(0, 0), (0, 1), (1, 0), (1, 1)]):
+            C = rs.integers(0, 2**16, size=(256, 256), dtype=np.uint16)
+            got = emulate_matmul(codes[:, None], codes[None, :], C, af, bf)
+            for i in range(n, 256, 4):
+                A = cls[af].fromh(f"{i:02x}")
+                ref = [int(fma(A, cls[bf].fromh(f"{j:02x}"), FP16.fromh(f"{C[i, j]:04x}")).h, 16) for j in range(256)]
+                assert (got[i] == ref).all(), (af, bf, i)
+        print("every FP8 pair matches fp.fma")
+        # Requantizing every FP16 code to each FP8 format
+        codes = np.arange(2**16, dtype=np.uint16)
+        for f in cls:
+            ref = [int(cls[f].fromf(FP16.fromh(f"{c:04x}").f).h, 16) for c in range(2**16)]
+            assert (quantize8(codes, f) == ref).all(), cls[f]
+        print("every FP16 code requantizes like fromf")
+        # Random matmuls, mixed formats per element, against K steps of fp.fma
+        for _ in range(20):
+            M, K, N = rs.integers(1, 9, size=3)
+            A, a_fmt = random8(rs, (M, K))
+            B, b_fmt = random8(rs, (K, N))
+            C = np.array([[int(FP16.fromf(float(v)).h, 16) for v in row] for row in rs.normal(0, 4, (M, N))],
+                         dtype=np.uint16)
+            got = emulate_matmul(A, B, C, a_fmt, b_fmt)
+            for i in range(M):
+                for j in range(N):
+                    acc = FP16.fromh(f"{C[i, j]:04x}")
+                    for k in range(K):
+                        a = (E4M3 if a_fmt[i, k] else E5M2).fromh(f"{A[i, k]:02x}")
+                        b = (E4M3 if b_fmt[k, j] else E5M2).fromh(f"{B[k, j]:02x}")
+                        acc = fma(a, b, acc)
+                    assert got[i, j] == int(acc.h, 16), (i, j, f"{got[i, j]:04x}", acc.h)
+        print("random matmuls match fp.fma")
+        # Out of core gives the same bits, in memory bounded by the panel size
+        with tempfile.TemporaryDirectory() as tmp:
+            path = lambda name: os.path.join(tmp, name)
+            peaks = []
+            for M, K, N in [(100, 70, 90), (400, 280, 360)]:
+                A, a_fmt = random8(rs, (M, K))
+                B, b_fmt = random8(rs, (K, N))
+                C = rs.integers(0, 2**16, size=(M, N), dtype=np.uint16)
+                for name, x in [("A", A), ("B", B), ("C", C), ("a_fmt", a_fmt), ("b_fmt", b_fmt)]:
+                    np.save(path(f"{name}.npy"), x)
+                ref = emulate_matmul(A, B, C, a_fmt, b_fmt)
+                del A, B, C
+                tracemalloc.start()
+                out = emulate_npy(path("A.npy"), path("B.npy"), path("out.npy"), path("C.npy"),
+                                  path("a_fmt.npy"), path("b_fmt.npy"), panel=32)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                assert (np.load(path("out.npy")) == ref).all()
+                del out
+            print(f"out of core matches, peak {peaks[0] / 1e3:.0f} kB and {peaks[1] / 1e3:.0f} kB"
+                  f" for 16x the matrix size")
+            assert peaks[1] < 2 * peaks[0]
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# %%  Analytic throughput and I/O estimates for a tile or a grid of tiles
+# Each tile takes 8 data bits and 2 control bits in (and out) every cycle, in
+# 4 cycle blocks, and a MAC block does 4 MACs, so a tile peaks at 1 MAC/cycle.
+# A GEMM of A (M x K) * B (K x N) + C runs as panels of 2*COLS x 2*ROWS outputs
+# (zero padded, see gemm.py), each K MAC blocks and then W = max(ROWS, COLS)
+# waves of each read-write block, which read it out and write in the next C:
+#   blocks = panels * (K + 2W)  (+ 2W to write in the first C)
+# With K split into S chunks (read out separately and summed on the host, see
+# ksplit.py) every panel is read out S times, 2W * S blocks instead of 2W.
+#   cycles = 4 * (blocks + ROWS + COLS - 1)  (skewed in and out of the grid)
+#   ./estimate.py 64 64 256 --grid 1x1 2x2 4x4
+#   ./estimate.py --check      # against cycle counts measured on model.py
+import argparse
+import math
+import os
+import random
+import re
+from dataclasses import dataclass
+
+INFO_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "info.yaml")
+
+
+# Clock frequency from info.yaml (project: clock_hz)
+def clock_hz(path=INFO_YAML):
+    with open(path) as f:
+        for line in f:
+            m = re.match(r"\s*clock_hz:\s*(\d+)", line)
+            if m:
+                return int(m.group(1))
+    raise ValueError(f"no clock_hz in {path}")
+
+
+@dataclass
+class Estimate:
+    M: int
+    N: int
+    K: int
+    rows: int
+    cols: int
+    C: bool  # write in C (otherwise the first panel starts from zero)
+    clock_hz: int
+    splits: int = 1  # chunks K is split into, each read out separately
+
+    @property
+    def panels(self):
+        return math.ceil(self.M / (2 * self.cols)) * math.ceil(self.N / (2 * self.rows))
+
+    @property
+    def mac_blocks(self):
+        return self.panels * self.K
+
+    # Read-write blocks, reading out every panel and writing in the next
+    @property
+    def io_blocks(self):
+        return 2 * max(self.rows, self.cols) * (self.panels * self.splits + self.C)
+
+    # Blocks before the last one comes out of the far corner of the grid
+    @property
+    def fill_blocks(self):
+        return self.rows + self.cols - 1
+
+    @property
+    def blocks(self):
+        return self.mac_blocks + self.io_blocks
+
+    @property
+    def cycles(self):
+        return 4 * (self.blocks + self.fill_blocks)
+
+    @property
+    def seconds(self):
+        return self.cycles / self.clock_hz
+
+    # Useful MACs (not the zero padding)
+    @property
+    def macs(self):
+        return self.M * self.N * self.K
+
+    @property
+    def macs_per_s(self):
+        return self.macs / self.seconds
+
+    @property
+    def utilization(self):
+        return self.macs / (self.cycles * self.rows * self.cols)
+
+    # Shares of the cycles spent on each
+    @property
+    def compute_share(self):
+        return self.mac_blocks / (self.blocks + self.fill_blocks)
+
+    @property
+    def io_share(self):
+        return self.io_blocks / (self.blocks + self.fill_blocks)
+
+    @property
+    def fill_share(self):
+        return self.fill_blocks / (self.blocks + self.fill_blocks)
+
+    # Bits per second through the north and west edges (each way), data and
+    # control, which the host has to sustain to keep every tile busy
+    @property
+    def edge_bps(self):
+        return 5 * (self.rows + self.cols) * self.clock_hz
+
+    # Data reuse: MACs per operand byte streamed in.  Each A value is used by
+    # the 2 * ROWS MACs along its column, each B value by 2 * COLS.
+    @property
+    def reuse(self):
+        return self.macs / (2 * (self.rows + self.cols) * self.mac_blocks)
+
+    def __str__(self):
+        return (f"{self.rows}x{self.cols}  {self.cycles:10d} cycles {self.seconds * 1e3:9.3f} ms"
+                f"  {self.macs_per_s / 1e6:8.1f} MMAC/s {100 * self.utilization:5.1f}%"
+                f"  compute {100 * self.compute_share:5.1f}% acc I/O {100 * self.io_share:5.1f}%"
+                f" fill {100 * self.fill_share:5.1f}%"
+                f"  edge {self.edge_bps / 8e6:6.1f} MB/s  reuse {self.reuse:5.2f} MAC/B")
+
+
+def estimate(M, N, K, rows=1, cols=1, C=True, clock=None, splits=1):
+    return Estimate(M, N, K, rows, cols, C, clock or clock_hz(), splits)
+
+
+# Run grid streams through the model (like grid.py run_grid), check every
+# block out of the edges, and return the cycles until the last read-out
+def measure(s):
+    from fp import FP16
+    from gemm import same
+    from model import Grid
+
+    grid = Grid(s.rows, s.cols)
+    col_in = [[(0, '0000')] * c + stream for c, stream in enumerate(s.col_in)]
+    row_in = [[(0, '0000')] * r + stream for r, stream in enumerate(s.row_in)]
+    nibble = lambda stream, b, j: ((stream[b][0] >> (4 * (3 - j))) & 0xf, int(stream[b][1][j])) \
+        if b < len(stream) else (0, 0)
+    seen = []
+    for b in range(s.blocks + s.rows + s.cols + 1):
+        for j in range(4):
+            seen.append(grid.cycle([nibble(x, b, j) for x in col_in], [nibble(x, b, j) for x in row_in]))
+    # Unskew, logical block L of column c comes out at block L + c + rows
+    for edge, streams, skew in [(0, s.col_out, s.rows), (1, s.row_out, s.cols)]:
+        for i, stream in enumerate(streams):
+            for L, (want, want_ctrl) in enumerate(stream):
+                cycles = [out[edge][i] for out in seen[4 * (L + i + skew):4 * (L + i + skew + 1)]]
+                data = sum(nib << (4 * (3 - j)) for j, (nib, _) in enumerate(cycles))
+                ctrl = ''.join(str(c) for _, c in cycles)
+                ok = same(FP16.fromh(f"{data:04x}"), want) if isinstance(want, FP16) else data == want
+                assert ok and ctrl == want_ctrl, f"edge {edge}.{i} block {L}: {data:04x}/{ctrl} {want}/{want_ctrl}"
+    # Read-outs are the only blocks leaving the south edge with control 1xxx
+    last = max(t for t, (south, _) in enumerate(seen) if t % 4 == 0 and any(c for _, c in south))
+    return last + 4
+
+
+# Estimates match the cycles measured on the model for random shapes and grids
+def check(n=100, seed=0):
+    from gemm import grid_streams, random_job
+
+    rs = random.Random(seed)
+    for _ in range(n):
+        rows, cols = rs.randint(1, 3), rs.randint(1, 3)
+        M, N, K = rs.randint(1, 3 * 2 * cols), rs.randint(1, 3 * 2 * rows), rs.randint(1, 8)
+        C, splits = rs.random() < 0.5, rs.randint(1, min(K, 3))
+        e = estimate(M, N, K, rows, cols, C, splits=splits)
+        chunks = [K // splits + (i < K % splits) for i in range(splits)]
+        jobs = [random_job(rs, 2 * cols, 2 * rows, k, C=C) for _ in range(e.panels) for k in chunks]
+        s = grid_streams(jobs, rows, cols)
+        assert (s.blocks, s.mac_blocks) == (e.blocks, e.mac_blocks), (e, s.blocks, s.mac_blocks)
+        cycles = measure(s)
+        assert cycles == e.cycles, f"{e}: measured {cycles} cycles"
+    print(f"{n} estimates match the cycles measured on the model")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="estimate GEMM throughput on a tile or grid")
+    parser.add_argument("shape", type=int, nargs="*", help="M N K, for A (M x K) * B (K x N)")
+    parser.add_argument("--grid", nargs="+", default=["1x1"], help="ROWSxCOLS, one or more")
+    parser.add_argument("--no-c", action="store_true", help="start from C = 0")
+    parser.add_argument("--clock", type=int, default=None, help="Hz, defaults to info.yaml")
+    parser.add_argument("--splits", type=int, default=1, help="chunks K is split into")
+    parser.add_argument("--check", action="store_true", help="check against model.py")
+    args = parser.parse_args()
+    if args.check:
+        return check()
+    M, N, K = args.shape or (64, 64, 256)
+    clock = args.clock or clock_hz()
+    print(f"{M}x{K} * {K}x{N}{'' if args.no_c else ' + C'} at {clock / 1e6:g} MHz")
+    for g in args.grid:
+        rows, cols = (int(x) for x in g.split("x"))
+        print(estimate(M, N, K, rows, cols, not args.no_c, clock, args.splits))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# %%  GEMMs on a grid of tiles, as streams of blocks on the grid edges
+#
+# A ROWS x COLS grid computes C = A * B + C where A is M x K, B is K x N, and
+# M = 2 * COLS, N = 2 * ROWS (A goes down the columns, B goes along the rows).
+# Grid column c streams rows 2c, 2c+1 of A, grid row r streams columns 2r, 2r+1
+# of B, and tile (r, c) accumulates (following mul22 in test.py):
+#   C0 = C[2c][2r]  C1 = C[2c+1][2r]  C2 = C[2c][2r+1]  C3 = C[2c+1][2r+1]
+#
+# Everything is written as one logical sequence of blocks per column and row.
+# Logical block t goes in the north edge of column c at block t + c, and the
+# west edge of row r at block t + r, so every tile sees the same logical block
+# from both sides (at block t + r + c).  It comes out of the south edge of
+# column c at block t + c + ROWS and the east edge of row r at t + r + COLS.
+#
+# Accumulators are read out and written in together by "swap" waves: each
+# read-write block shifts every C0 (C2) one tile south and every C1 (C3) one
+# tile east, so max(ROWS, COLS) waves of accumulator 0 then accumulator 1
+# read out the whole grid while shifting in the next C.
+import random
+from dataclasses import dataclass
+
+from fp import E4M3, E5M2, FP16, fma
+
+# Control bits (col_ctrl, row_ctrl) for each kind of block, see README.md Modes
+PASS = ('0000', '0000')
+RW0 = ('1000', '0100')
+RW1 = ('1100', '0000')
+
+
+def fmt(x):
+    return '1' if isinstance(x, E4M3) else '0'
+
+
+@dataclass
+class Job:
+    A: list  # M x K of E5M2/E4M3
+    B: list  # K x N of E5M2/E4M3
+    C: list = None  # M x N of FP16, or None for zeros
+
+    @property
+    def K(self):
+        return len(self.B)
+
+
+# Reference result, multiply-accumulating in order of K like the hardware
+def golden(job):
+    M, N = len(job.A), len(job.B[0])
+    C = [[job.C[i][j] if job.C else FP16.fromf(0.) for j in range(N)] for i in range(M)]
+    for k in range(job.K):
+        for i in range(M):
+            for j in range(N):
+                C[i][j] = fma(job.A[i][k], job.B[k][j], C[i][j])
+    return C
+
+
+# Random values, mostly reasonable sized but sometimes any code (nan/inf/sub)
+def rand8(rs):
+    cls = rs.choice([E5M2, E4M3])
+    if rs.random() < 0.1:
+        return cls.fromb(f"{rs.getrandbits(8):08b}", norm=True)
+    return cls.fromf(rs.gauss(0, 1))
+
+
+# With sparse, that fraction of K-steps have all of A or all of B zero (either
+# sign), like padded or pruned workloads
+def random_job(rs, M, N, K, C=True, sparse=0.):
+    A = [[rand8(rs) for _ in range(K)] for _ in range(M)]
+    B = [[rand8(rs) for _ in range(N)] for _ in range(K)]
+    zero = lambda: rs.choice([E5M2, E4M3]).fromf(rs.choice([0., -0.]))
+    for k in range(K):
+        if sparse and rs.random() < sparse:
+            if rs.random() < 0.5:
+                B[k] = [zero() for _ in range(N)]
+            else:
+                for i in range(M):
+                    A[i][k] = zero()
+    C = [[FP16.fromf(rs.gauss(0, 4)) for _ in range(N)] for _ in range(M)] if C else None
+    return Job(A, B, C)
+
+
+# Does C + A * B leave C exactly as it is: the product has to round to zero
+# (a zero operand, or underflow), and even then -0 + 0 is +0.  0 * inf is NaN,
+# so those steps are always kept.
+def noop(A, B, C):
+    return FP16.fromf(A.f * B.f).f == 0 and fma(A, B, C).h == C.h
+
+
+# Block streams for a sequence of jobs on a grid
+# Returns col_in[c], row_in[r]: lists of (data, ctrl) logical blocks
+# and col_out[c], row_out[r]: expected (data, ctrl) out of the south/east edges,
+# where data is an int, or an FP16 if it is read out of an accumulator
+# and results: golden C for each job
+# With elide, K-steps that can't change any accumulator are left out (elided)
+# Without expected, the golden C (fp.fma, most of the time here) isn't worked
+# out, and read-outs and results are None
+@dataclass
+class GridStreams:
+    rows: int
+    cols: int
+    col_in: list
+    row_in: list
+    col_out: list
+    row_out: list
+    results: list
+    macs: int
+    elided: int = 0  # K-steps left out, each one block on every edge
+
+    @property
+    def blocks(self):
+        return len(self.col_in[0])
+
+    @property
+    def mac_blocks(self):
+        return self.macs // (4 * self.rows * self.cols)
+
+
+def grid_streams(jobs, rows, cols, elide=False, expected=True):
+    assert expected or not elide, "eliding needs the accumulators"
+    M, N = 2 * cols, 2 * rows
+    W = max(rows, cols)
+    zero = FP16.fromf(0.)
+    # Accumulators, acc[r][c] = [C0, C1, C2, C3]
+    acc = [[[zero] * 4 for _ in range(cols)] for _ in range(rows)]
+    s = GridStreams(rows, cols, [[] for _ in range(cols)], [[] for _ in range(rows)],
+                    [[] for _ in range(cols)], [[] for _ in range(rows)], [], 0, 0)
+
+    def swap(C):
+        for part, ctrl in enumerate([RW0, RW1]):
+            south, east = 2 * part, 2 * part + 1  # C0/C1 then C2/C3
+            for w in range(W):
+                t = W - 1 - w  # tile row/column this wave's input ends up in
+                for c in range(cols):
+                    v = C[2 * c][2 * t + part] if (C and t < rows) else zero
+                    s.col_in[c].append((int(v.h, 16), ctrl[0]))
+                    s.col_out[c].append((acc[rows - 1][c][south] if expected else None, ctrl[0]))
+                    for r in range(rows - 1, 0, -1):
+                        acc[r][c][south] = acc[r - 1][c][south]
+                    acc[0][c][south] = v
+                for r in range(rows):
+                    v = C[2 * t + 1][2 * r + part] if (C and t < cols) else zero
+                    s.row_in[r].append((int(v.h, 16), ctrl[1]))
+                    s.row_out[r].append((acc[r][cols - 1][east] if expected else None, ctrl[1]))
+                    for c in range(cols - 1, 0, -1):
+                        acc[r][c][east] = acc[r][c - 1][east]
+                    acc[r][0][east] = v
+
+    def mac(job):
+        assert len(job.A) == M and len(job.B[0]) == N, f"job is not {M}xKx{N}"
+        for k in range(job.K):
+            if elide and all(noop(job.A[i][k], job.B[k][j], acc[j // 2][i // 2][i % 2 + 2 * (j % 2)])
+                             for i in range(M) for j in range(N)):
+                s.elided += 1
+                continue
+            for c in range(cols):
+                A0, A1 = job.A[2 * c][k], job.A[2 * c + 1][k]
+                block = (int(A0.h + A1.h, 16), f"0{fmt(A0)}{fmt(A1)}0")
+                s.col_in[c].append(block)
+                s.col_out[c].append(block)
+            for r in range(rows):
+                B0, B1 = job.B[k][2 * r], job.B[k][2 * r + 1]
+                block = (int(B0.h + B1.h, 16), f"1{fmt(B0)}{fmt(B1)}0")
+                s.row_in[r].append(block)
+                s.row_out[r].append(block)
+            for r in range(rows if expected else 0):
+                for c in range(cols):
+                    A0, A1 = job.A[2 * c][k], job.A[2 * c + 1][k]
+                    B0, B1 = job.B[k][2 * r], job.B[k][2 * r + 1]
+                    C0, C1, C2, C3 = acc[r][c]
+                    acc[r][c] = [fma(A0, B0, C0), fma(A1, B0, C1), fma(A0, B1, C2), fma(A1, B1, C3)]
+            s.macs += 4 * rows * cols
+
+    # Nothing to write in if we start from zero (after reset)
+    if jobs and jobs[0].C is not None:
+        swap(jobs[0].C)
+    for i, job in enumerate(jobs):
+        mac(job)
+        res = [[None] * N for _ in range(M)]
+        for r in range(rows if expected else 0):
+            for c in range(cols):
+                C0, C1, C2, C3 = acc[r][c]
+                res[2 * c][2 * r], res[2 * c + 1][2 * r] = C0, C1
+                res[2 * c][2 * r + 1], res[2 * c + 1][2 * r + 1] = C2, C3
+        s.results.append(res if expected else None)
+        swap(jobs[i + 1].C if i + 1 < len(jobs) else None)
+    return s
+
+
+# Compare two FP16 values like test_sequence does (nan == nan, 0 == -0)
+def same(a, b):
+    return (a.f != a.f and b.f != b.f) or a.f == b.f
+
+
+if __name__ == "__main__":
+    rs = random.Random(0)
+    for rows, cols in [(1, 1), (1, 2), (2, 1), (2, 2), (3, 2)]:
+        jobs = [random_job(rs, 2 * cols, 2 * rows, rs.randint(1, 4), C=rs.random() < 0.5)
+                for _ in range(3)]
+        s = grid_streams(jobs, rows, cols)
+        # Results match the reference
+        for job, res in zip(jobs, s.results):
+            ref = golden(job)
+            assert all(same(a, b) for x, y in zip(ref, res) for a, b in zip(x, y))
+        # Every accumulator comes out of an edge exactly once per job
+        outs = [d for stream in s.col_out + s.row_out for d, _ in stream if isinstance(d, FP16)]
+        swaps = len(jobs) + (jobs[0].C is not None)
+        assert len(outs) == swaps * 2 * max(rows, cols) * (rows + cols)
+        for job, res in zip(jobs, s.results):
+            for row in res:
+                for v in row:
+                    assert any(o is v for o in outs), f"{v} never read out"
+        assert s.macs == sum(4 * rows * cols * job.K for job in jobs)
+    # Eliding no-op K-steps gives bit-identical results, in fewer blocks
+    saved = total = 0
+    for n in range(100):
+        rows, cols = rs.randint(1, 3), rs.randint(1, 3)
+        jobs = [random_job(rs, 2 * cols, 2 * rows, rs.randint(1, 8), C=rs.random() < 0.5, sparse=0.5)
+                for _ in range(3)]
+        s = grid_streams(jobs, rows, cols)
+        e = grid_streams(jobs, rows, cols, elide=True)
+        for res, ref in zip(e.results, s.results):
+            assert all(a.h == b.h for x, y in zip(ref, res) for a, b in zip(x, y))
+        assert e.blocks == s.blocks - e.elided and e.macs == s.macs - 4 * rows * cols * e.elided
+        saved, total = saved + e.elided, total + s.blocks
+    print(f"elided {saved} of {total} blocks ({4 * saved} cycles) at 50% sparse K-steps")
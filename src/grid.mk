@@ -0,0 +1,51 @@
+# Makefile
+# See https://docs.cocotb.org/en/stable/quickstart.html for more info
+
+# defaults
+SIM ?= icarus
+TOPLEVEL_LANG ?= verilog
+
+# size of the grid of tiles, also read by grid.py
+GRID_ROWS ?= 2
+GRID_COLS ?= 2
+export GRID_ROWS GRID_COLS
+# GRID_SPARSE=0.5 zeroes half the K-steps in A or B, and elides them (grid.py)
+
+# verilator: see Makefile
+ifeq ($(SIM),verilator)
+COMPILE_ARGS += --no-timing
+COMPILE_ARGS += -Wno-WIDTHEXPAND -Wno-WIDTHTRUNC
+COMPILE_ARGS += -GROWS=$(GRID_ROWS) -GCOLS=$(GRID_COLS)
+else
+COMPILE_ARGS += -Pgridtb.ROWS=$(GRID_ROWS) -Pgridtb.COLS=$(GRID_COLS)
+endif
+
+# normal simulation
+ifneq ($(GATES),yes)
+
+# this is the only part you should need to modify:
+VERILOG_SOURCES += $(PWD)/gridtb.v $(PWD)/tt_um_machinaut_systolic.v $(PWD)/pipe.v
+
+else
+
+# gate level simulation requires some extra setup, you shouldn't need to touch this
+COMPILE_ARGS    += -DGL_TEST
+COMPILE_ARGS    += -DFUNCTIONAL
+COMPILE_ARGS    += -DUSE_POWER_PINS
+COMPILE_ARGS    += -DSIM
+COMPILE_ARGS    += -DUNIT_DELAY=\#1
+VERILOG_SOURCES += $(PDK_ROOT)/sky130A/libs.ref/sky130_fd_sc_hd/verilog/primitives.v
+VERILOG_SOURCES += $(PDK_ROOT)/sky130A/libs.ref/sky130_fd_sc_hd/verilog/sky130_fd_sc_hd.v
+
+# this gets copied in by the GDS action workflow
+VERILOG_SOURCES += $(PWD)/gridtb.v $(PWD)/gate_level_netlist.v
+endif
+
+# TOPLEVEL is the name of the toplevel module in your Verilog or VHDL file
+TOPLEVEL = gridtb
+
+# MODULE is the basename of the Python test file
+MODULE = grid
+
+# include cocotb's make rules to take care of the simulator setup
+include $(shell cocotb-config --makefiles)/Makefile.sim
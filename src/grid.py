@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# %%
+# Run GEMMs end-to-end on a grid of tiles (see gridtb.v and gemm.py), checking
+# every block out of the south and east edges and the achieved MACs/cycle.
+import os
+import random
+
+import cocotb
+from cocotb.triggers import FallingEdge
+
+from fp import FP16
+from gemm import grid_streams, random_job, same
+from test import TEST_N, reset
+
+# Should match grid.mk
+GRID_ROWS = int(os.environ.get("GRID_ROWS", 2))
+GRID_COLS = int(os.environ.get("GRID_COLS", 2))
+# Fraction of K-steps with all of A or B zero, which are elided from the stream
+GRID_SPARSE = float(os.environ.get("GRID_SPARSE", 0))
+
+
+# Pack nibble j (MSB first) of each stream's block b into an edge vector
+def edge(streams, b, j, width=4):
+    v = 0
+    for i, stream in enumerate(streams):
+        if b < len(stream):
+            data, ctrl = stream[b]
+            nib = (data >> (4 * (3 - j))) & 0xf if width == 4 else int(ctrl[j])
+            v |= nib << (width * i)
+    return v
+
+
+# Drive the streams through the grid, return what comes out of each edge
+# as col_out[c], row_out[r] lists of (data, ctrl) in block order
+async def run_grid(dut, s):
+    rows, cols = s.rows, s.cols
+    # Stream i is skewed by i blocks, so every tile sees matching blocks
+    col_in = [[(0, '0000')] * c + stream for c, stream in enumerate(s.col_in)]
+    row_in = [[(0, '0000')] * r + stream for r, stream in enumerate(s.row_in)]
+    blocks = s.blocks + rows + cols
+    seen = []
+    for t in range(4 * blocks):
+        b, j = divmod(t, 4)
+        seen.append((dut.col_out.value.integer, dut.col_ctrl_out.value.integer,
+                     dut.row_out.value.integer, dut.row_ctrl_out.value.integer))
+        dut.col_in.value = edge(col_in, b, j)
+        dut.col_ctrl_in.value = edge(col_in, b, j, width=1)
+        dut.row_in.value = edge(row_in, b, j)
+        dut.row_ctrl_in.value = edge(row_in, b, j, width=1)
+        await FallingEdge(dut.clk)
+
+    # Unskew, logical block L of column c comes out at block L + c + rows
+    def unpack(i, skew, data_at, ctrl_at):
+        out = []
+        for L in range(s.blocks):
+            cycles = seen[4 * (L + skew):4 * (L + skew) + 4]
+            data = sum(((v[data_at] >> (4 * i)) & 0xf) << (4 * (3 - j)) for j, v in enumerate(cycles))
+            ctrl = ''.join(str((v[ctrl_at] >> i) & 1) for v in cycles)
+            out.append((data, ctrl))
+        return out
+    col_out = [unpack(c, c + rows, 0, 1) for c in range(cols)]
+    row_out = [unpack(r, r + cols, 2, 3) for r in range(rows)]
+    return col_out, row_out, 4 * blocks
+
+
+# Compare one edge stream against the expected blocks, return error messages
+def compare(name, got, expected):
+    errors = []
+    for L, ((data, ctrl), (want, want_ctrl)) in enumerate(zip(got, expected)):
+        if isinstance(want, FP16):
+            ok = same(FP16.fromh(f"{data:04x}"), want)
+            want = want.h
+        else:
+            ok = data == want
+            want = f"{want:04x}"
+        if not ok or ctrl != want_ctrl:
+            errors.append(f"{name} block {L}: got {data:04x}/{ctrl} expected {want}/{want_ctrl}")
+    return errors
+
+
+@cocotb.test()
+async def test_gemm(dut):
+    rows, cols = GRID_ROWS, GRID_COLS
+    dut._log.info(f"start test_gemm on a {rows}x{cols} grid")
+    dut.ena.value = 1
+    dut.col_in.value = dut.col_ctrl_in.value = 0
+    dut.row_in.value = dut.row_ctrl_in.value = 0
+    await reset(dut)
+    seed = random.getrandbits(32)
+    dut._log.info(f"  seed {seed}")
+    rs = random.Random(seed)
+    # Back-to-back jobs, so each read-out overlaps the next write-in
+    jobs = [random_job(rs, 2 * cols, 2 * rows, rs.randint(1, 16), C=rs.random() < 0.75, sparse=GRID_SPARSE)
+            for _ in range(TEST_N)]
+    s = grid_streams(jobs, rows, cols, elide=GRID_SPARSE > 0)
+    col_out, row_out, cycles = await run_grid(dut, s)
+    errors = []
+    for c in range(cols):
+        errors += compare(f"col {c}", col_out[c], s.col_out[c])
+    for r in range(rows):
+        errors += compare(f"row {r}", row_out[r], s.row_out[r])
+    peak = rows * cols
+    dut._log.info(f"  {len(jobs)} jobs, {s.blocks} blocks, {s.mac_blocks} MAC blocks")
+    if s.elided:
+        dut._log.info(f"  elided {s.elided} blocks ({4 * s.elided} cycles) of zero K-steps")
+    dut._log.info(f"  {s.macs} MACs in {cycles} cycles: {s.macs / cycles:.2f} MACs/cycle"
+                  f" of {peak} peak ({100 * s.macs / cycles / peak:.1f}%)")
+    dut._log.info(f"  steady state {s.macs / (4 * s.blocks):.2f} MACs/cycle"
+                  f" ({100 * s.mac_blocks / s.blocks:.1f}% MAC blocks)")
+    assert not errors, f"{len(errors)} mismatches:\n" + "\n".join(errors[:20])
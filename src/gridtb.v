@@ -0,0 +1,71 @@
+`default_nettype none
+`timescale 1ns/1ps
+
+/*
+this testbench wires a ROWS x COLS grid of the module into a systolic array:
+col_out -> col_in going south and row_out -> row_in going east, with the
+control bits forwarded alongside the data (see "Systolic Tiling" in README.md)
+*/
+
+// testbench is controlled by grid.py
+module gridtb #(parameter ROWS = 2, parameter COLS = 2) ();
+
+    // shared clock and reset
+    reg  clk;
+    reg  rst_n;
+    reg  ena;
+
+    // Grid edges, column c is bits [4*c+3:4*c] (or bit c for control)
+    // and row r is bits [4*r+3:4*r] (or bit r for control)
+    reg  [4*COLS-1:0] col_in;       // North edge data
+    reg  [COLS-1:0]   col_ctrl_in;  // North edge control
+    reg  [4*ROWS-1:0] row_in;       // West edge data
+    reg  [ROWS-1:0]   row_ctrl_in;  // West edge control
+    wire [4*COLS-1:0] col_out;      // South edge data
+    wire [COLS-1:0]   col_ctrl_out; // South edge control
+    wire [4*ROWS-1:0] row_out;      // East edge data
+    wire [ROWS-1:0]   row_ctrl_out; // East edge control
+
+    // Connections, col_con[r] goes into tile row r and row_con[c] into tile column c
+    wire [4*COLS-1:0] col_con [0:ROWS];
+    wire [COLS-1:0]   col_ctrl_con [0:ROWS];
+    wire [4*ROWS-1:0] row_con [0:COLS];
+    wire [ROWS-1:0]   row_ctrl_con [0:COLS];
+    assign col_con[0] = col_in;
+    assign col_ctrl_con[0] = col_ctrl_in;
+    assign row_con[0] = row_in;
+    assign row_ctrl_con[0] = row_ctrl_in;
+    assign col_out = col_con[ROWS];
+    assign col_ctrl_out = col_ctrl_con[ROWS];
+    assign row_out = row_con[COLS];
+    assign row_ctrl_out = row_ctrl_con[COLS];
+
+    genvar r, c;
+    generate
+        for (r = 0; r < ROWS; r = r + 1) begin : row
+            for (c = 0; c < COLS; c = c + 1) begin : col
+                wire [7:0] uio_out;
+                wire [7:0] uio_oe;
+
+                tt_um_machinaut_systolic tt_um_machinaut_systolic (
+                // include power ports for the Gate Level test
+                `ifdef GL_TEST
+                    .VPWR( 1'b1),
+                    .VGND( 1'b0),
+                `endif
+                    .ui_in   ({col_con[r][4*c+3:4*c], row_con[c][4*r+3:4*r]}),
+                    .uo_out  ({col_con[r+1][4*c+3:4*c], row_con[c+1][4*r+3:4*r]}),
+                    .uio_in  ({4'b0000, col_ctrl_con[r][c], row_ctrl_con[c][r], 2'b00}),
+                    .uio_out (uio_out),
+                    .uio_oe  (uio_oe),
+                    .ena     (ena),
+                    .clk     (clk),
+                    .rst_n   (rst_n)
+                    );
+                assign col_ctrl_con[r+1][c] = uio_out[1];
+                assign row_ctrl_con[c+1][r] = uio_out[0];
+            end
+        end
+    endgenerate
+
+endmodule
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# %%  Plan how to split K so the FP16 accumulators stay accurate
+# The tiles round to FP16 after every multiply and every add, so over a long K
+# small products get swamped by a large running sum, and big sums overflow to
+# inf.  Splitting K into chunks, each accumulated on the tiles from zero (C goes
+# in with the first), read out, and summed on the host in float64, keeps every
+# on-chip sum short.  Each chunk costs one more read-out per panel (see
+# estimate.py), so the plan is the fewest chunks that meet an error target on
+# sample data, run through the bit-exact emulation (emulate.py).
+#   ./ksplit.py        # plan a few example layers
+from dataclasses import dataclass
+
+import numpy as np
+
+from emulate import FP8, decode16, emulate_matmul
+from estimate import Estimate, estimate
+
+
+# K split into chunks of nearly equal length, as (start, stop)
+def chunks(K, n):
+    bounds = [i * K // n for i in range(n + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+# Result of running K as n chunks on the tiles and summing them on the host
+def split_matmul(A, B, C=None, a_fmt=0, b_fmt=0, n=1):
+    out = np.zeros((A.shape[0], B.shape[1]))
+    fmt = lambda f, *idx: f if np.ndim(f) == 0 else f[idx]
+    with np.errstate(invalid='ignore'):  # inf - inf
+        for i, (start, stop) in enumerate(chunks(A.shape[1], n)):
+            D = emulate_matmul(A[:, start:stop], B[start:stop], C if i == 0 else None,
+                               fmt(a_fmt, slice(None), slice(start, stop)), fmt(b_fmt, slice(start, stop)))
+            out += decode16(D)
+    return out
+
+
+# Exact result (to float64) of C + A * B
+def exact(A, B, C=None, a_fmt=0, b_fmt=0):
+    a = FP8[np.asarray(a_fmt, dtype=np.intp), A].astype(np.float64)
+    b = FP8[np.asarray(b_fmt, dtype=np.intp), B].astype(np.float64)
+    return a @ b + (0. if C is None else decode16(C))
+
+
+# Relative RMS error, inf if anything overflowed (or went NaN) that shouldn't
+def rel_error(got, ref):
+    finite = np.isfinite(ref)
+    if not np.isfinite(got[finite]).all():
+        return np.inf
+    return np.sqrt(((got - ref)[finite] ** 2).sum() / max((ref[finite] ** 2).sum(), 1e-300))
+
+
+@dataclass
+class Plan:
+    K: int
+    splits: int
+    error: float  # relative RMS error of the sample, split
+    error1: float  # and all of K on the tiles at once
+    target: float
+    estimate: Estimate  # throughput of the full GEMM, split
+    estimate1: Estimate  # and not
+
+    @property
+    def met(self):
+        return self.error <= self.target
+
+    def __str__(self):
+        e, e1 = self.estimate, self.estimate1
+        return (f"K={self.K} in {self.splits} chunks of ~{self.K // self.splits}: error {self.error:.2e}"
+                f" ({self.error1:.2e} unsplit, target {self.target:.0e}{'' if self.met else ', NOT MET'}),"
+                f" {e.macs_per_s / 1e6:.1f} MMAC/s ({e1.macs_per_s / 1e6:.1f} unsplit,"
+                f" acc I/O {100 * e.io_share:.1f}% vs {100 * e1.io_share:.1f}%)")
+
+
+# Fewest chunks that bring the sample's error under target.  Error falls about
+# monotonically with shorter chunks, so double until it's met, then bisect, and
+# every candidate is measured, so the result is right even where it doesn't.
+# shape is the full (M, N, K) for the throughput estimate, rows x cols the grid.
+def plan(A, B, C=None, a_fmt=0, b_fmt=0, target=1e-3, shape=None, rows=1, cols=1, clock=None):
+    K = A.shape[1]
+    ref = exact(A, B, C, a_fmt, b_fmt)
+    errors = {}
+
+    def err(n):
+        if n not in errors:
+            errors[n] = rel_error(split_matmul(A, B, C, a_fmt, b_fmt, n), ref)
+        return errors[n]
+
+    lo, hi = 0, 1  # lo fails (or is nothing), hi is being tried
+    while err(hi) > target and hi < K:
+        lo, hi = hi, min(2 * hi, K)
+    if err(hi) <= target:
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            lo, hi = (lo, mid) if err(mid) <= target else (mid, hi)
+    else:  # even one K step per chunk doesn't do it, take the best there is
+        hi = min(errors, key=errors.get)
+    M, N, K = shape or (A.shape[0], B.shape[1], K)
+    return Plan(K, hi, err(hi), err(1), target, estimate(M, N, K, rows, cols, C is not None, clock, hi),
+                estimate(M, N, K, rows, cols, C is not None, clock))
+
+
+if __name__ == "__main__":
+    from quant import quantize
+
+    rs = np.random.default_rng(0)
+    # Chunk results are the on-chip sums exactly, and chunks cover K
+    A, a_fmt = quantize(rs.normal(0, 1, (8, 100)))
+    B, b_fmt = quantize(rs.normal(0, 1, (100, 6)))
+    assert (split_matmul(A, B, None, a_fmt, b_fmt, 1) == decode16(emulate_matmul(A, B, None, a_fmt, b_fmt))).all()
+    for n in range(1, 101):
+        assert sum(stop - start for start, stop in chunks(100, n)) == 100
+    # Long K on zero mean data loses precision, on positive data it overflows
+    M, N, K = 32, 32, 4096
+    for name, scale, target in [("zero mean", 1., 1e-3), ("zero mean", 1., 3e-4), ("positive", 8., 1e-2)]:
+        x = rs.normal(0, scale, (M, K))
+        w = rs.normal(0, scale, (K, N))
+        if name == "positive":
+            x, w = np.abs(x), np.abs(w)
+        (A, a_fmt), (B, b_fmt) = quantize(x), quantize(w)
+        p = plan(A, B, None, a_fmt, b_fmt, target, shape=(1024, 1024, K), rows=4, cols=4)
+        print(f"{name}, target {target:.0e}: {p}")
+        assert p.met
+        assert p.splits == 1 or p.error1 > target
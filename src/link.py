@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# %%  Drive a tile over a byte stream (serial port or pty) from the host
+# Every cycle the host sends ui_in, uio_in and the device sends back uo_out,
+# uio_out as they were before that clock edge (like model.Tile.cycle), two
+# bytes each way.  Block streams (as model.run_blocks takes them) are encoded
+# a chunk of cycles at a time with numpy, and written while the chunk before is
+# still in flight (double buffered), with the replies decoded into blocks as
+# they come in.  If a chunk goes out only after everything before it has come
+# back, the device had nothing to clock in between: an underrun.
+# Standin is a device on a pty, running the Python tile model.
+#   ./link.py                      # check against the model, time on a stand-in
+#   ./link.py --standin            # be a device, on the pty it prints
+#   ./link.py --port /dev/ttyUSB0 --baud 3000000   # time on a real device
+import argparse
+import os
+import random
+import socket
+import termios
+import threading
+import time
+import tty
+from dataclasses import dataclass
+
+import numpy as np
+
+from model import Tile, run_blocks
+
+
+# Blocks of (col, col_ctrl, row, row_ctrl) to (ui_in, uio_in) bytes per cycle
+def encode(blocks):
+    data = np.array([(col, row) for col, _, row, _ in blocks], dtype=np.uint16).reshape(-1, 2)
+    ctrl = np.array([(int(cc, 2), int(rc, 2)) for _, cc, _, rc in blocks], dtype=np.uint8).reshape(-1, 2)
+    shift = np.arange(3, -1, -1)  # nibble and ctrl bit j go out MSB first
+    nib = (data[:, None, :] >> (4 * shift[None, :, None])) & 0xf
+    bit = (ctrl[:, None, :] >> shift[None, :, None]) & 1
+    cycles = np.stack([(nib[..., 0] << 4) | nib[..., 1], (bit[..., 0] << 3) | (bit[..., 1] << 2)], axis=-1)
+    return cycles.astype(np.uint8).reshape(-1)
+
+
+# (uo_out, uio_out) bytes per cycle back to blocks, incrementally: feed takes
+# whatever has arrived and returns the blocks completed by it
+class Decoder:
+    def __init__(self):
+        self.rest = b""
+
+    def feed(self, data):
+        data = self.rest + data
+        n = len(data) // 8 * 8
+        self.rest = data[n:]
+        cycles = np.frombuffer(data[:n], dtype=np.uint8).reshape(-1, 4, 2)
+        weight = 1 << (4 * np.arange(3, -1, -1))
+        col = ((cycles[..., 0] >> 4).astype(np.int64) * weight).sum(axis=1)
+        row = ((cycles[..., 0] & 0xf).astype(np.int64) * weight).sum(axis=1)
+        bits = lambda b: [''.join(map(str, x)) for x in (cycles[..., 1] >> b) & 1]
+        return [(int(c), cc, int(r), rc) for c, cc, r, rc in zip(col, bits(1), row, bits(0))]
+
+
+@dataclass
+class LinkStats:
+    cycles: int = 0
+    chunks: int = 0
+    underruns: int = 0  # chunks that went out after everything before had come back
+    seconds: float = 0.
+
+    def __str__(self):
+        return (f"{self.cycles} cycles in {self.chunks} chunks, {self.seconds:.2f} s,"
+                f" {self.cycles / self.seconds if self.seconds else 0.:.0f} cycles/s, {self.underruns} underruns")
+
+
+class Link:
+    # fd is open for reading and writing, chunk is in cycles, buffers is how
+    # many chunks can be in flight (1 waits for each chunk before the next)
+    def __init__(self, fd, chunk=4096, buffers=2):
+        self.fd, self.chunk, self.buffers = fd, chunk, buffers
+
+    # Run the blocks through the device, returning the blocks that came out
+    def run(self, blocks, stats=None):
+        stats = stats or LinkStats()
+        data = encode(blocks)
+        cycles = len(data) // 2
+        chunks = [(n, min(n + self.chunk, cycles)) for n in range(0, cycles, self.chunk)]
+        free = threading.Semaphore(self.buffers)
+        done = [0]  # cycles come back so far
+        sent = [0]
+        error = [None]  # what stopped the reader, if anything
+        out, decoder = [], Decoder()
+
+        def read():
+            got, ends = 0, [end for _, end in chunks]
+            try:
+                while got < 2 * cycles:
+                    part = os.read(self.fd, 2 * cycles - got)
+                    if not part:
+                        raise EOFError("device closed the link")
+                    got += len(part)
+                    out.extend(decoder.feed(part))
+                    done[0] = got // 2
+                    while ends and done[0] >= ends[0]:
+                        ends.pop(0)
+                        free.release()
+            except BaseException as e:
+                error[0] = e
+                if ends:  # so the writer doesn't wait for chunks that won't come back
+                    free.release(len(ends))
+
+        reader = threading.Thread(target=read, daemon=True)
+        t = time.perf_counter()
+        reader.start()
+        for n, (start, end) in enumerate(chunks):
+            free.acquire()
+            if error[0] is not None:
+                break
+            if n and done[0] >= sent[0]:
+                stats.underruns += 1
+            view = memoryview(data[2 * start:2 * end])
+            while view:
+                view = view[os.write(self.fd, view):]
+            sent[0] = end
+            stats.chunks += 1
+        reader.join()
+        if error[0] is not None:
+            raise error[0]
+        if len(out) != len(blocks):
+            raise EOFError(f"{len(out)} blocks came back for {len(blocks)} sent")
+        stats.seconds += time.perf_counter() - t
+        stats.cycles += cycles
+        return out
+
+
+# Open a serial port raw at a baud rate (termios, so no pyserial needed)
+def open_port(path, baud=None):
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    if baud:
+        attr = termios.tcgetattr(fd)
+        attr[4] = attr[5] = getattr(termios, f"B{baud}")
+        termios.tcsetattr(fd, termios.TCSANOW, attr)
+    return fd
+
+
+# A device on a pty: the host opens port like a serial port (or uses fd), and
+# the other end runs the Python tile model a byte pair at a time, in a thread
+class Standin:
+    def __init__(self):
+        self.device, self.fd = os.openpty()
+        tty.setraw(self.fd)
+        self.port = os.ttyname(self.fd)
+        self.tile = Tile()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        rest = b""
+        while True:
+            try:
+                data = rest + os.read(self.device, 65536)
+            except OSError:  # host end closed
+                return os.close(self.device)
+            n = len(data) // 2 * 2
+            rest = data[n:]
+            out = bytearray()
+            for ui, uio in zip(data[0:n:2], data[1:n:2]):
+                out += bytes(self.tile.cycle(ui, uio))
+            view = memoryview(out)
+            while view:
+                view = view[os.write(self.device, view):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="drive a tile over a serial port or pty")
+    parser.add_argument("--standin", action="store_true", help="be a device on a pty")
+    parser.add_argument("--port", default=None, help="serial port of a device to time")
+    parser.add_argument("--baud", type=int, default=None)
+    parser.add_argument("--blocks", type=int, default=20000, help="blocks to time")
+    parser.add_argument("--chunk", type=int, nargs="+", default=[256, 4096], help="cycles per chunk")
+    args = parser.parse_args()
+    if args.standin:
+        s = Standin()
+        print(s.port, flush=True)
+        s.thread.join()
+        raise SystemExit
+    from gemm import random_job
+    from tilesched import schedule, tile_stream
+
+    rs = random.Random(0)
+    stream = lambda n: [b for _ in range(n) for b in tile_stream(
+        schedule([random_job(rs, 2, 2, rs.randint(1, 8), C=True) for _ in range(8)], expected=False).blocks)]
+    # Same blocks out as the model, for any chunk size
+    if args.port is None:
+        for chunk in [1, 3, 4, 1000]:
+            s = Standin()
+            blocks = stream(4)
+            assert Link(s.fd, chunk).run(blocks) == run_blocks(Tile(), blocks), chunk
+            s.close()
+        print("blocks through the stand-in match the model")
+        # A device that goes away part way through is an error, not a hang
+        host, device = socket.socketpair()
+        threading.Thread(target=lambda: (device.recv(64), device.sendall(bytes(16)), device.close()),
+                         daemon=True).start()
+        try:
+            Link(host.fileno(), 4).run(stream(1))
+        except (EOFError, BrokenPipeError) as e:
+            print(f"device going away: {e!r}")
+        else:
+            raise AssertionError("link ran with the device gone")
+        host.close()
+    # Sustained rate, single and double buffered
+    blocks = stream(args.blocks // 60 + 1)
+    for chunk in args.chunk:
+        for buffers in (1, 2):
+            s = None if args.port else Standin()
+            fd = open_port(args.port, args.baud) if args.port else s.fd
+            stats = LinkStats()
+            Link(fd, chunk, buffers).run(blocks, stats)
+            os.close(fd)
+            print(f"{chunk} cycle chunks, {buffers} buffered: {stats}")
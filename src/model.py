@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# %%  Cycle-accurate, bit-exact Python model of the tile
+# Follows tt_um_machinaut_systolic.v and pipe.v signal for signal, so expected
+# outputs can be computed for any stimulus (not just well-formed sequences),
+# including the exact NaN / signed zero encodings the hardware produces.
+import random
+
+
+def bit(x, i):
+    return (x >> i) & 1
+
+
+def bits(x, hi, lo):
+    return (x >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+
+# %% pipe.v
+
+def multiplicand(X, fmt):
+    exp0 = bits(X, 6, 3) == 0 if fmt else bits(X, 6, 2) == 0
+    exp1 = bits(X, 6, 3) == 0b1111 if fmt else bits(X, 6, 2) == 0b11111
+    man0 = bits(X, 2, 0) == 0 if fmt else bits(X, 1, 0) == 0
+    nan = exp1 and (bits(X, 2, 0) == 0b111 if fmt else not man0)
+    inf = exp1 and man0 and not fmt
+    zero = exp0 and man0
+    sub = exp0 and not man0
+    if sub:
+        if fmt:  # E4M3 subnormals
+            sexp = bits(X, 6, 3) + (9 if bit(X, 2) else 8 if bit(X, 1) else 7)
+            frac = (bits(X, 1, 0) << 1) if bit(X, 2) else (bit(X, 0) << 2) if bit(X, 1) else 0
+        else:  # E5M2 subnormals
+            sexp = bits(X, 6, 2) + (1 if bit(X, 1) else 0)
+            frac = (bit(X, 0) << 2) if bit(X, 1) else 0
+    else:
+        sexp = bits(X, 6, 3) + 9 if fmt else bits(X, 6, 2) + 1
+        frac = bits(X, 2, 0) if fmt else bits(X, 1, 0) << 1
+    return nan, inf, zero, sexp & 0x3f, frac
+
+
+# Multiply A and B to get product
+def pipe0(A, B, C, Afmt, Bfmt, save):
+    Anan, Ainf, Azero, Asexp, Afrac = multiplicand(A, Afmt)
+    Bnan, Binf, Bzero, Bsexp, Bfrac = multiplicand(B, Bfmt)
+    Pnan = Anan or Bnan or (Ainf and Bzero) or (Azero and Binf)
+    Pinf = not Pnan and (Ainf or Binf)
+    Pzero = not Pnan and not Pinf and (Azero or Bzero)
+    Psig = bit(A, 7) ^ bit(B, 7)
+    Pq = ((8 | Afrac) * (8 | Bfrac)) & 0xff
+    Psexp = (Asexp + Bsexp + bit(Pq, 7)) & 0x7f
+    Pfrac = bits(Pq, 6, 0) if bit(Pq, 7) else (bits(Pq, 5, 0) << 1)
+    out = (Pnan << 33) | (Pinf << 32) | (Pzero << 31) | (Psig << 30)
+    out |= (Psexp << 23) | (Pfrac << 16) | C
+    return out, save
+
+
+def roundproduct(sexp, frac):
+    rem = bool(frac & ((1 << (14 - sexp)) - 1)) if 7 <= sexp <= 13 else False
+    if sexp >= 18:
+        shifted = frac << 4
+    elif sexp >= 7:  # leading one, then the fraction shifted down
+        shifted = ((0x80 | frac) << (sexp - 7)) >> 7
+    else:
+        shifted = 0
+    shifted &= 0x7ff
+    half, odd = bit(shifted, 0), bit(shifted, 1)
+    man = bits(shifted, 10, 1)
+    return (man + 1) & 0x3ff if half and (odd or rem) else man
+
+
+# Round the product and normalize to FP16
+def pipe1(x, save):
+    Pnan, Pinf, Pzero, Psig = bit(x, 33), bit(x, 32), bit(x, 31), bit(x, 30)
+    Psexp, Pfrac, C = bits(x, 29, 23), bits(x, 22, 16), bits(x, 15, 0)
+    Pman = roundproduct(Psexp, Pfrac)
+    Pexp = 31 if Psexp >= 48 else 0 if Psexp <= 16 else Psexp - 17
+    if Pnan:
+        P = 0x7fff
+    elif Pinf or Pexp == 31:
+        P = (Psig << 15) | 0x7c00
+    elif Pzero or Psexp < 7:
+        P = Psig << 15
+    elif Psexp > 16:
+        P = (Psig << 15) | (Pexp << 10) | Pman
+    else:
+        P = (Psig << 15) | Pman
+    return ((P << 16) | C) if save else 0, save
+
+
+# Add the product and accumulator
+def pipe2(x, save):
+    P, C = bits(x, 31, 16), bits(x, 15, 0)
+    Psig, Pexp, Pman = bit(P, 15), bits(P, 14, 10), bits(P, 9, 0)
+    Csig, Cexp, Cman = bit(C, 15), bits(C, 14, 10), bits(C, 9, 0)
+    Pnan, Pinf, Pzero = Pexp == 31 and Pman != 0, Pexp == 31 and Pman == 0, Pexp == 0 and Pman == 0
+    Cnan, Cinf, Czero = Cexp == 31 and Cman != 0, Cexp == 31 and Cman == 0, Cexp == 0 and Cman == 0
+    Snan = Pnan or Cnan or (Pinf and Cinf and Psig != Csig)
+    Sinf = not Snan and (Pinf or Cinf)
+    Szero = not Snan and not Sinf and (Pzero and Czero)
+    F, G = (P, C) if bits(P, 14, 0) > bits(C, 14, 0) else (C, P)
+    Fsig, Fexp, Fman = bit(F, 15), bits(F, 14, 10), bits(F, 9, 0)
+    Gsig, Gexp, Gman = bit(G, 15), bits(G, 14, 10), bits(G, 9, 0)
+    Fexps, Gexps = max(Fexp, 1), max(Gexp, 1)
+    Fq = ((Fexp > 0) << 13) | (Fman << 3)
+    Gq = ((Gexp > 0) << 13) | (Gman << 3)
+    shift = (Fexps - Gexps) & 0x1f
+    # Shift right, keeping a sticky bit
+    Gqs = Gq if shift == 0 else (((Gq >> (shift + 1)) << 1) | (Gq & ((2 << shift) - 1) != 0))
+    Sq = (Fq + Gqs if Fsig == Gsig else Fq - Gqs) & 0x7fff
+    out = (Snan << 39) | (Sinf << 38) | (Szero << 37) | (Fsig << 36) | (Fexps << 31) | (Sq << 16) | C
+    return out if save else 0, save
+
+
+# Normalize and round the sum
+def pipe3(x, save):
+    Sq, Sexp, Ssig = bits(x, 30, 16), bits(x, 35, 31), bit(x, 36)
+    Szeroin, Sinfin, Snan = bit(x, 37), bit(x, 38), bit(x, 39)
+    if bit(Sq, 14):
+        Sqs, Sexps = (bits(Sq, 14, 2) << 1) | (bits(Sq, 1, 0) != 0), (Sexp + 1) & 0x1f
+    else:
+        Sqs, Sexps = 0, 0
+        for k in range(13, -1, -1):
+            if bit(Sq, k) or Sexp == 14 - k:
+                Sqs, Sexps = bits(Sq, k, 0) << (13 - k), (Sexp - (13 - k)) & 0x1f
+                break
+    Szero = Szeroin or Sexps == 0
+    o, g, r, s = bit(Sqs, 3), bit(Sqs, 2), bit(Sqs, 1), bit(Sqs, 0)
+    Sqr = bits(Sqs, 13, 3) + 1 if g and (r or s or o) else bits(Sqs, 13, 3)
+    Sexpr = (Sexps + 1) & 0x1f if bit(Sqr, 11) else Sexps
+    Sqf = bits(Sqr, 11, 1) if bit(Sqr, 11) else bits(Sqr, 10, 0)
+    Sinf = Sinfin or Sexpr == 31
+    if Snan:
+        S = 0x7fff
+    elif Sinf:
+        S = (Ssig << 15) | 0x7c00
+    elif Szero:
+        S = Ssig << 15
+    elif bit(Sqf, 10):
+        S = (Ssig << 15) | (Sexpr << 10) | bits(Sqf, 9, 0)
+    else:
+        S = (Ssig << 15) | bits(Sqf, 9, 0)
+    return S if save else 0, save
+
+
+# %% tt_um_machinaut_systolic.v
+
+# Input multiplexer to pick what's going into the first pipeline stage
+def pipe_in(cnt, ci, co, cci, cco, ri, ro, rci, rco, C0, C1, C2, C3):
+    Afmt = bit(cci, 2) if cnt == 3 else bit(cco, 1) if cnt == 0 else bit(cco, 2) if cnt == 1 else bit(cco, 1)
+    Bfmt = bit(rci, 2) if cnt == 3 else bit(rco, 2) if cnt == 0 else bit(rco, 1)
+    if cnt == 3:
+        save = bit(cci, 3) == 0 and bit(rci, 3) == 1
+    else:
+        save = bit(cco, 3) == 0 and bit(rco, 3) == 1
+    if not save:
+        return 0, 0, 0, Afmt, Bfmt, save
+    A = [bits(co, 7, 0), bits(co, 15, 8), bits(co, 7, 0), bits(ci, 15, 8)][cnt]
+    B = [bits(ro, 15, 8), bits(ro, 7, 0), bits(ro, 7, 0), bits(ri, 15, 8)][cnt]
+    C = [C1, C2, C3, C0][cnt]
+    return A, B, C, Afmt, Bfmt, save
+
+
+class Tile:
+    def __init__(self):
+        self.reset()
+
+    # Everything is zeroed in reset
+    def reset(self):
+        self.count = 0
+        self.col_buf_in = self.row_buf_in = 0
+        self.col_ctrl_buf_in = self.row_ctrl_buf_in = 0
+        self.col_buf_out = self.row_buf_out = 0
+        self.col_ctrl_buf_out = self.row_ctrl_buf_out = 0
+        self.C = [0, 0, 0, 0]
+        self.pipe = [(0, 0), (0, 0), (0, 0)]  # (Pipe0s, Pipe0Ss), ...
+
+    # Outputs only depend on the state (and reset), nibble count 0 is the MSB
+    def outputs(self, rst_n=1):
+        if not rst_n:
+            return 0, 0
+        shift = 4 * (3 - self.count)
+        col, row = (self.col_buf_out >> shift) & 0xf, (self.row_buf_out >> shift) & 0xf
+        col_ctrl = bit(self.col_ctrl_buf_out, 3 - self.count)
+        row_ctrl = bit(self.row_ctrl_buf_out, 3 - self.count)
+        return (col << 4) | row, (col_ctrl << 1) | row_ctrl
+
+    # One rising clock edge with these inputs
+    def clock(self, ui_in, uio_in, rst_n=1):
+        if not rst_n:
+            return self.reset()
+        count = self.count
+        col_in, row_in = ui_in >> 4, ui_in & 0xf
+        col_ctrl_in, row_ctrl_in = bit(uio_in, 3), bit(uio_in, 2)
+        ci = (self.col_buf_in << 4) | col_in
+        ri = (self.row_buf_in << 4) | row_in
+        cci = (self.col_ctrl_buf_in << 1) | col_ctrl_in
+        rci = (self.row_ctrl_buf_in << 1) | row_ctrl_in
+        C0, C1, C2, C3 = self.C
+        (p0, s0), (p1, s1), (p2, s2) = self.pipe
+        pin = pipe_in(count, ci, self.col_buf_out, cci, self.col_ctrl_buf_out,
+                      ri, self.row_buf_out, rci, self.row_ctrl_buf_out, C0, C1, C2, C3)
+        P3, S3 = pipe3(p2, s2)
+        rw0 = bits(cci, 3, 2) == 0b10 and bits(rci, 3, 2) == 0b01
+        rw1 = bits(cci, 3, 2) == 0b11 and bits(rci, 3, 2) == 0b00
+
+        # Input buffers
+        if count < 3:
+            shift = 4 * (2 - count)
+            self.col_buf_in = (self.col_buf_in & ~(0xf << shift)) | (col_in << shift)
+            self.row_buf_in = (self.row_buf_in & ~(0xf << shift)) | (row_in << shift)
+            self.col_ctrl_buf_in = (self.col_ctrl_buf_in & ~(1 << (2 - count))) | (col_ctrl_in << (2 - count))
+            self.row_ctrl_buf_in = (self.row_ctrl_buf_in & ~(1 << (2 - count))) | (row_ctrl_in << (2 - count))
+        # Output buffers
+        if count == 3:
+            if rw0:
+                self.col_buf_out, self.row_buf_out = C0, P3 if S3 else C1
+            elif rw1:
+                self.col_buf_out, self.row_buf_out = C2, C3
+            else:
+                self.col_buf_out, self.row_buf_out = ci, ri
+            self.col_ctrl_buf_out, self.row_ctrl_buf_out = cci, rci
+        # Pipeline
+        self.pipe = [pipe0(*pin), pipe1(p0, s0), pipe2(p1, s1)]
+        # Accumulator
+        if count == 3:
+            if rw0:
+                self.C[0], self.C[1] = ci, ri
+            else:
+                if rw1:
+                    self.C[2], self.C[3] = ci, ri
+                if S3:
+                    self.C[1] = P3
+        elif S3:
+            self.C[[2, 3, 0][count]] = P3
+        self.count = (count + 1) & 3
+
+    # Outputs for this cycle, then clock in the inputs
+    def cycle(self, ui_in, uio_in, rst_n=1):
+        out = self.outputs(rst_n)
+        self.clock(ui_in, uio_in, rst_n)
+        return out
+
+
+# Per-cycle (ui_in, uio_in) for a block of col/row data and control
+# (data is 16 bits, control is a 4 character bit string, both MSB first)
+def block_cycles(col, col_ctrl, row, row_ctrl):
+    return [((((col >> (12 - 4 * j)) & 0xf) << 4) | ((row >> (12 - 4 * j)) & 0xf),
+             (int(col_ctrl[j]) << 3) | (int(row_ctrl[j]) << 2)) for j in range(4)]
+
+
+# Run blocks of (col, col_ctrl, row, row_ctrl) through the tile,
+# returning the blocks that come out, one block later
+def run_blocks(tile, blocks):
+    out = []
+    for block in blocks:
+        cycles = [tile.cycle(ui, uio) for ui, uio in block_cycles(*block)]
+        col = sum((uo >> 4) << (12 - 4 * j) for j, (uo, _) in enumerate(cycles))
+        row = sum((uo & 0xf) << (12 - 4 * j) for j, (uo, _) in enumerate(cycles))
+        col_ctrl = ''.join(str(bit(uio, 1)) for _, uio in cycles)
+        row_ctrl = ''.join(str(bit(uio, 0)) for _, uio in cycles)
+        out.append((col, col_ctrl, row, row_ctrl))
+    return out
+
+
+# A rows x cols grid of tiles wired like gridtb.v: col_out goes south into the
+# next tile's col_in, row_out east into the next tile's row_in
+class Grid:
+    def __init__(self, rows, cols):
+        self.rows, self.cols = rows, cols
+        self.tiles = [[Tile() for _ in range(cols)] for _ in range(rows)]
+
+    # South and east edge outputs for this cycle, then clock in the north and
+    # west edge inputs, all as lists of (nibble, ctrl) per column and per row
+    def cycle(self, col_in, row_in):
+        outs = [[tile.outputs() for tile in tiles] for tiles in self.tiles]
+        south = lambda r, c: (outs[r][c][0] >> 4, bit(outs[r][c][1], 1))
+        east = lambda r, c: (outs[r][c][0] & 0xf, bit(outs[r][c][1], 0))
+        for r, tiles in enumerate(self.tiles):
+            for c, tile in enumerate(tiles):
+                col, col_ctrl = col_in[c] if r == 0 else south(r - 1, c)
+                row, row_ctrl = row_in[r] if c == 0 else east(r, c - 1)
+                tile.clock((col << 4) | row, (col_ctrl << 3) | (row_ctrl << 2))
+        return ([south(self.rows - 1, c) for c in range(self.cols)],
+                [east(r, self.cols - 1) for r in range(self.rows)])
+
+
+if __name__ == "__main__":
+    from fp import E4M3, E5M2, FP16, fma
+
+    # Check against the floating point reference: write in C, K MACs, read out C
+    same = lambda a, b: (a.f != a.f and b.f != b.f) or a.f == b.f
+    for _ in range(1000):
+        tile = Tile()
+        C = [FP16.rand() for _ in range(4)]
+        K = random.randint(1, 4)
+        A = [[random.choice([E5M2, E4M3]).rand() for _ in range(2)] for _ in range(K)]
+        B = [[random.choice([E5M2, E4M3]).rand() for _ in range(2)] for _ in range(K)]
+        fmt = lambda x: '1' if isinstance(x, E4M3) else '0'
+        h = lambda *xs: int(''.join(x.h for x in xs), 16)
+        blocks = [(h(C[0]), '1000', h(C[1]), '0100'), (h(C[2]), '1100', h(C[3]), '0000')]
+        blocks += [(h(*a), f"0{fmt(a[0])}{fmt(a[1])}0", h(*b), f"1{fmt(b[0])}{fmt(b[1])}0")
+                   for a, b in zip(A, B)]
+        blocks += [(0, '1000', 0, '0100'), (0, '1100', 0, '0000'), (0, '0000', 0, '0000')]
+        out = run_blocks(tile, blocks)
+        got = [FP16.fromh(f"{x:04x}") for x in [out[-2][0], out[-2][2], out[-1][0], out[-1][2]]]
+        for (a0, a1), (b0, b1) in zip(A, B):
+            C = [fma(a0, b0, C[0]), fma(a1, b0, C[1]), fma(a0, b1, C[2]), fma(a1, b1, C[3])]
+        assert all(same(g, c) for g, c in zip(got, C)), f"A={A} B={B} got={got} expected={C}"
+        # Everything else passes through a block later
+        for i in range(len(blocks) - 3):
+            assert out[i + 1][1::2] == blocks[i][1::2], (i, out[i + 1], blocks[i])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# %%
+# Drive N independent tiles in one simulation (see multitb.v), each with its own
+# random sequence and scoreboard, so the per-cycle simulator overhead is shared.
+import logging
+import os
+import random
+
+import cocotb
+
+import probe
+from test import TEST_N, mul22, reset, run_sequence
+from waves import BlockFailure
+
+# Should match multi.mk
+MULTI_N = int(os.environ.get("MULTI_N", 8))
+
+
+# One tile's pins, looking just like the single tile tb to the test.py helpers
+class Tile:
+    def __init__(self, dut, i):
+        scope = dut.tile[i]
+        self.clk = dut.clk
+        self.ui_in = scope.ui_in
+        self.uio_in = scope.uio_in
+        self.uo_out = scope.uo_out
+        self.uio_out = scope.uio_out
+        self.tt_um_machinaut_systolic = scope.tt_um_machinaut_systolic  # for COSIM=regs and PROBE
+        self._log = logging.getLogger(f"cocotb.multitb.tile{i}")
+
+
+# Results for one tile
+class Scoreboard:
+    def __init__(self, name):
+        self.name = name
+        self.sequences = 0
+        self.blocks = 0
+        self.macs = 0
+        self.failure = None
+
+    def passed(self, blocks):
+        self.sequences += 1
+        self.blocks += len(blocks)
+        self.macs += 4 * sum(1 for b in blocks if b.get('a', 0) == 1)
+
+    def failed(self, sequence, error):
+        self.failure = (sequence, error)
+
+    def __str__(self):
+        s = f"{self.name}: {self.sequences} sequences, {self.blocks} blocks, {self.macs} MACs"
+        if self.failure is not None:
+            s += f", FAILED sequence {self.failure[0]}: {self.failure[1]}"
+        return s
+
+
+# Random sequence: write in C, K multiply-accumulate blocks, read out C
+def random_sequence(rs):
+    if rs.random() < 0.25:  # Passthrough only
+        blocks = [{'ci': f"{rs.getrandbits(16):04x}", 'ri': f"{rs.getrandbits(16):04x}"}
+                  for _ in range(rs.randint(1, 4))]
+        return blocks + [{}]
+    K = rs.randint(1, 4)
+    Ah = f"{rs.getrandbits(16 * K):0{4 * K}x}"
+    Bh = f"{rs.getrandbits(16 * K):0{4 * K}x}"
+    Ci = f"{rs.getrandbits(64):016x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh, Ci)
+    blocks = [
+        {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
+        {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
+    ]
+    for k in range(K):
+        blocks.append({'a': 1, 'ci': Ah[4 * k:4 * k + 4], 'ri': Bh[4 * k:4 * k + 4],})
+    blocks[2].update({'co': '0000', 'ro': '0000'})
+    blocks += [
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+    return blocks
+
+
+# Run random sequences on one tile until done or the first failure
+async def run_tile(tile, board, rs, n):
+    for i in range(n):
+        blocks = random_sequence(rs)
+        try:
+            await run_sequence(tile, blocks=blocks)
+        except BlockFailure as e:
+            # The tile state is unknown after a failure, so stop this one
+            board.failed(i, e)
+            root, ext = os.path.splitext(probe.PROBE_FILE)
+            if probe.flush(tile, f"{root}_{board.name}{ext}", str(e)):
+                tile._log.info(f"  probes written to {root}_{board.name}{ext}")
+            return
+        board.passed(blocks)
+
+
+@cocotb.test()
+async def test_multi(dut):
+    dut._log.info(f"start test_multi with {MULTI_N} tiles")
+    await reset(dut)
+    seed = random.getrandbits(32)
+    dut._log.info(f"  seed {seed}")
+    tiles = [Tile(dut, i) for i in range(MULTI_N)]
+    boards = [Scoreboard(f"tile{i}") for i in range(MULTI_N)]
+    tasks = [
+        cocotb.start_soon(run_tile(tile, board, random.Random(f"{seed}-{i}"), TEST_N))
+        for i, (tile, board) in enumerate(zip(tiles, boards))
+    ]
+    for task in tasks:
+        await task
+    for board in boards:
+        dut._log.info(f"  {board}")
+    total = sum(board.blocks for board in boards)
+    dut._log.info(f"  {total} blocks checked across {MULTI_N} tiles")
+    failed = [board for board in boards if board.failure is not None]
+    assert not failed, "\n".join(str(board) for board in failed)
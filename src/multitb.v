@@ -0,0 +1,44 @@
+`default_nettype none
+`timescale 1ns/1ps
+
+/*
+this testbench instantiates N independent copies of the module, each with its
+own pins, so one simulation can check N independent sequences at once
+*/
+
+// testbench is controlled by multi.py
+module multitb #(parameter N = 8) ();
+
+    // shared clock and reset, everything else is per instance
+    reg  clk;
+    reg  rst_n;
+    reg  ena;
+
+    genvar i;
+    generate
+        for (i = 0; i < N; i = i + 1) begin : tile
+            reg  [7:0] ui_in;
+            reg  [7:0] uio_in;
+            wire [7:0] uo_out;
+            wire [7:0] uio_out;
+            wire [7:0] uio_oe;
+
+            tt_um_machinaut_systolic tt_um_machinaut_systolic (
+            // include power ports for the Gate Level test
+            `ifdef GL_TEST
+                .VPWR( 1'b1),
+                .VGND( 1'b0),
+            `endif
+                .ui_in      (ui_in),    // Dedicated inputs
+                .uo_out     (uo_out),   // Dedicated outputs
+                .uio_in     (uio_in),   // IOs: Input path
+                .uio_out    (uio_out),  // IOs: Output path
+                .uio_oe     (uio_oe),   // IOs: Enable path (active high: 0=input, 1=output)
+                .ena        (ena),      // enable - goes high when design is selected
+                .clk        (clk),      // clock
+                .rst_n      (rst_n)     // not reset
+                );
+        end
+    endgenerate
+
+endmodule
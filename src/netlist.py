@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# %%  Bit-parallel evaluation of the synthesized pipeline netlist
+# Gate-level simulation is too slow to run much, so this evaluates the
+# synthesized logic of pipe.v directly: yosys maps it to simple gates (and
+# writes JSON), the gates are put in levels (each only depends on earlier
+# levels), and each level is a few numpy ops on uint64 words, one per kind of
+# gate, with 64 test vectors in every word (vector k is bit k % 64 of word
+# k // 64).  That's fast enough to check every FP8 product against model.py.
+# Any yosys JSON netlist of these gates loads (write_json after abc -g, as
+# synth below), and any Verilog yosys can read is synthesized first, but only
+# the pipeline stages can be checked: modules pipe0-3 (with pipe.v's ports) or
+# pipechain, not the whole tile (so not the GDS gate_level_netlist.v).
+# yosys is found on the PATH, or as yowasp-yosys (pip install yowasp-yosys).
+#   ./netlist.py                 # synthesize pipe.v, check every FP8 product and format
+#   ./netlist.py --keep netlists # keeping the JSON netlists
+#   ./netlist.py --netlist netlists/pipechain.json   # check one already made
+#   ./netlist.py --verilog pipe.v --top pipe2          # just one stage
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+from model import pipe0, pipe1, pipe2, pipe3
+from vectors import rand16
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GATES = "AND,NAND,OR,NOR,XOR,XNOR,ANDNOT,ORNOT,MUX"
+# The four stages back to back, as in pipetb.v, without the registers
+CHAIN = """
+module pipechain (
+    input wire [7:0] A, input wire [7:0] B, input wire [15:0] C,
+    input wire Afmt, input wire Bfmt, input wire save,
+    output wire [15:0] out, output wire saveout
+    );
+    wire [33:0] w0; wire [31:0] w1; wire [39:0] w2; wire s0, s1, s2;
+    pipe0 p0(.A(A), .B(B), .C(C), .Afmt(Afmt), .Bfmt(Bfmt), .save(save), .out(w0), .saveout(s0));
+    pipe1 p1(.in(w0), .save(s0), .out(w1), .saveout(s1));
+    pipe2 p2(.in(w1), .save(s1), .out(w2), .saveout(s2));
+    pipe3 p3(.in(w2), .save(s2), .out(out), .saveout(saveout));
+endmodule
+"""
+
+# Gate functions on words, with their input pins
+OPS = {
+    "$_BUF_": (lambda a: a, "A"),
+    "$_NOT_": (lambda a: ~a, "A"),
+    "$_AND_": (lambda a, b: a & b, "AB"),
+    "$_NAND_": (lambda a, b: ~(a & b), "AB"),
+    "$_OR_": (lambda a, b: a | b, "AB"),
+    "$_NOR_": (lambda a, b: ~(a | b), "AB"),
+    "$_XOR_": (lambda a, b: a ^ b, "AB"),
+    "$_XNOR_": (lambda a, b: ~(a ^ b), "AB"),
+    "$_ANDNOT_": (lambda a, b: a & ~b, "AB"),
+    "$_ORNOT_": (lambda a, b: a | ~b, "AB"),
+    "$_MUX_": (lambda a, b, s: (a & ~s) | (b & s), "ABS"),
+}
+
+
+def yosys():
+    for exe in ("yosys", "yowasp-yosys"):
+        if shutil.which(exe):
+            return exe
+    raise RuntimeError("needs yosys or yowasp-yosys on the PATH")
+
+
+# Synthesize module top of the Verilog sources (text) into gates, written as
+# JSON to out.  Everything goes through a script in out's directory, since
+# yowasp-yosys only sees some paths (not /tmp).
+def synth(sources, top, out):
+    d, name = os.path.split(os.path.abspath(out))
+    script = "".join(f"read_verilog -sv <<EOT\n{src}\nEOT\n" for src in sources)
+    script += f"synth -flatten -top {top}\nabc -g {GATES}\nopt_clean\nwrite_json {name}\n"
+    with open(os.path.join(d, f"{top}.ys"), "w") as f:
+        f.write(script)
+    subprocess.run([yosys(), "-q", "-s", f"{top}.ys"], cwd=d, check=True)
+    return out
+
+
+@dataclass
+class Netlist:
+    top: str
+    inputs: dict  # port name -> net numbers, LSB first
+    outputs: dict
+    nets: int  # 0 and 1 are the constants
+    levels: list  # per level, (op, output nets, input nets per pin) for each kind of gate
+    gates: int
+
+    # Words for each output bit from words for each input bit, as
+    # {port: (width, words) uint64} in and out
+    def evaluate(self, words):
+        n = len(next(iter(words.values()))[0])
+        vals = np.zeros((self.nets, n), dtype=np.uint64)
+        vals[1] = ~np.uint64(0)
+        for name, nets in self.inputs.items():
+            vals[nets] = words[name]
+        for level in self.levels:
+            for op, out, ins in level:
+                vals[out] = op(*(vals[i] for i in ins))
+        return {name: vals[nets] for name, nets in self.outputs.items()}
+
+    # Outputs for vectors of input values, as {port: int array} in and out
+    def run(self, **values):
+        n = len(next(iter(values.values())))
+        words = {name: pack(values[name], len(nets)) for name, nets in self.inputs.items()}
+        return {name: unpack(w, n) for name, w in self.evaluate(words).items()}
+
+
+# Load module top (or the only one) of a yosys JSON netlist, in levels
+def load(path, top=None):
+    with open(path) as f:
+        modules = json.load(f)["modules"]
+    top = top or next(iter(modules))
+    m = modules[top]
+    net = lambda b: b if isinstance(b, int) else 1 if b == "1" else 0  # x and z as 0
+    ports = {d: {name: [net(b) for b in p["bits"]] for name, p in m["ports"].items() if p["direction"] == d}
+             for d in ("input", "output")}
+    gates, driver = [], {}
+    for name, cell in m["cells"].items():
+        if cell["type"] == "$scopeinfo":
+            continue
+        if cell["type"] not in OPS:
+            raise ValueError(f"{name}: {cell['type']} isn't a combinational gate (synthesize with abc -g {GATES})")
+        c = cell["connections"]
+        gates.append((cell["type"], net(c["Y"][0]), [net(c[p][0]) for p in OPS[cell["type"]][1]]))
+        driver[gates[-1][1]] = len(gates) - 1
+    # Level of each gate, one more than the latest of its inputs (inputs and constants are 0)
+    fanout, waiting = defaultdict(list), []
+    for g, (_, _, ins) in enumerate(gates):
+        deps = {driver[i] for i in ins if i in driver}
+        waiting.append(len(deps))
+        for d in deps:
+            fanout[d].append(g)
+    level = [1 if w == 0 else 0 for w in waiting]
+    ready = [g for g, w in enumerate(waiting) if w == 0]
+    for g in ready:  # grows as gates become ready
+        for h in fanout[g]:
+            level[h] = max(level[h], level[g] + 1)
+            waiting[h] -= 1
+            if waiting[h] == 0:
+                ready.append(h)
+    if len(ready) < len(gates):
+        raise ValueError(f"combinational loop through {len(gates) - len(ready)} gates")
+    groups = defaultdict(lambda: defaultdict(list))
+    for g, (kind, out, ins) in enumerate(gates):
+        groups[level[g]][kind].append((out, ins))
+    levels = [[(OPS[kind][0], np.array([o for o, _ in gs]), tuple(np.array(i) for i in zip(*(i for _, i in gs))))
+               for kind, gs in groups[n].items()] for n in sorted(groups)]
+    nets = 1 + max([1] + [b for bits in ports["input"].values() for b in bits]
+                   + [b for bits in ports["output"].values() for b in bits] + [o for _, o, _ in gates]
+                   + [i for _, _, ins in gates for i in ins])
+    return Netlist(top, ports["input"], ports["output"], nets, levels, len(gates))
+
+
+# Values (n,) to words (width, n / 64) with vector k at bit k % 64 of word k // 64
+def pack(x, width):
+    x = np.asarray(x, dtype=np.uint64)
+    n = -len(x) % 64
+    bits = ((x[None, :] >> np.arange(width, dtype=np.uint64)[:, None]) & np.uint64(1)).astype(np.uint8)
+    bits = np.pad(bits, ((0, 0), (0, n)))
+    return np.packbits(bits, axis=1, bitorder="little").view("<u8")
+
+
+# And back, the first n vectors
+def unpack(words, n):
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1, bitorder="little")[:, :n]
+    return (bits.astype(np.uint64) << np.arange(len(words), dtype=np.uint64)[:, None]).sum(axis=0)
+
+
+TOPS = ["pipe0", "pipe1", "pipe2", "pipe3", "pipechain"]
+
+
+# What model.py says a netlist of one of TOPS gives, for one vector
+def reference(top, v):
+    if top == "pipechain":
+        x, s = pipe0(v["A"], v["B"], v["C"], v["Afmt"], v["Bfmt"], v["save"])
+        for stage in (pipe1, pipe2, pipe3):
+            x, s = stage(x, s)
+        return x, s
+    if top == "pipe0":
+        return pipe0(v["A"], v["B"], v["C"], v["Afmt"], v["Bfmt"], v["save"])
+    return {"pipe1": pipe1, "pipe2": pipe2, "pipe3": pipe3}[top](v["in"], v["save"])
+
+
+# And for vectors of input values, as {port: int array} in and out
+def golden(top, **values):
+    names = list(values)
+    out = [reference(top, dict(zip(names, v))) for v in zip(*(values[k].tolist() for k in names))]
+    return {port: np.array(x, dtype=np.uint64) for port, x in zip(("out", "saveout"), zip(*out))}
+
+
+# Every A, B and format pair (2^18 vectors) with C drawn by c(n)
+def products(c):
+    A, B, Afmt, Bfmt = (x.ravel() for x in np.meshgrid(np.arange(256), np.arange(256), [0, 1], [0, 1]))
+    n = len(A)
+    vec = {"A": A, "B": B, "C": c(n), "Afmt": Afmt, "Bfmt": Bfmt, "save": np.ones(n, dtype=np.int64)}
+    return {k: np.asarray(v, dtype=np.uint64) for k, v in vec.items()}
+
+
+# Check a netlist against the model, returning the vectors checked
+def check(net, rs, n_random=1 << 16):
+    width = lambda name: len(net.inputs[name])
+    rand = lambda bits, n: np.array([rs.getrandbits(bits) for _ in range(n)], dtype=np.uint64)
+    if net.top in ("pipechain", "pipe0"):
+        # Every product, with C random, then each special C
+        specials = [0x0000, 0x8000, 0x3c00, 0x7bff, 0x7c00, 0xfc00, 0x7fff, 0x0001]
+        cs = [lambda n: [rand16(rs) for _ in range(n)]] + [lambda n, c=c: [c] * n for c in specials]
+        sets = [products(c) for c in cs]
+    else:
+        sets = []
+    # Random bits everywhere, save on and off
+    sets.append({name: rand(width(name), n_random) for name in net.inputs})
+    total = 0
+    for vec in sets:
+        got, ref = net.run(**vec), golden(net.top, **vec)
+        for port in ("out", "saveout"):
+            bad = np.flatnonzero(got[port] != ref[port])
+            if len(bad):
+                k = bad[0]
+                raise AssertionError(f"{net.top}.{port} {got[port][k]:x} != {ref[port][k]:x} for "
+                                     + ", ".join(f"{n}={int(v[k]):x}" for n, v in vec.items())
+                                     + f" ({len(bad)} of {len(ref[port])} vectors wrong)")
+        total += len(ref["out"])
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="check the synthesized pipeline netlist against the model")
+    parser.add_argument("--netlist", default=None, help="yosys JSON netlist to check (pipechain or a stage)")
+    parser.add_argument("--verilog", nargs="+", default=None,
+                        help="Verilog to synthesize instead of pipe.v, defining pipe0-3 with its ports"
+                             " (with any cell models they need)")
+    parser.add_argument("--top", default=None,
+                        help="module to check (default: the first, or all of pipe0-3 and pipechain)")
+    parser.add_argument("--keep", default=None, help="directory to keep the synthesized netlists in")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rs = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as d:
+        out = args.keep or d
+        os.makedirs(out, exist_ok=True)
+        if args.netlist:
+            paths = [(args.netlist, args.top)]
+        else:
+            sources = [CHAIN]
+            for path in args.verilog or [os.path.join(HERE, "pipe.v")]:
+                with open(path) as f:
+                    sources.insert(-1, f.read())
+            paths = []
+            for top in [args.top] if args.top else TOPS:
+                t = time.perf_counter()
+                paths.append((synth(sources, top, os.path.join(out, f"{top}.json")), top))
+                print(f"synthesized {top} in {time.perf_counter() - t:.1f} s")
+        for path, top in paths:
+            net = load(path, top)
+            if net.top not in TOPS:
+                raise SystemExit(f"can only check the pipeline stages (pipe0-3 or pipechain), not {net.top}")
+            # Evaluation speed alone, then the check (the model is most of the time)
+            bits = np.random.default_rng(args.seed)
+            words = {name: bits.integers(0, 2**64, size=(len(nets), 4096), dtype=np.uint64)
+                     for name, nets in net.inputs.items()}
+            t = time.perf_counter()
+            net.evaluate(words)
+            t = time.perf_counter() - t
+            n = check(net, rs)
+            print(f"{net.top}: {net.gates} gates in {len(net.levels)} levels, {64 * 4096 / t / 1e6:.1f}M vectors/s,"
+                  f" {n} vectors match the model")
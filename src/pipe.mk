@@ -5,6 +5,35 @@
 SIM ?= icarus
 TOPLEVEL_LANG ?= verilog
 
+# waveforms: DUMP=fail replays failing iterations with dumping on around the failure,
+# DUMP=all dumps the whole run (slow), DUMP=none never dumps
+DUMP ?= fail
+ifeq ($(DUMP),all)
+PLUSARGS += +dumpall
+endif
+ifeq ($(DUMP),none)
+PLUSARGS += +dumpnone
+endif
+ifdef DUMP_WINDOW
+PLUSARGS += +dumpwindow=$(DUMP_WINDOW)
+endif
+ifeq ($(SIM),icarus)
+PLUSARGS += -fst
+endif
+
+# verilator: make SIM=verilator, usually much faster for long runs (see simbench.py)
+# tracing is compiled in unless DUMP=none, and switched by dump_en through dump.cpp,
+# as FST where verilator's FST writer can build (it needs lz4), otherwise VCD
+ifeq ($(SIM),verilator)
+COMPILE_ARGS += --no-timing $(PWD)/dump.cpp
+COMPILE_ARGS += -Wno-WIDTHEXPAND -Wno-WIDTHTRUNC
+CUSTOM_COMPILE_DEPS += $(PWD)/dump.cpp
+ifneq ($(DUMP),none)
+LZ4 := $(shell $(CXX) -E -include lz4.h -x c++ /dev/null >/dev/null 2>&1 && echo yes)
+COMPILE_ARGS += $(if $(LZ4),--trace-fst,--trace) --trace-structs
+endif
+endif
+
 # this is the only part you should need to modify:
 VERILOG_SOURCES += $(PWD)/pipetb.v $(PWD)/pipe.v
 
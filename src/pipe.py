@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # %%
+import os
 import random
 from itertools import product
 
@@ -7,9 +8,11 @@ import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import ClockCycles, FallingEdge, RisingEdge, Timer
 
+import ties
 from fp import E4M3, E5M2, FP16, fma, is_bin, is_hex
+from waves import DUMP_FAIL, dump
 
-TEST_N = 1000  # TODO: turn this down to 10 for submission
+TEST_N = int(os.environ.get("TEST_N", 1000))  # TODO: turn this down to 10 for submission
 # random.seed(0)  # TODO: deterministic seed for submission
 
 
@@ -40,6 +43,23 @@ async def test_zero(dut):
     assert dut.Pipe3Save.value.binstr == "1"
 
 
+# Run a check, replaying it with waveforms dumped if it fails
+async def check(dut, fn, *args):
+    try:
+        await fn(dut, *args)
+    except AssertionError:
+        if DUMP_FAIL:
+            dut._log.info(f"  replaying {fn.__name__}({', '.join(map(str, args))}) into pipetb.fst")
+            dump(dut, True)
+            try:
+                await fn(dut, *args)
+            except AssertionError:
+                pass
+            dump(dut, False)
+            await Timer(1, units="ns")
+        raise
+
+
 # Pass through C and return the result
 async def check_pass(dut, Ci):
     await reset(dut)
@@ -58,11 +78,11 @@ async def test_pass(dut):
     dut._log.info("start test_pass")
     # Special values
     for Ch in ['0000', '8000', '7fff', '7c00', 'fc00', '7ff0', 'fffe']:
-        await check_pass(dut, f"{int(Ch, 16):016b}")
+        await check(dut, check_pass, f"{int(Ch, 16):016b}")
     # Random value tests
     for _ in range(TEST_N):
         Ci = f"{random.randint(0, 2**16 - 1):016b}"
-        await check_pass(dut, Ci)
+        await check(dut, check_pass, Ci)
 
 
 # Check A * B
@@ -97,22 +117,22 @@ async def test_identity(dut):
         vals = [0., E5M2.MIN, E5M2.MIN * 2, E4M3.MIN, 1., E4M3.MAX, E5M2.MAX, 'inf', 'nan']
         vals = sum([[float(v), -float(v)] for v in vals], [])
         for a in vals:
-            await check_ab(dut, Acls.fromf(a), I)
+            await check(dut, check_ab, Acls.fromf(a), I)
         # Random value tests
         for _ in range(TEST_N):
-            await check_ab(dut, Acls.rand(), I)
+            await check(dut, check_ab, Acls.rand(), I)
         # Random real tests
         for _ in range(TEST_N):
-            await check_ab(dut, Acls.real(), I)
+            await check(dut, check_ab, Acls.real(), I)
         # Random sub tests
         for _ in range(TEST_N):
-            await check_ab(dut, Acls.real(), I)
+            await check(dut, check_ab, Acls.real(), I)
         # Random sub tests
         for _ in range(TEST_N):
-            await check_ab(dut, Acls.rsub(), I)
+            await check(dut, check_ab, Acls.rsub(), I)
         # Random sub tests
         for _ in range(TEST_N):
-            await check_ab(dut, Acls.rsub(), I)
+            await check(dut, check_ab, Acls.rsub(), I)
 
 
 # Test multiplying A * B
@@ -127,22 +147,22 @@ async def test_ab(dut):
             vals = sum([[float(v), -float(v)] for v in vals], [])
             for a in vals:
                 for b in vals:
-                    await check_ab(dut, Acls.fromf(a), Bcls.fromf(b))
+                    await check(dut, check_ab, Acls.fromf(a), Bcls.fromf(b))
             # Random value tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rand(), Bcls.rand())
+                await check(dut, check_ab, Acls.rand(), Bcls.rand())
             # Random real tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.real(), Bcls.real())
+                await check(dut, check_ab, Acls.real(), Bcls.real())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.real(), Bcls.rsub())
+                await check(dut, check_ab, Acls.real(), Bcls.rsub())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rsub(), Bcls.real())
+                await check(dut, check_ab, Acls.rsub(), Bcls.real())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rsub(), Bcls.rsub())
+                await check(dut, check_ab, Acls.rsub(), Bcls.rsub())
 
 # Test multiplying A * B + C
 @cocotb.test()
@@ -157,19 +177,28 @@ async def test_ab(dut):
             for a in vals:
                 for b in vals:
                     for c in vals:
-                        await check_ab(dut, Acls.fromf(a), Bcls.fromf(b), FP16.fromf(c))
+                        await check(dut, check_ab, Acls.fromf(a), Bcls.fromf(b), FP16.fromf(c))
             # Random value tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rand(), Bcls.rand(), FP16.rand())
+                await check(dut, check_ab, Acls.rand(), Bcls.rand(), FP16.rand())
             # Random real tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.real(), Bcls.real(), FP16.real())
+                await check(dut, check_ab, Acls.real(), Bcls.real(), FP16.real())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.real(), Bcls.rsub(), FP16.rsub())
+                await check(dut, check_ab, Acls.real(), Bcls.rsub(), FP16.rsub())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rsub(), Bcls.real(), FP16.rsub())
+                await check(dut, check_ab, Acls.rsub(), Bcls.real(), FP16.rsub())
             # Random sub tests
             for _ in range(TEST_N):
-                await check_ab(dut, Acls.rsub(), Bcls.rsub(), FP16.rsub())
\ No newline at end of file
+                await check(dut, check_ab, Acls.rsub(), Bcls.rsub(), FP16.rsub())
+
+
+# Test every exact rounding tie in the product and the sum (see ties.py)
+@cocotb.test()
+async def test_ties(dut):
+    await cocotb.start_soon(reset(dut))
+    dut._log.info("start test_ties")
+    for A, B, C in ties.suite():
+        await check(dut, check_ab, A, B, C)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# %%  Streaming multi-layer pipeline of emulated matmuls (see emulate.py)
+# Activations flow through as panels of rows: each stage multiplies a panel of
+# FP8 codes by its layer's weights, a tile of output columns at a time, and
+# requantizes each FP16 output tile to FP8 as soon as it is produced, so the
+# next stage only ever sees one panel.  Rows are independent, so this is bit
+# for bit the same as running each whole layer and requantizing its output,
+# but no whole activation matrix is ever held in memory.
+#   ./pipeline.py              # check against whole layers, then time one
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import numpy as np
+
+from emulate import accumulate, decode8, decode16, emulate_matmul, encode16, quantize8
+
+
+@dataclass
+class Layer:
+    B: np.ndarray  # K x N FP8 codes (weights)
+    b_fmt: object = 0  # 0 (E5M2), 1 (E4M3), or K x N of them
+    bias: np.ndarray = None  # N FP16 codes every row starts from, or zeros
+    out_fmt: int = 0  # FP8 format the outputs are requantized to, None for FP16
+
+
+@dataclass
+class Stats:
+    name: str
+    rows: int = 0
+    macs: int = 0
+    seconds: float = 0.  # in this stage only, not waiting on the one before
+    peak: int = 0  # bytes allocated on top of what there was at the start of a panel
+    high: int = 0  # most bytes allocated in total while running a panel
+
+    def __str__(self):
+        rate = lambda x: x / self.seconds if self.seconds else 0.
+        return (f"{self.name}: {self.rows} rows in {self.seconds:.2f} s, {rate(self.rows):.0f} rows/s,"
+                f" {rate(self.macs) / 1e6:.1f} MMAC/s, peak {self.peak / 1e3:.0f} kB")
+
+
+# Panels of rows of an activation matrix (which may be memory mapped)
+def row_panels(X, fmt=0, rows=256):
+    for i in range(0, len(X), rows):
+        yield X[i:i + rows], fmt if np.ndim(fmt) == 0 else fmt[i:i + rows]
+
+
+# One layer over a stream of (FP8 codes, formats) panels, yielding the outputs
+# for each panel as they are produced (requantized, unless out_fmt is None)
+def stage(layer, panels, stats, tile=256):
+    K, N = layer.B.shape
+    # Weights are decoded once, a tile of columns at a time
+    fmt = lambda j: layer.b_fmt if np.ndim(layer.b_fmt) == 0 else layer.b_fmt[:, j:j + tile]
+    weights = [(j, decode8(layer.B[:, j:j + tile], fmt(j))) for j in range(0, N, tile)]
+    for a, a_fmt in panels:
+        t = time.perf_counter()
+        if tracemalloc.is_tracing():
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        a = decode8(a, a_fmt)
+        out = np.empty((len(a), N), dtype=np.uint16 if layer.out_fmt is None else np.uint8)
+        for j, b in weights:
+            acc = np.zeros((len(a), b.shape[1]), dtype=np.float16)
+            if layer.bias is not None:
+                acc[...] = decode16(layer.bias[j:j + tile])
+            D = encode16(accumulate(acc, a, b)) if K else acc.view(np.uint16)
+            out[:, j:j + tile] = D if layer.out_fmt is None else quantize8(D, layer.out_fmt)
+        if tracemalloc.is_tracing():
+            high = tracemalloc.get_traced_memory()[1]
+            stats.peak, stats.high = max(stats.peak, high - start), max(stats.high, high)
+        stats.rows += len(a)
+        stats.macs += len(a) * K * N
+        stats.seconds += time.perf_counter() - t
+        yield out, layer.out_fmt
+
+
+# Chain the layers over a stream of panels, returning the output panels (a
+# generator, nothing runs until it is consumed) and the stats for each stage
+def pipeline(layers, panels, tile=256):
+    stats = [Stats(f"layer {i}") for i in range(len(layers))]
+    for layer, s in zip(layers, stats):
+        panels = stage(layer, panels, s, tile)
+    return panels, stats
+
+
+# Whole layers at a time, for reference
+def reference(layers, X, fmt=0):
+    for layer in layers:
+        C = None if layer.bias is None else np.broadcast_to(layer.bias, (len(X), layer.B.shape[1]))
+        X = emulate_matmul(X, layer.B, C, fmt, layer.b_fmt)
+        X, fmt = (X, None) if layer.out_fmt is None else (quantize8(X, layer.out_fmt), layer.out_fmt)
+    return X
+
+
+# Random layers of the given widths, with small weights so outputs stay in range
+def random_layers(rs, widths, out_fmts):
+    layers = []
+    for K, N, out_fmt in zip(widths, widths[1:], out_fmts):
+        b_fmt = rs.integers(0, 2, size=(K, N))
+        exp = rs.integers(-4, 0, size=(K, N)) + np.where(b_fmt, 7, 15)
+        man = rs.integers(0, 8, size=(K, N))
+        B = (rs.integers(0, 2, size=(K, N)) << 7) | np.where(b_fmt, (exp << 3) | man, (exp << 2) | (man & 3))
+        bias = np.asarray(rs.normal(0, 1, size=N), dtype=np.float16).view(np.uint16)
+        layers.append(Layer(B.astype(np.uint8), b_fmt, bias, out_fmt))
+    return layers
+
+
+if __name__ == "__main__":
+    rs = np.random.default_rng(0)
+    # Streaming gives the same bits as whole layers, for any panel and tile size
+    for rows, tile in [(1, 1), (7, 5), (64, 16), (1000, 1000)]:
+        layers = random_layers(rs, [24, 40, 33, 16], [0, 1, None])
+        X = rs.integers(0, 256, size=(150, 24), dtype=np.uint8)
+        out, stats = pipeline(layers, row_panels(X, 1, rows), tile)
+        got = np.concatenate([panel for panel, _ in out])
+        assert (got == reference(layers, X, 1)).all(), (rows, tile)
+        assert all(s.rows == len(X) for s in stats)
+    print("streamed layers match whole layers")
+    # Throughput and memory, keeping only the last panel of the output
+    widths = [128, 256, 256, 64]
+    layers = random_layers(rs, widths, [1, 1, None])
+    X = rs.integers(0, 256, size=(8192, widths[0]), dtype=np.uint8)
+    tracemalloc.start()
+    out, stats = pipeline(layers, row_panels(X, 1, rows=128))
+    t = time.perf_counter()
+    for panel, _ in out:
+        pass
+    t = time.perf_counter() - t
+    tracemalloc.stop()
+    peak = max(s.high for s in stats)
+    for s in stats:
+        print(s)
+    whole = max(len(X) * (K + 2 * N) for K, N in zip(widths, widths[1:]))
+    print(f"{len(X)} rows through {len(layers)} layers in {t:.2f} s,"
+          f" peak {peak / 1e6:.1f} MB (whole activations would be {whole / 1e6:.1f} MB)")
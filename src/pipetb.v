@@ -4,12 +4,38 @@
 // testbench is controlled by test.py
 module pipetb ();
 
-    // this part dumps the trace to a vcd file that can be viewed with GTKWave
+    // this part dumps the trace to a fst file that can be viewed with GTKWave
+    // dumping is off unless +dumpall is given, otherwise the harness raises
+    // dump_en around the blocks it wants to see (e.g. replaying a failure)
+    reg dump_en;
+`ifdef VERILATOR
+    // $dumpon/$dumpoff are ignored here, dump.cpp switches its own dumper
+    import "DPI-C" function void dump_switch(input string file, input bit on);
+    initial dump_switch("pipetb.fst", $test$plusargs("dumpall") != 0);
+    always @(posedge dump_en) dump_switch("pipetb.fst", 1);
+    always @(negedge dump_en) dump_switch("pipetb.fst", 0);
+`else
+    reg dumping = 0;
     initial begin
-        $dumpfile ("pipetb.vcd");
-        $dumpvars (0, pipetb);
-        #1;
+        if ($test$plusargs("dumpall")) begin
+            $dumpfile ("pipetb.fst");
+            $dumpvars (0, pipetb);
+            dumping = 1;
+        end
     end
+    always @(posedge dump_en) begin
+        if (!dumping) begin
+            $dumpfile ("pipetb.fst");
+            $dumpvars (0, pipetb);
+            dumping = 1;
+        end else begin
+            $dumpon;
+        end
+    end
+    always @(negedge dump_en) begin
+        $dumpoff;
+    end
+`endif
 
     // Pipeline inputs
     wire [7:0]  PipeA;  // A input to pipeline
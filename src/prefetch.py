@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# %%  Make test stimulus and expected results in the background
+# The reference math (fp.fma) is slow in Python, so a test that works out each
+# batch of blocks before sending it leaves the simulator waiting.  Prefetch
+# runs make(rs) in a worker process, n times from one seeded random.Random,
+# into a bounded queue, while the test consumes the batches made before.
+# Batches come out in order, the same as making them inline with the same seed.
+# The worker is forked, so this works inside a simulator (whose executable
+# isn't Python), and make can be any function, even one defined in a test.
+#   ./prefetch.py      # check it matches inline, and time both
+import multiprocessing
+import queue
+import random
+import time
+
+
+def produce(make, n, seed, out):
+    rs = random.Random(seed)
+    for _ in range(n):
+        out.put(make(rs))
+
+
+# Iterates over the n batches.  The first one always waits for the worker to
+# start, after that any wait is a stall, where the test would have been faster
+# with more workers or a deeper queue.
+class Prefetch:
+    def __init__(self, make, n, seed, depth=4):
+        self.make, self.n, self.seed, self.depth = make, n, seed, depth
+        self.stalls = 0  # batches after the first that weren't ready when asked for
+        self.waited = 0.  # seconds spent waiting on them
+
+    def __iter__(self):
+        ctx = multiprocessing.get_context("fork")
+        out = ctx.Queue(self.depth)
+        worker = ctx.Process(target=produce, args=(self.make, self.n, self.seed, out), daemon=True)
+        worker.start()
+        try:
+            for i in range(self.n):
+                stalled, t = i > 0 and out.empty(), time.perf_counter()
+                while True:
+                    try:
+                        batch = out.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not worker.is_alive():
+                            raise RuntimeError(f"prefetch worker exited with {worker.exitcode}")
+                if stalled:
+                    self.stalls += 1
+                    self.waited += time.perf_counter() - t
+                yield batch
+        finally:
+            worker.terminate()
+            worker.join()
+
+    def __str__(self):
+        return f"{self.n} batches prefetched, stalled {self.stalls} times ({1e3 * self.waited:.0f} ms)"
+
+
+if __name__ == "__main__":
+    from gemm import random_job
+    from tilesched import schedule
+
+    # A schedule of random jobs, expected results and all
+    def make(rs):
+        return schedule([random_job(rs, 2, 2, rs.randint(1, 8), C=rs.random() < 0.5) for _ in range(4)]).blocks
+
+    # Same batches as inline with the same seed, and a consumer that takes
+    # about as long as making them only waits for the first
+    n, seed = 20, 1234
+    rs = random.Random(seed)
+    t = time.perf_counter()
+    inline = [make(rs) for _ in range(n)]
+    each = (time.perf_counter() - t) / n
+    p = Prefetch(make, n, seed)
+    t = time.perf_counter()
+    for batch, ref in zip(p, inline):
+        assert [b.keys() for b in batch] == [b.keys() for b in ref]
+        assert all(str(b.get(k)) == str(r.get(k)) for b, r in zip(batch, ref) for k in r)
+        time.sleep(1.5 * each)  # simulating it
+    t = time.perf_counter() - t
+    print(f"{p}, {t:.2f} s against {n * 2.5 * each:.2f} s making each batch first")
+    assert p.stalls <= 1
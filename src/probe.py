@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# %%  Record internal signals every cycle, written out only when wanted
+# Instead of dumping everything (see waves.py), sample a chosen set of signals
+# in the tile (pipeline registers, accumulators, ...) each cycle into
+# preallocated numpy ring buffers, which keep the last PROBE_DEPTH cycles.
+# They're written to a compressed .npz when asked (flush) or when a test
+# sequence fails, and this file reads them back as a table.
+# Each set of pins test.py drives (the tb, or each tile of multitb) gets its own
+# probe, from its first cycle after reset; gridtb isn't probed.
+# Set from the environment, e.g. make SIM=verilator PROBE=pipe,C0,C1
+#   PROBE=names   - comma separated, signals in tt_um_machinaut_systolic (or
+#                   dotted paths below it, like p3.out) or these groups:
+#                   acc, pipe, buf, regs (all the registers, as in cosim.py)
+#   PROBE_DEPTH=N - cycles kept (default 1024)
+#   PROBE_FILE=f  - where to write them (default probe.npz)
+#   ./probe.py                    # check the ring buffer and time sampling
+#   ./probe.py probe.npz --last 16 --signals C0 C1   # show what was recorded
+import argparse
+import os
+import time
+
+import numpy as np
+
+GROUPS = {
+    "acc": ["C0", "C1", "C2", "C3"],
+    "pipe": ["Pipe0s", "Pipe0Ss", "Pipe1s", "Pipe1Ss", "Pipe2s", "Pipe2Ss", "Pipe3w", "Pipe3Sw"],
+    "buf": ["col_buf_in", "col_ctrl_buf_in", "row_buf_in", "row_ctrl_buf_in",
+            "col_buf_out", "col_ctrl_buf_out", "row_buf_out", "row_ctrl_buf_out"],
+}
+GROUPS["regs"] = ["count"] + GROUPS["buf"] + GROUPS["acc"] + GROUPS["pipe"][:6]
+
+PROBE = os.environ.get("PROBE", "")
+PROBE_DEPTH = int(os.environ.get("PROBE_DEPTH", 1024))
+PROBE_FILE = os.environ.get("PROBE_FILE", "probe.npz")
+
+
+# Signal names with the groups expanded, in order, without repeats
+def expand(names):
+    out = []
+    for name in names:
+        for n in GROUPS.get(name, [name]):
+            if n not in out:
+                out.append(n)
+    return out
+
+
+# Handle for a (dotted) name below a module handle
+def lookup(top, name):
+    for part in name.split("."):
+        top = getattr(top, part)
+    return top
+
+
+class Probe:
+    # handles by name, each at most 64 bits
+    def __init__(self, handles, depth=PROBE_DEPTH):
+        self.names = list(handles)
+        self.handles = list(handles.values())
+        self.widths = np.array([len(h) for h in self.handles], dtype=np.uint8)
+        assert (self.widths <= 64).all(), dict(zip(self.names, self.widths))
+        self.values = np.zeros((depth, len(self.names)), dtype=np.uint64)
+        self.xz = np.zeros((depth, len(self.names)), dtype=bool)  # any bit X or Z
+        self.cycles = np.zeros(depth, dtype=np.int64)
+        self.depth, self.n = depth, 0  # cycles sampled since reset
+
+    def reset(self):
+        self.n = 0
+
+    # One cycle of every signal
+    def sample(self):
+        i = self.n % self.depth
+        row, xz = self.values[i], self.xz[i]
+        for j, h in enumerate(self.handles):
+            v = h.value
+            if v.is_resolvable:
+                row[j], xz[j] = v.integer, False
+            else:
+                row[j], xz[j] = 0, True
+        self.cycles[i] = self.n
+        self.n += 1
+
+    # What's in the buffers, oldest first
+    def contents(self):
+        kept = min(self.n, self.depth)
+        order = (np.arange(kept) + self.n - kept) % self.depth
+        return self.cycles[order], self.values[order], self.xz[order]
+
+    def flush(self, path=PROBE_FILE, note=""):
+        cycles, values, xz = self.contents()
+        np.savez_compressed(path, names=np.array(self.names), widths=self.widths,
+                            cycles=cycles, values=values, xz=xz, note=np.array(note))
+        return len(cycles)
+
+
+probes = {}  # by the pins they're sampled with
+
+
+# Start recording from reset (called by test.reset), keeping the buffers
+def reset(dut):
+    for p in probes.values():
+        p.reset()
+
+
+# One cycle of the tile behind pins (the dut, or a multi.py Tile), with the
+# outputs settled
+def sample(pins):
+    if PROBE:
+        if pins not in probes:
+            top = pins.tt_um_machinaut_systolic
+            probes[pins] = Probe({n: lookup(top, n) for n in expand(PROBE.split(","))})
+        probes[pins].sample()
+
+
+# Write out what's been recorded for pins (if anything), returning the cycles written
+def flush(pins, path=PROBE_FILE, note=""):
+    return probes[pins].flush(path, note) if pins in probes else 0
+
+
+# Recorded signals back as a table, oldest cycle first
+def show(path, signals=None, last=None):
+    f = np.load(path)
+    names = list(f["names"])
+    cols = [names.index(s) for s in signals] if signals else range(len(names))
+    rows = slice(-last, None) if last else slice(None)
+    digits = [(int(f["widths"][j]) + 3) // 4 for j in cols]
+    lines = [str(f["note"])] if str(f["note"]) else []
+    lines.append(f"{'cycle':>7} " + " ".join(f"{names[j]:>{max(d, len(names[j]))}}" for j, d in zip(cols, digits)))
+    for c, vals, xz in zip(f["cycles"][rows], f["values"][rows], f["xz"][rows]):
+        cells = ["x" * d if xz[j] else f"{int(vals[j]):0{d}x}" for j, d in zip(cols, digits)]
+        lines.append(f"{c:>7} " + " ".join(f"{s:>{max(d, len(names[j]))}}" for s, j, d in zip(cells, cols, digits)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="show signals recorded by a probe")
+    parser.add_argument("file", nargs="?", help="probe .npz to show (otherwise check and time)")
+    parser.add_argument("--signals", nargs="+", default=None)
+    parser.add_argument("--last", type=int, default=None, help="only the last cycles")
+    args = parser.parse_args()
+    if args.file:
+        print(show(args.file, args.signals, args.last))
+        raise SystemExit
+    import random
+    import tempfile
+
+    from cocotb.binary import BinaryValue
+
+    from cosim import registers
+    from model import Tile
+
+    # Handles onto the Python model's registers, with a width each like the RTL
+    class Handle:
+        def __init__(self, tile, name, width):
+            self.tile, self.name, self.width = tile, name, width
+
+        def __len__(self):
+            return self.width
+
+        @property
+        def value(self):
+            return BinaryValue(f"{registers(self.tile)[self.name]:0{self.width}b}")
+
+    rs = random.Random(0)
+    tile = Tile()
+    widths = {"count": 2, "Pipe0s": 34, "Pipe1s": 32, "Pipe2s": 40}
+    widths.update({n: 1 for n in ["Pipe0Ss", "Pipe1Ss", "Pipe2Ss"]})
+    widths.update({n: 4 if "ctrl" in n else 12 if "buf_in" in n else 16 for n in GROUPS["buf"] + GROUPS["acc"]})
+    p = Probe({n: Handle(tile, n, widths[n]) for n in expand(["regs"])}, depth=64)
+    # The last depth cycles come back in order, and match the model as it ran
+    seen = []
+    for n in range(150):
+        p.sample()
+        seen.append(registers(tile))
+        tile.clock(rs.getrandbits(8), rs.getrandbits(2) << 2)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "probe.npz")
+        assert p.flush(path, "check") == 64
+        f = np.load(path)
+        assert list(f["cycles"]) == list(range(86, 150))
+        for c, vals in zip(f["cycles"], f["values"]):
+            assert [int(v) for v in vals] == [seen[c][n] for n in p.names]
+        print(show(path, ["count", "C0", "Pipe2s"], last=4))
+    # Sampling cost per signal, without a simulator (a real one adds its own)
+    t, n = time.perf_counter(), 2000
+    for _ in range(n):
+        p.sample()
+    t = time.perf_counter() - t
+    print(f"{1e6 * t / n:.1f} us per cycle for {len(p.names)} signals (of which the fake handles are most)")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# %%  FP8 quantizer that picks E5M2 or E4M3 per element, row or column
+# Every A and B operand has its own format bit (W, X, Y, Z in the control), so
+# each value can take E4M3 (more precision, up to 448) or E5M2 (more range, up
+# to 57344, and inf) independently.  quantize() rounds to both (emulate.encode8,
+# bit-identical to fromf) and keeps the one with the least squared error, for
+# each element, or summed over each row or column.
+#   ./quant.py         # check against fromf, compare errors, time 4M weights
+import time
+
+import numpy as np
+
+from emulate import FP8, encode8
+from fp import E4M3, E5M2
+
+GRANULARITY = ("element", "row", "column", "matrix")
+
+
+# Squared error of each code against the value it came from (inf when an
+# in-range value overflows, 0 for NaN, which has nothing better)
+def error(x, codes, fmt):
+    q = FP8[np.asarray(fmt, dtype=np.intp), codes].astype(np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+        err = (q - x) ** 2
+    return np.where(np.isnan(x), 0., np.where(q == x, 0., err))
+
+
+# Float matrix to FP8 codes and format bits (0 for E5M2, 1 for E4M3), with the
+# format picked per element, row, column or for the whole matrix.  Formats are
+# returned per element either way, like the control bits want them.
+def quantize(x, granularity="element"):
+    assert granularity in GRANULARITY, f"granularity={granularity!r} not in {GRANULARITY}"
+    x = np.asarray(x, dtype=np.float64)
+    e5, e4 = encode8(x, 0), encode8(x, 1)
+    err5, err4 = error(x, e5, 0), error(x, e4, 1)
+    if granularity == "row":
+        err5, err4 = err5.sum(axis=1, keepdims=True), err4.sum(axis=1, keepdims=True)
+    elif granularity == "column":
+        err5, err4 = err5.sum(axis=0, keepdims=True), err4.sum(axis=0, keepdims=True)
+    elif granularity == "matrix":
+        err5, err4 = err5.sum(), err4.sum()
+    fmt = np.broadcast_to(err4 <= err5, x.shape).astype(np.uint8)  # precision on ties
+    return np.where(fmt, e4, e5), fmt
+
+
+# Codes and format bits to E5M2 / E4M3 values, like gemm.Job takes
+def fp8s(codes, fmt):
+    return [[(E4M3 if f else E5M2).fromh(f"{c:02x}") for c, f in zip(cs, fs)] for cs, fs in zip(codes, fmt)]
+
+
+if __name__ == "__main__":
+    rs = np.random.default_rng(0)
+    # Rounding matches fromf, including the specials
+    specials = [0., -0., np.inf, -np.inf, np.nan, 448., 464., 57344., 61440., 2**-16, 2**-17, 2**-9, 2**-10]
+    x = np.concatenate([specials, rs.normal(0, 1, 5000) * 2. ** rs.integers(-20, 20, 5000)])
+    for f, cls in [(0, E5M2), (1, E4M3)]:
+        ref = [int(cls.fromf(float(v)).h, 16) for v in x]
+        assert (encode8(x, f) == ref).all(), cls
+    print("rounding matches fromf")
+    # Picking per element, row or column never does worse than one format
+    # Rows at scales from well below E4M3's subnormals to well above its max
+    W = rs.normal(0, 1, (256, 256)) * 2. ** rs.integers(-14, 10, (256, 1))
+    # (SQNR over the whole matrix, and averaged over the rows)
+    sqnr = lambda codes, fmt, axis=None: 10 * np.log10((W ** 2).sum(axis) / error(W, codes, fmt).sum(axis))
+    report = lambda codes, fmt: (f"{sqnr(codes, fmt):.1f} dB, {sqnr(codes, fmt, 1).mean():.1f} dB per row")
+    uniform = {f: sqnr(encode8(W, f), f) for f in (0, 1)}
+    print(f"E5M2 only {report(encode8(W, 0), 0)}, E4M3 only {report(encode8(W, 1), 1)}")
+    for g in GRANULARITY:
+        codes, fmt = quantize(W, g)
+        assert sqnr(codes, fmt) >= max(uniform.values()) - 1e-9, g
+        print(f"  per {g}: {report(codes, fmt)} ({100 * fmt.mean():.0f}% E4M3)")
+    codes, fmt = quantize(W)
+    assert (error(W, codes, fmt) <= np.minimum(error(W, encode8(W, 0), 0), error(W, encode8(W, 1), 1))).all()
+    # Codes and formats go straight into a gemm.Job, and match the emulation
+    from emulate import emulate_matmul
+    from gemm import Job, golden
+    (A, a_fmt), (B, b_fmt) = quantize(rs.normal(0, 4, (4, 6))), quantize(rs.normal(0, 1e-3, (6, 2)), "column")
+    ref = emulate_matmul(A, B, None, a_fmt, b_fmt)
+    assert [[int(c.h, 16) for c in row] for row in golden(Job(fp8s(A, a_fmt), fp8s(B, b_fmt)))] == ref.tolist()
+    # Array speed
+    W = rs.normal(0, 1, (2048, 2048)).astype(np.float32)
+    t = time.perf_counter()
+    quantize(W)
+    t = time.perf_counter() - t
+    print(f"{W.size / 1e6:.1f}M weights in {t:.2f} s")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# %%  Side-by-side simulator throughput
+# Runs the same cocotb tests under each simulator and compares wall clock time,
+# so long soak / exhaustive runs can pick the faster one.
+#   ./simbench.py                      # test.py on tb.v, TEST_N=10
+#   ./simbench.py -f pipe.mk -n 100    # pipe.py on pipetb.v
+#   ./simbench.py -t test_CABABC -n 1000
+import argparse
+import os
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+
+SIMS = ["icarus", "verilator"]
+
+
+# Build and run one simulator, return (build seconds, {test: (real s, sim ns, passed)})
+def run(makefile, sim, test_n, testcase=None):
+    name = os.path.splitext(os.path.basename(makefile))[0].lower()
+    build = f"sim_build_{name}_{sim}"
+    results = f"results_{name}_{sim}.xml"
+    args = ["make", "-f", makefile, f"SIM={sim}", f"SIM_BUILD={build}", "DUMP=none"]
+    env = dict(os.environ, TEST_N=str(test_n), COCOTB_RESULTS_FILE=results)
+    if testcase is not None:
+        env["TESTCASE"] = testcase
+    # Build only, by asking for a test that doesn't exist
+    start = time.time()
+    subprocess.run(args, env=dict(env, TESTCASE="__build_only__"), capture_output=True)
+    built = time.time() - start
+    if os.path.exists(results):
+        os.remove(results)
+    proc = subprocess.run(args, env=env, capture_output=True, text=True)
+    if not os.path.exists(results):
+        print(proc.stdout[-2000:], proc.stderr[-2000:])
+        raise RuntimeError(f"{sim} did not produce {results}")
+    tests = {}
+    for case in ET.parse(results).getroot().iter("testcase"):
+        name = f"{case.get('classname')}.{case.get('name')}"
+        passed = case.find("failure") is None and case.find("error") is None
+        tests[name] = (float(case.get("time")), float(case.get("sim_time_ns")), passed)
+    return built, tests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="side-by-side simulator throughput")
+    parser.add_argument("-f", "--makefile", default="Makefile")
+    parser.add_argument("-n", "--test-n", type=int, default=10, help="TEST_N for the tests")
+    parser.add_argument("-t", "--testcase", default=None)
+    parser.add_argument("-s", "--sims", nargs="+", default=SIMS)
+    args = parser.parse_args()
+
+    runs = {sim: run(args.makefile, sim, args.test_n, args.testcase) for sim in args.sims}
+    names = list(runs[args.sims[0]][1])
+    base = args.sims[0]
+    header = f"{'test':<28}" + "".join(f"{s + ' s':>14}" for s in args.sims)
+    header += "".join(f"{s + ' kns/s':>18}" for s in args.sims)
+    header += "".join(f"{'x' + s:>12}" for s in args.sims[1:])
+    print(header)
+    for name in names + ["total"]:
+        if name == "total":
+            cols = [sum(t for t, _, _ in runs[s][1].values()) for s in args.sims]
+            sims = [sum(n for _, n, _ in runs[s][1].values()) for s in args.sims]
+            ok = all(p for s in args.sims for _, _, p in runs[s][1].values())
+        else:
+            cols = [runs[s][1][name][0] for s in args.sims]
+            sims = [runs[s][1][name][1] for s in args.sims]
+            ok = all(runs[s][1][name][2] for s in args.sims)
+        line = f"{name:<28}" + "".join(f"{t:14.2f}" for t in cols)
+        line += "".join(f"{n / t / 1e3 if t else 0:18.1f}" for n, t in zip(sims, cols))
+        line += "".join(f"{cols[0] / t if t else 0:11.1f}x" for t in cols[1:])
+        print(line + ("" if ok else "  FAIL"))
+    print(f"{'build':<28}" + "".join(f"{runs[s][0]:14.2f}" for s in args.sims))
+    print(f"TEST_N={args.test_n} baseline={base}")
+
+
+if __name__ == "__main__":
+    main()
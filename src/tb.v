@@ -9,12 +9,38 @@ that can be driven / tested by the cocotb test.py
 // testbench is controlled by test.py
 module tb ();
 
-    // this part dumps the trace to a vcd file that can be viewed with GTKWave
+    // this part dumps the trace to a fst file that can be viewed with GTKWave
+    // dumping is off unless +dumpall is given, otherwise the harness raises
+    // dump_en around the blocks it wants to see (e.g. replaying a failure)
+    reg dump_en;
+`ifdef VERILATOR
+    // $dumpon/$dumpoff are ignored here, dump.cpp switches its own dumper
+    import "DPI-C" function void dump_switch(input string file, input bit on);
+    initial dump_switch("tb.fst", $test$plusargs("dumpall") != 0);
+    always @(posedge dump_en) dump_switch("tb.fst", 1);
+    always @(negedge dump_en) dump_switch("tb.fst", 0);
+`else
+    reg dumping = 0;
     initial begin
-        $dumpfile ("tb.vcd");
-        $dumpvars (0, tb);
-        #1;
+        if ($test$plusargs("dumpall")) begin
+            $dumpfile ("tb.fst");
+            $dumpvars (0, tb);
+            dumping = 1;
+        end
     end
+    always @(posedge dump_en) begin
+        if (!dumping) begin
+            $dumpfile ("tb.fst");
+            $dumpvars (0, tb);
+            dumping = 1;
+        end else begin
+            $dumpon;
+        end
+    end
+    always @(negedge dump_en) begin
+        $dumpoff;
+    end
+`endif
 
     // wire up the inputs and outputs
     reg  clk;
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # %%
+import os
 import random
 from itertools import product
 
@@ -7,26 +8,47 @@ import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import ClockCycles, FallingEdge, RisingEdge, Timer
 
+import cosim
+import probe
+import ties
+import waves
+from cover import Coverage, Directed
 from fp import E4M3, E5M2, FP16, fma, is_bin, is_hex
+from gemm import random_job
+from prefetch import Prefetch
+from tilesched import schedule
+from waves import DUMP_FAIL, BlockFailure, window
 
 # Should match info.yaml
-TEST_N = 10
+TEST_N = int(os.environ.get("TEST_N", 10))
+# test_coverage runs until every coverage bin is hit, or COVERAGE_PATIENCE
+# chunks in a row hit nothing new, and saves the bitmap to COVERAGE_FILE
+COVERAGE_MAX = int(os.environ.get("COVERAGE_MAX", 100 * TEST_N))
+COVERAGE_PATIENCE = int(os.environ.get("COVERAGE_PATIENCE", 20))
+COVERAGE_FILE = os.environ.get("COVERAGE_FILE", "")
 CLOCK_HZ = 50000000
-HALF_CLOCK_PERIOD_NS = 1e9 / (2 * CLOCK_HZ)
-EPSILON_NS = HALF_CLOCK_PERIOD_NS / 10
+CLOCK_PERIOD_NS = 1e9 / CLOCK_HZ
+
+# Clock driving the dut for the current test (cocotb kills it after each test)
+clock = None
 
 
 # Reset before every test
+# Everything is driven and sampled on the falling edge of the clock, so the
+# inputs are stable at the rising edge and the outputs have settled after it.
+# This only needs one trigger per clock and behaves the same on every simulator.
 async def reset(dut):
+    global clock
     dut._log.info("reset")
+    if clock is None or clock.done():
+        dut.clk.value = 0
+        clock = cocotb.start_soon(Clock(dut.clk, CLOCK_PERIOD_NS, units="ns").start(start_high=False))
+    await FallingEdge(dut.clk)
     dut.rst_n.value = 0
-    dut.clk.value = 0
-    await Timer(HALF_CLOCK_PERIOD_NS, units="ns")
-    dut.clk.value = 1
-    await Timer(HALF_CLOCK_PERIOD_NS, units="ns")
-    dut.clk.value = 0
-    await Timer(HALF_CLOCK_PERIOD_NS, units="ns")
+    await FallingEdge(dut.clk)
     dut.rst_n.value = 1
+    cosim.reset(dut)
+    probe.reset(dut)
 
 
 # Test a single clock cycle
@@ -57,28 +79,22 @@ async def test_clock(
     uo_out = f"{int(col_out + row_out, 16):08b}"
     uio_out = "000000" + col_ctrl_out + row_ctrl_out
 
-    # Assume that the clock could have been 0 for a while
-    await Timer(HALF_CLOCK_PERIOD_NS - (2 * EPSILON_NS), units="ns")
-    # Read and assert our outputs
+    # We start just after a negative clock edge, so outputs have settled
+    # Record probes (with PROBE)
+    probe.sample(dut)
+    # Check against the model first (with COSIM), then our outputs
+    cosim.step(dut, int(ui_in, 16), int(uio_in, 2))
     assert (
         dut.uo_out.value.binstr == uo_out
     ), f"dut.uo_out={dut.uo_out.value.binstr} != {uo_out}"
     assert (
         dut.uio_out.value.binstr == uio_out
     ), f"dut.uio_out={dut.uio_out.value.binstr} != {uio_out}"
-    # Wait a small amount before setting inputs
-    await Timer(EPSILON_NS, units="ns")
     # Set inputs
     dut.ui_in.value = int(ui_in, 16)
     dut.uio_in.value = int(uio_in, 2)
-    # Wait a small amount before sending positive clock edge
-    await Timer(EPSILON_NS, units="ns")
-    # Send positive clock edge
-    dut.clk.value = 1
-    # Wait half a clock period
-    await Timer(HALF_CLOCK_PERIOD_NS, units="ns")
-    # Send negative clock edge
-    dut.clk.value = 0
+    # Wait through the positive clock edge to the next negative clock edge
+    await FallingEdge(dut.clk)
     # Done, next test_clock can start immediately
 
 
@@ -99,26 +115,20 @@ async def send_clock(
     # Map inputs/outputs to DUT
     ui_in = col_in + row_in
     uio_in = '0000' + col_ctrl_in + row_ctrl_in + "00"
-    # Assume that the clock could have been 0 for a while
-    await Timer(HALF_CLOCK_PERIOD_NS - (2 * EPSILON_NS), units="ns")
-    # Read outputs
+    # We start just after a negative clock edge, so outputs have settled
+    # Record probes (with PROBE)
+    probe.sample(dut)
+    # Check against the model (with COSIM), then read outputs
+    cosim.step(dut, int(ui_in, 16), int(uio_in, 2))
     uo_out = dut.uo_out.value.binstr
     uio_out = dut.uio_out.value.binstr
     assert is_bin(uo_out, 8), f"uo_out={repr(uo_out)}"
     assert is_bin(uio_out, 8), f"uio_out={repr(uio_out)}"
-    # Wait a small amount before setting inputs
-    await Timer(EPSILON_NS, units="ns")
     # Set inputs
     dut.ui_in.value = int(ui_in, 16)
     dut.uio_in.value = int(uio_in, 2)
-    # Wait a small amount before sending positive clock edge
-    await Timer(EPSILON_NS, units="ns")
-    # Send positive clock edge
-    dut.clk.value = 1
-    # Wait half a clock period
-    await Timer(HALF_CLOCK_PERIOD_NS, units="ns")
-    # Send negative clock edge
-    dut.clk.value = 0
+    # Wait through the positive clock edge to the next negative clock edge
+    await FallingEdge(dut.clk)
     # Done, next test_clock can start immediately
     uo_hex = f"{int(uo_out, 2):02x}"
     col_out = uo_hex[0]
@@ -225,36 +235,69 @@ ADDR_IN = {a: {f"{k}_in": f"{v}" for k, v in v.items()} for a, v in ADDR.items()
 ADDR_OUT = {a: {f"{k}_out": f"{v}" for k, v in v.items()} for a, v in ADDR.items()}
 
 
-# Test a sequence of blocks
+# Test a sequence of blocks, replaying a failure with waveforms around it
 async def test_sequence(dut, *, blocks):
-    for i in range(len(blocks)):
-        prev = blocks[i - 1] if i > 0 else {}
-        block = blocks[i]
-        dut._log.info(f"  test_sequence[{i}] {block}")
-        params = {}
-        params.update(ADDR_IN[block.get('a', 0)])
-        params['col_in'] = block.get('ci', '0000')
-        params['row_in'] = block.get('ri', '0000')
-        if isinstance(block.get('co', None), FP16):
-            Co = block['co']
-            Ro = block['ro']
-            Cof = Co.f
-            Rof = Ro.f
-            dut._log.info(f"  sending block {params}")
-            col_out, col_ctrl_out, row_out, row_ctrl_out = await send_block(dut, **params)
-            dut._log.info(f"  received block {col_out} {col_ctrl_out} {row_out} {row_ctrl_out}")
-            ro = FP16.fromh(row_out)
-            co = FP16.fromh(col_out)
-            cof = co.f
-            rof = ro.f
-            assert (cof != cof and Cof != Cof) or cof == Cof, f"cof={cof} Cof={Cof} co={co.h} Co={Co.h}"
-            assert (rof != rof and Rof != Rof) or rof == Rof, f"rof={rof} Rof={Rof} ro={ro.h} Ro={Ro.h}"
+    try:
+        await run_sequence(dut, blocks=blocks)
+    except BlockFailure as e:
+        if probe.flush(dut, note=str(e)):
+            dut._log.info(f"  probes written to {probe.PROBE_FILE}")
+        if not DUMP_FAIL:
+            raise
+        blocks_dumped = window(e.index)
+        dut._log.info(f"  replaying blocks {blocks_dumped} into tb.fst")
+        await reset(dut)
+        try:
+            await run_sequence(dut, blocks=blocks, dump=blocks_dumped)
+        except BlockFailure:
+            pass
         else:
-            params.update(ADDR_OUT[prev.get('a', 0)])
-            params['col_out'] = block.get('co', prev.get('ci', '0000'))
-            params['row_out'] = block.get('ro', prev.get('ri', '0000'))
-            dut._log.info(f"  testing block {params}")
-            await test_block(dut, **params)
+            dut._log.warning("  failure did not reproduce on replay")
+        raise
+
+
+# Run a sequence of blocks, dumping waveforms for the block indices in dump
+async def run_sequence(dut, *, blocks, dump=()):
+    for i in range(len(blocks)):
+        if dump:
+            waves.dump(dut, i in dump)
+        try:
+            await run_block(dut, blocks, i)
+        except AssertionError as e:
+            raise BlockFailure(i, e) from e
+    if dump:
+        waves.dump(dut, False)
+
+
+# Run block i of a sequence of blocks
+async def run_block(dut, blocks, i):
+    prev = blocks[i - 1] if i > 0 else {}
+    block = blocks[i]
+    dut._log.info(f"  test_sequence[{i}] {block}")
+    params = {}
+    params.update(ADDR_IN[block.get('a', 0)])
+    params['col_in'] = block.get('ci', '0000')
+    params['row_in'] = block.get('ri', '0000')
+    if isinstance(block.get('co', None), FP16):
+        Co = block['co']
+        Ro = block['ro']
+        Cof = Co.f
+        Rof = Ro.f
+        dut._log.info(f"  sending block {params}")
+        col_out, col_ctrl_out, row_out, row_ctrl_out = await send_block(dut, **params)
+        dut._log.info(f"  received block {col_out} {col_ctrl_out} {row_out} {row_ctrl_out}")
+        ro = FP16.fromh(row_out)
+        co = FP16.fromh(col_out)
+        cof = co.f
+        rof = ro.f
+        assert (cof != cof and Cof != Cof) or cof == Cof, f"cof={cof} Cof={Cof} co={co.h} Co={Co.h}"
+        assert (rof != rof and Rof != Rof) or rof == Rof, f"rof={rof} Rof={Rof} ro={ro.h} Ro={Ro.h}"
+    else:
+        params.update(ADDR_OUT[prev.get('a', 0)])
+        params['col_out'] = block.get('co', prev.get('ci', '0000'))
+        params['row_out'] = block.get('ro', prev.get('ri', '0000'))
+        dut._log.info(f"  testing block {params}")
+        await test_block(dut, **params)
 
 
 # Test that we get zeroes post-reset
@@ -366,171 +409,234 @@ def mulfmt(A0, A1, B0, B1, C0=None, C1=None, C2=None, C3=None):
     return C0, C1, C2, C3
 
 
-@cocotb.test()
-async def test_1x1(dut):
-    dut._log.info("start test_1x1")
-    await cocotb.start_soon(reset(dut))
+# Blocks for each random test below, made from rs in a prefetch worker
+# (see prefetch.py) so the simulator doesn't wait on the reference math
+def blocks_1x1(rs):
     # TODO: Do E4M3 format combinations
-    for _ in range(TEST_N):
-        i = random.randint(0, 255)
-        j = random.randint(0, 255)
-        Ah = f"{i:02x}00" if random.random() < 0.5 else f"00{i:02x}"
-        Bh = f"{j:02x}00" if random.random() < 0.5 else f"00{j:02x}"
-        C0, C1, C2, C3 = mul22(Ah, Bh)
-        dut._log.info(f"  test_1x1 {Ah} {Bh}")
-        blocks = [
-            {'a': 1, 'ci': Ah, 'ri': Bh,},
-            {'a': 6,},
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
+    i = rs.randint(0, 255)
+    j = rs.randint(0, 255)
+    Ah = f"{i:02x}00" if rs.random() < 0.5 else f"00{i:02x}"
+    Bh = f"{j:02x}00" if rs.random() < 0.5 else f"00{j:02x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh)
+    return [
+        {'a': 1, 'ci': Ah, 'ri': Bh,},
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_fmt(rs):
+    a = tuple(rs.randint(0, 1) for _ in range(4))
+    A0, A1, B0, B1 = ((E4M3 if f else E5M2).fromb(f"{rs.getrandbits(8):08b}", norm=True) for f in a)
+    C0, C1, C2, C3 = mulfmt(A0, A1, B0, B1)
+    return [
+        {'a': a, 'ci': A0.h + A1.h, 'ri': B0.h + B1.h,},
+        {'a': 6, },
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_ABC(rs):
+    # TODO: Do E4M3 format combinations
+    Ah = f"{rs.randint(0, 2**16-1):04x}"
+    Bh = f"{rs.randint(0, 2**16-1):04x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh)
+    return [
+        {'a': 1, 'ci': Ah, 'ri': Bh,},
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_ABABC(rs):
+    Ah = f"{rs.randint(0, 2**32-1):08x}"
+    Bh = f"{rs.randint(0, 2**32-1):08x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh)
+    return [
+        {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4],},
+        {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_CABC(rs):
+    Ah = f"{rs.randint(0, 2**16-1):04x}"
+    Bh = f"{rs.randint(0, 2**16-1):04x}"
+    Ci = f"{rs.randint(0, 2**64-1):016x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh, Ci)
+    return [
+        {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
+        {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
+        {'a': 1, 'ci': Ah, 'ri': Bh, 'co': '0000', 'ro': '0000',},
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_CABABC(rs):
+    Ah = f"{rs.randint(0, 2**32-1):08x}"
+    Bh = f"{rs.randint(0, 2**32-1):08x}"
+    Ci = f"{rs.randint(0, 2**64-1):016x}"
+    C0, C1, C2, C3 = mul22(Ah, Bh, Ci)
+    return [
+        {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
+        {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
+        {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4], 'co': '0000', 'ro': '0000',},
+        {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
+        {'a': 6,},
+        {'a': 7, 'co': C0, 'ro': C1,},
+        {'a': 0, 'co': C2, 'ro': C3,},
+        {},
+    ]
+
+
+def blocks_CABABCABABC(rs):
+    Ah = f"{rs.randint(0, 2**64-1):016x}"
+    Bh = f"{rs.randint(0, 2**64-1):016x}"
+    Ci = f"{rs.randint(0, 2**128-1):032x}"
+    C0, C1, C2, C3 = mul22(Ah[0:8], Bh[0:8], Ci[0:16])
+    D0, D1, D2, D3 = mul22(Ah[8:16], Bh[8:16], Ci[16:32])
+    return [
+        {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
+        {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
+        {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4], 'co': '0000', 'ro': '0000',},
+        {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
+        {'a': 6, 'ci': Ci[16:20], 'ri': Ci[20:24],},
+        {'a': 7, 'ci': Ci[24:28], 'ri': Ci[28:32], 'co': C0, 'ro': C1,},
+        {'a': 1, 'ci': Ah[8:12], 'ri': Bh[8:12], 'co': C2, 'ro': C3,},
+        {'a': 1, 'ci': Ah[12:16], 'ri': Bh[12:16],},
+        {'a': 6,},
+        {'a': 7, 'co': D0, 'ro': D1,},
+        {'a': 0, 'co': D2, 'ro': D3,},
+        {},
+    ]
+
+
+# Run TEST_N sequences from make, prefetched
+async def test_random(dut, name, make):
+    dut._log.info(f"start {name}")
+    await cocotb.start_soon(reset(dut))
+    seed = random.getrandbits(32)
+    dut._log.info(f"  seed {seed}")
+    batches = Prefetch(make, TEST_N, seed)
+    for blocks in batches:
         await test_sequence(dut, blocks=blocks)
+    dut._log.info(f"  {batches}")
+
+
+@cocotb.test()
+async def test_1x1(dut):
+    await test_random(dut, "test_1x1", blocks_1x1)
 
 
 @cocotb.test()
 async def test_fmt(dut):
-    dut._log.info("start test_fmt")
-    await cocotb.start_soon(reset(dut))
-    for _ in range(TEST_N):
-        A0fmt = random.randint(0, 1)
-        A1fmt = random.randint(0, 1)
-        B0fmt = random.randint(0, 1)
-        B1fmt = random.randint(0, 1)
-        a = (A0fmt, A1fmt, B0fmt, B1fmt)
-        A0cls = E4M3 if A0fmt else E5M2
-        A1cls = E4M3 if A1fmt else E5M2
-        B0cls = E4M3 if B0fmt else E5M2
-        B1cls = E4M3 if B1fmt else E5M2
-        A0 = A0cls.rand()
-        A1 = A1cls.rand()
-        B0 = B0cls.rand()
-        B1 = B1cls.rand()
-        C0, C1, C2, C3 = mulfmt(A0, A1, B0, B1)
-        cc = f'0{A0fmt}{A1fmt}0'
-        rc = f'1{B0fmt}{B1fmt}0'
-        dut._log.info(f"  test_fmt {A0} {B0} {C0}")
-        blocks = [
-            {'a': a, 'ci': A0.h + A1.h, 'ri': B0.h + B1.h,},
-            {'a': 6, },
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
-        await test_sequence(dut, blocks=blocks)
+    await test_random(dut, "test_fmt", blocks_fmt)
 
 
 @cocotb.test()
 async def test_ABC(dut):
-    dut._log.info("start test_ABC")
-    await cocotb.start_soon(reset(dut))
-    # TODO: Do E4M3 format combinations
-    for _ in range(TEST_N):
-        Ah = f"{random.randint(0, 2**16-1):04x}"
-        Bh = f"{random.randint(0, 2**16-1):04x}"
-        C0, C1, C2, C3 = mul22(Ah, Bh)
-        dut._log.info(f"  test_ABC {Ah} {Bh}")
-        blocks = [
-            {'a': 1, 'ci': Ah, 'ri': Bh,},
-            {'a': 6,},
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
-        await test_sequence(dut, blocks=blocks)
-
+    await test_random(dut, "test_ABC", blocks_ABC)
 
 
 @cocotb.test()
 async def test_ABABC(dut):
-    dut._log.info("start test_ABABC")
-    await cocotb.start_soon(reset(dut))
-    for _ in range(TEST_N): 
-        Ah = f"{random.randint(0, 2**32-1):08x}"
-        Bh = f"{random.randint(0, 2**32-1):08x}"
-        C0, C1, C2, C3 = mul22(Ah, Bh)
-        dut._log.info(f"  test_ABABC {Ah} {Bh}")
-        blocks = [
-            {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4],},
-            {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
-            {'a': 6,},
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
-        await test_sequence(dut, blocks=blocks)
-
+    await test_random(dut, "test_ABABC", blocks_ABABC)
 
 
 @cocotb.test()
 async def test_CABC(dut):
-    dut._log.info("start test_CABC")
-    await cocotb.start_soon(reset(dut))
-    for _ in range(TEST_N):
-        Ah = f"{random.randint(0, 2**16-1):04x}"
-        Bh = f"{random.randint(0, 2**16-1):04x}"
-        Ci = f"{random.randint(0, 2**64-1):016x}"
-        C0, C1, C2, C3 = mul22(Ah, Bh, Ci)
-        dut._log.info(f"  test_CABC {Ah} {Bh} {Ci}")
-        blocks = [
-            {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
-            {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
-            {'a': 1, 'ci': Ah, 'ri': Bh, 'co': '0000', 'ro': '0000',},
-            {'a': 6,},
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
-        await test_sequence(dut, blocks=blocks)
-
+    await test_random(dut, "test_CABC", blocks_CABC)
 
 
 @cocotb.test()
 async def test_CABABC(dut):
-    dut._log.info("start test_CABABC")
-    await cocotb.start_soon(reset(dut))
-    for _ in range(TEST_N):
-        Ah = f"{random.randint(0, 2**32-1):08x}"
-        Bh = f"{random.randint(0, 2**32-1):08x}"
-        Ci = f"{random.randint(0, 2**64-1):016x}"
-        C0, C1, C2, C3 = mul22(Ah, Bh, Ci)
-        dut._log.info(f"  test_CABABC {Ah} {Bh} {Ci}")
-        blocks = [
-            {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
-            {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
-            {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4], 'co': '0000', 'ro': '0000',},
-            {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
-            {'a': 6,},
-            {'a': 7, 'co': C0, 'ro': C1,},
-            {'a': 0, 'co': C2, 'ro': C3,},
-            {},
-        ]
-        await test_sequence(dut, blocks=blocks)
+    await test_random(dut, "test_CABABC", blocks_CABABC)
 
 
 @cocotb.test()
 async def test_CABABCABABC(dut):
-    dut._log.info("start test_CABABCABABC")
+    await test_random(dut, "test_CABABCABABC", blocks_CABABCABABC)
+
+
+# Coverage-directed random walks over the block modes, biased toward
+# operands/accumulators that hit unhit coverage bins (see cover.py)
+@cocotb.test()
+async def test_coverage(dut):
+    dut._log.info("start test_coverage")
     await cocotb.start_soon(reset(dut))
-    for _ in range(TEST_N):
-        Ah = f"{random.randint(0, 2**64-1):016x}"
-        Bh = f"{random.randint(0, 2**64-1):016x}"
-        Ci = f"{random.randint(0, 2**128-1):032x}"
-        C0, C1, C2, C3 = mul22(Ah[0:8], Bh[0:8], Ci[0:16])
-        D0, D1, D2, D3 = mul22(Ah[8:16], Bh[8:16], Ci[16:32])
-        dut._log.info(f"  test_CABABCABABC {Ah} {Bh} {Ci}")
+    cov = Coverage()
+    seed = random.getrandbits(32)
+    dut._log.info(f"  seed {seed}")
+    gen = Directed(cov, random.Random(seed))
+    chunks = stale = 0
+    while chunks < COVERAGE_MAX and not cov.saturated() and stale < COVERAGE_PATIENCE:
+        before = cov.hits
+        await test_sequence(dut, blocks=gen.chunk())
+        chunks += 1
+        stale = 0 if cov.hits > before else stale + 1
+    dut._log.info(f"  {chunks} chunks, {cov}")
+    if COVERAGE_FILE:
+        cov.save(COVERAGE_FILE)
+
+
+# Exact rounding ties in the product and the sum (see ties.py), spread over
+# 20 * TEST_N cases, two per sequence since C0 = A0 * B0 and C3 = A1 * B1
+@cocotb.test()
+async def test_ties(dut):
+    dut._log.info("start test_ties")
+    await cocotb.start_soon(reset(dut))
+    cases = ties.suite()
+    cases = cases[::max(1, len(cases) // (20 * TEST_N))]
+    zero = FP16.fromf(0.)
+    for (A0, B0, C0), (A1, B1, C3) in zip(cases[0::2], cases[1::2]):
+        D0, D1, D2, D3 = mulfmt(A0, A1, B0, B1, C0, zero, zero, C3)
+        a = tuple(1 if isinstance(x, E4M3) else 0 for x in (A0, A1, B0, B1))
+        dut._log.info(f"  test_ties {A0.h} {B0.h} {C0.h} {A1.h} {B1.h} {C3.h}")
         blocks = [
-            {'a': 6, 'ci': Ci[0:4], 'ri': Ci[4:8],},
-            {'a': 7, 'ci': Ci[8:12], 'ri': Ci[12:16], 'co': '0000', 'ro': '0000',},
-            {'a': 1, 'ci': Ah[0:4], 'ri': Bh[0:4], 'co': '0000', 'ro': '0000',},
-            {'a': 1, 'ci': Ah[4:8], 'ri': Bh[4:8],},
-            {'a': 6, 'ci': Ci[16:20], 'ri': Ci[20:24],},
-            {'a': 7, 'ci': Ci[24:28], 'ri': Ci[28:32], 'co': C0, 'ro': C1,},
-            {'a': 1, 'ci': Ah[8:12], 'ri': Bh[8:12], 'co': C2, 'ro': C3,},
-            {'a': 1, 'ci': Ah[12:16], 'ri': Bh[12:16],},
+            {'a': 6, 'ci': C0.h, 'ri': '0000',},
+            {'a': 7, 'ci': '0000', 'ri': C3.h, 'co': '0000', 'ro': '0000',},
+            {'a': a, 'ci': A0.h + A1.h, 'ri': B0.h + B1.h, 'co': '0000', 'ro': '0000',},
             {'a': 6,},
             {'a': 7, 'co': D0, 'ro': D1,},
             {'a': 0, 'co': D2, 'ro': D3,},
             {},
         ]
-        await test_sequence(dut, blocks=blocks)
\ No newline at end of file
+        await test_sequence(dut, blocks=blocks)
+
+
+# A queue of independent jobs back to back, scheduled so each read-out is
+# the next job's write-in (see tilesched.py)
+@cocotb.test()
+async def test_schedule(dut):
+    dut._log.info("start test_schedule")
+    await cocotb.start_soon(reset(dut))
+    rs = random.Random(random.getrandbits(32))
+    jobs = [random_job(rs, 2, 2, rs.randint(1, 8), C=rs.random() < 0.5) for _ in range(TEST_N)]
+    sched = schedule(jobs)
+    dut._log.info(f"  {len(jobs)} jobs in {sched.stream_blocks} blocks, {100 * sched.mac_fraction:.1f}% MAC blocks")
+    await test_sequence(dut, blocks=sched.blocks)
+
+
+# Same with half the K-steps all zero in A or B, which the schedule leaves out
+@cocotb.test()
+async def test_schedule_sparse(dut):
+    dut._log.info("start test_schedule_sparse")
+    await cocotb.start_soon(reset(dut))
+    rs = random.Random(random.getrandbits(32))
+    jobs = [random_job(rs, 2, 2, rs.randint(1, 8), C=rs.random() < 0.5, sparse=0.5) for _ in range(TEST_N)]
+    sched = schedule(jobs, elide=True)
+    dut._log.info(f"  elided {sched.elided} blocks ({4 * sched.elided} cycles),"
+                  f" {len(jobs)} jobs in {sched.stream_blocks} blocks")
+    await test_sequence(dut, blocks=sched.blocks)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# %%  Every exact rounding tie in the FMA, worked out from the integer structure
+# An FP8 value is m * 2**e for an integer significand m (at most 4 bits), so a
+# product is M * 2**E with M = ma * mb at most 8 bits.  FP16 keeps 11 bits, so
+# a product can only round (or tie) when it lands below the normal range, which
+# makes the ties few enough to enumerate exactly (no float rounding involved).
+# The add then ties when P + C is an odd multiple of half an FP16 ulp: with q
+# the lowest set bit of P, any sum S = j * 2**q (j odd, 2**11 < j < 2**12) does,
+# so C = S - P for a few such j (and both signs of S), when C is an FP16.
+#   ./ties.py          # count and check the suite
+import math
+from itertools import product
+
+from fp import E4M3, E5M2, FP16, fma
+
+FMTS = {0: E5M2, 1: E4M3}
+
+
+# (code, m, e) with value m * 2**e, for every finite non-zero positive code
+def significands(fmt):
+    for code in range(1, 0x80):
+        if fmt:  # E4M3, bias 7, 3 bit mantissa
+            exp, man = code >> 3, code & 7
+            if code == 0x7f:
+                continue
+            yield (code, 8 | man, exp - 10) if exp else (code, man, -9)
+        else:  # E5M2, bias 15, 2 bit mantissa
+            exp, man = code >> 2, code & 3
+            if exp == 31:
+                continue
+            yield (code, 4 | man, exp - 17) if exp else (code, man, -16)
+
+
+# Exponent of the FP16 ulp for values in binade b (2**b <= |x| < 2**(b+1))
+def ulp16(b):
+    return max(b, -14) - 10
+
+
+# Every (A, B) whose exact product is halfway between two FP16 values
+# (including halfway between zero and the smallest subnormal)
+def product_ties():
+    for fa, fb in product((0, 1), repeat=2):
+        for a, ma, ea in significands(fa):
+            for b, mb, eb in significands(fb):
+                M, E = ma * mb, ea + eb
+                k = ulp16(M.bit_length() - 1 + E) - E  # bits below the ulp
+                if k > 0 and M % (1 << k) == 1 << (k - 1):
+                    for sa, sb in product((0, 0x80), repeat=2):
+                        yield FMTS[fa].fromh(f"{a | sa:02x}"), FMTS[fb].fromh(f"{b | sb:02x}")
+
+
+# Exponent of the lowest set bit of a finite non-zero float
+def lsb(v):
+    n, d = abs(v).as_integer_ratio()
+    return ((n & -n).bit_length() - 1) - (d.bit_length() - 1)
+
+
+# FP16 values C so that P + C is exactly halfway between two FP16 values:
+# round down and up to even, the carry into the next binade, and both signs
+def sum_ties(P):
+    p = P.f
+    if p != p or p == 0 or abs(p) == math.inf:
+        return []
+    q = lsb(p)
+    out = []
+    for j in [2**11 + 1, 2**11 + 3, 2**12 - 3, 2**12 - 1]:
+        for sign in (1, -1):
+            S = sign * math.ldexp(j, q)
+            c = S - p  # exact, everything is a small multiple of 2**q
+            if c == 0 or abs(S) > 65520 or abs(c) > FP16.MAX or FP16.fromf(c).f != c:
+                continue
+            out.append(FP16.fromf(c))
+    return out
+
+
+# Dense corner case suite of (A, B, C): every product tie, each with C = 0
+# and with every C that puts the sum on a tie
+def suite():
+    zero = FP16.fromf(0.)
+    cases = []
+    for A, B in product_ties():
+        cases.append((A, B, zero))
+        cases += [(A, B, C) for C in sum_ties(fma(A, B))]
+    return cases
+
+
+# Is x exactly halfway between two FP16 values (or FP16.MAX and infinity)
+def is_tie(x):
+    ax = abs(x)
+    u = ulp16(math.frexp(ax)[1] - 1)
+    return ax <= 65520 and math.ldexp(ax, -u) % 1 == 0.5
+
+
+if __name__ == "__main__":
+    from cover import round16
+    from model import pipe0, pipe1, pipe2, pipe3
+
+    ties = list(product_ties())
+    cases = suite()
+    sums = [c for c in cases if c[2].f != 0]
+    print(f"{len(ties)} product ties, {len(sums)} sum ties, {len(cases)} cases")
+    # Cross check the product ties against rounding every FP8 pair
+    assert all(is_tie(A.f * B.f) for A, B in ties)
+    assert all(round16(A.f * B.f)[0] in ('tie_up', 'tie_down', 'underflow') for A, B in ties)
+    assert all(is_tie(fma(A, B).f + C.f) for A, B, C in sums)
+    vals = [v for cls in FMTS.values() for v in (cls.fromh(f"{i:02x}").f for i in range(256)) if abs(v) < math.inf]
+    every = [x for a in vals for b in vals for x in [a * b] if x and is_tie(x)]
+    assert len(every) == len(ties), (len(every), len(ties))
+    # And the bit-exact pipeline model agrees with the reference on all of them
+    for A, B, C in cases:
+        x = pipe0(int(A.h, 16), int(B.h, 16), int(C.h, 16), isinstance(A, E4M3), isinstance(B, E4M3), 1)
+        got = FP16.fromh(f"{pipe3(*pipe2(*pipe1(*x)))[0]:04x}")
+        ref = fma(A, B, C)
+        assert got == ref or got.f == ref.f, f"{A} * {B} + {C}: {got} != {ref}"
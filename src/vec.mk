@@ -0,0 +1,64 @@
+# Makefile
+# Self-checking vector testbench, no cocotb: vectors.py writes the stimulus and
+# expected outputs, vectb.v plays them and compares in HDL
+#   make -f vec.mk                      # icarus, RTL
+#   make -f vec.mk SIM=verilator        # verilator --binary
+#   make -f vec.mk GATES=yes            # gate level netlist
+#   make -f vec.mk VEC_BLOCKS=100000 VEC_SEED=1
+
+# defaults
+SIM ?= icarus
+VEC_BLOCKS ?= 10000
+VEC_SEED ?= 0
+# named for both, so changing either regenerates it
+VECTORS ?= vectors_$(VEC_BLOCKS)_$(VEC_SEED).hex
+SIM_BUILD ?= sim_build_vec_$(SIM)
+
+# normal simulation
+ifneq ($(GATES),yes)
+
+VERILOG_SOURCES += $(PWD)/vectb.v $(PWD)/tt_um_machinaut_systolic.v $(PWD)/pipe.v
+
+else
+
+# gate level simulation, same setup as Makefile
+COMPILE_ARGS    += -DGL_TEST
+COMPILE_ARGS    += -DFUNCTIONAL
+COMPILE_ARGS    += -DUSE_POWER_PINS
+COMPILE_ARGS    += -DSIM
+COMPILE_ARGS    += -DUNIT_DELAY=\#1
+VERILOG_SOURCES += $(PDK_ROOT)/sky130A/libs.ref/sky130_fd_sc_hd/verilog/primitives.v
+VERILOG_SOURCES += $(PDK_ROOT)/sky130A/libs.ref/sky130_fd_sc_hd/verilog/sky130_fd_sc_hd.v
+
+# this gets copied in by the GDS action workflow
+VERILOG_SOURCES += $(PWD)/vectb.v $(PWD)/gate_level_netlist.v
+endif
+
+ifeq ($(SIM),verilator)
+COMPILE_ARGS += -Wno-WIDTHEXPAND -Wno-WIDTHTRUNC
+SIM_BIN = $(SIM_BUILD)/Vvectb
+else
+SIM_BIN = $(SIM_BUILD)/vectb.vvp
+endif
+
+# a failing simulator fails the pipeline, not just tee
+SHELL := /bin/bash
+.SHELLFLAGS := -o pipefail -c
+
+.PHONY: all clean
+all: $(SIM_BIN) $(VECTORS)
+	$(if $(filter verilator,$(SIM)),,vvp) $(SIM_BIN) +vectors=$(VECTORS) | tee $(SIM_BUILD)/vec.log
+	@grep -q "VECTORS PASS" $(SIM_BUILD)/vec.log
+
+$(VECTORS): vectors.py model.py
+	python vectors.py -n $(VEC_BLOCKS) -s $(VEC_SEED) -o $@
+
+$(SIM_BUILD)/Vvectb: $(VERILOG_SOURCES)
+	verilator --binary --top-module vectb -Mdir $(SIM_BUILD) $(COMPILE_ARGS) $(VERILOG_SOURCES)
+
+$(SIM_BUILD)/vectb.vvp: $(VERILOG_SOURCES)
+	mkdir -p $(SIM_BUILD)
+	iverilog -g2012 -s vectb -o $@ $(COMPILE_ARGS) $(VERILOG_SOURCES)
+
+clean:
+	rm -rf $(SIM_BUILD) vectors_*.hex
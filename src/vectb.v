@@ -0,0 +1,96 @@
+`default_nettype none
+`timescale 1ns/1ps
+
+/*
+this testbench plays precomputed per-cycle vectors (see vectors.py) through the
+module and checks the outputs in HDL, with no python in the loop, so long
+regressions (especially GATES=yes) run at native simulator speed
+*/
+
+// vector file, one 32 bit hex word per cycle after a cycle count:
+//   {ui_in, uio_in, uo_out, uio_out}
+// inputs are applied on the falling edge, and outputs checked on the falling
+// edge before that, just like test.py does
+module vectb #(parameter DEPTH = 1 << 20) ();
+
+    // wire up the inputs and outputs
+    reg  clk;
+    reg  rst_n;
+    reg  ena;
+    reg  [7:0] ui_in;
+    reg  [7:0] uio_in;
+
+    wire [7:0] uo_out;
+    wire [7:0] uio_out;
+    wire [7:0] uio_oe;
+
+    tt_um_machinaut_systolic tt_um_machinaut_systolic (
+    // include power ports for the Gate Level test
+    `ifdef GL_TEST
+        .VPWR( 1'b1),
+        .VGND( 1'b0),
+    `endif
+        .ui_in      (ui_in),    // Dedicated inputs
+        .uo_out     (uo_out),   // Dedicated outputs
+        .uio_in     (uio_in),   // IOs: Input path
+        .uio_out    (uio_out),  // IOs: Output path
+        .uio_oe     (uio_oe),   // IOs: Enable path (active high: 0=input, 1=output)
+        .ena        (ena),      // enable - goes high when design is selected
+        .clk        (clk),      // clock
+        .rst_n      (rst_n)     // not reset
+        );
+
+    // 50 MHz, same as test.py
+    initial clk = 0;
+    always #10 clk = ~clk;
+
+    reg [31:0] vectors [0:DEPTH];
+    reg [1023:0] file;
+    integer cycles;
+    integer t;
+    integer errors;
+    integer first;
+    reg [15:0] expected;
+
+    initial begin
+        if (!$value$plusargs("vectors=%s", file))
+            file = "vectors.hex";
+        $readmemh(file, vectors);
+        cycles = vectors[0];
+        if (cycles > DEPTH) begin
+            $display("VECTORS ERROR: %0d cycles but DEPTH is %0d", cycles, DEPTH);
+            $finish;
+        end
+        errors = 0;
+        first = -1;
+        ena = 1;
+        ui_in = 0;
+        uio_in = 0;
+        // reset, like test.py
+        rst_n = 1;
+        @(negedge clk);
+        rst_n = 0;
+        @(negedge clk);
+        rst_n = 1;
+        for (t = 0; t < cycles; t = t + 1) begin
+            expected = vectors[t + 1][15:0];
+            if ({uo_out, uio_out} !== expected) begin
+                if (errors < 10)
+                    $display("cycle %0d: uo_out=%h uio_out=%h expected uo_out=%h uio_out=%h",
+                             t, uo_out, uio_out, expected[15:8], expected[7:0]);
+                if (first < 0)
+                    first = t;
+                errors = errors + 1;
+            end
+            {ui_in, uio_in} = vectors[t + 1][31:16];
+            @(negedge clk);
+        end
+        if (errors == 0)
+            $display("VECTORS PASS: %0d cycles", cycles);
+        else
+            $display("VECTORS FAIL: %0d mismatches in %0d cycles, first at cycle %0d (block %0d)",
+                     errors, cycles, first, first / 4);
+        $finish;
+    end
+
+endmodule
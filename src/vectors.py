@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# %%  Precomputed per-cycle vectors for vectb.v
+# Random block stimulus, with the expected outputs from the bit-exact tile model
+# (model.py), written out for $readmemh so the check runs entirely in HDL.
+#   ./vectors.py -n 10000 -o vectors.hex
+#   make -f vec.mk              # generates vectors_10000_0.hex and runs vectb.v
+import argparse
+import random
+
+from model import Tile, block_cycles
+
+# Control bits for each kind of block, see README.md Modes
+RW0 = ('1000', '0100')
+RW1 = ('1100', '0000')
+
+
+# Random FP8 code, biased to the interesting ones (zero, subnormal, inf/nan)
+def rand8(rs):
+    r = rs.random()
+    if r < 0.05:
+        return rs.choice([0x00, 0x80])
+    if r < 0.15:
+        return (rs.getrandbits(1) << 7) | rs.getrandbits(3)
+    if r < 0.25:
+        return (rs.getrandbits(1) << 7) | 0x78 | rs.getrandbits(3)
+    return rs.getrandbits(8)
+
+
+# Random FP16 accumulator value, mostly in range so sums stay interesting
+def rand16(rs):
+    r = rs.random()
+    if r < 0.05:
+        return rs.choice([0x0000, 0x8000, 0x7c00, 0xfc00, 0x7fff])
+    if r < 0.5:
+        return (rs.getrandbits(1) << 15) | (rs.randint(8, 22) << 10) | rs.getrandbits(10)
+    return rs.getrandbits(16)
+
+
+# One random block of (col, col_ctrl, row, row_ctrl)
+def random_block(rs):
+    r = rs.random()
+    if r < 0.6:  # multiply-accumulate
+        W, X, Y, Z = (rs.choice('01') for _ in range(4))
+        col = (rand8(rs) << 8) | rand8(rs)
+        row = (rand8(rs) << 8) | rand8(rs)
+        return col, f"0{W}{X}0", row, f"1{Y}{Z}0"
+    if r < 0.75:  # read-write accumulators
+        col_ctrl, row_ctrl = rs.choice([RW0, RW1])
+        return rand16(rs), col_ctrl, rand16(rs), row_ctrl
+    # anything else, mostly passthrough
+    ctrl = lambda: f"{rs.getrandbits(4):04b}"
+    return rs.getrandbits(16), ctrl(), rs.getrandbits(16), ctrl()
+
+
+# Per-cycle (ui_in, uio_in, uo_out, uio_out) for a list of blocks, after reset
+def vectors(blocks):
+    tile = Tile()
+    out = []
+    for block in blocks:
+        for ui_in, uio_in in block_cycles(*block):
+            uo_out, uio_out = tile.cycle(ui_in, uio_in)
+            out.append((ui_in, uio_in, uo_out, uio_out))
+    return out
+
+
+def write(path, vecs, comment=""):
+    with open(path, "w") as f:
+        f.write(f"// {comment}\n" if comment else "")
+        f.write("// cycle count, then {ui_in, uio_in, uo_out, uio_out} per cycle\n")
+        f.write(f"{len(vecs):08x}\n")
+        for v in vecs:
+            f.write("%02x%02x%02x%02x\n" % v)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate vectors for vectb.v")
+    parser.add_argument("-n", "--blocks", type=int, default=10000)
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", default="vectors.hex")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    rs = random.Random(seed)
+    blocks = [random_block(rs) for _ in range(args.blocks)]
+    # One more passthrough block so the last block's outputs are checked
+    vecs = vectors(blocks + [(0, '0000', 0, '0000')])
+    write(args.output, vecs, f"seed {seed}, {args.blocks} blocks")
+    print(f"wrote {len(vecs)} cycles to {args.output} (seed {seed})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# %%  Failure-windowed waveform capture (see dump_en in tb.v / pipetb.v)
+import cocotb
+
+# Plusargs, normally set from the Makefile DUMP variable
+#   +dumpall       - dump everything from time 0 (slow, huge files)
+#   +dumpnone      - never dump, not even on failure
+#   +dumpwindow=N  - blocks to dump either side of a failing block
+# Otherwise failures are replayed with dumping on just around the failure
+DUMP_ALL = "dumpall" in cocotb.plusargs
+DUMP_FAIL = not DUMP_ALL and "dumpnone" not in cocotb.plusargs
+DUMP_WINDOW = int(cocotb.plusargs.get("dumpwindow", 2))
+
+
+# Turn dumping on/off, the first time on opens the dump file
+def dump(dut, on):
+    if DUMP_FAIL:
+        dut.dump_en.value = 1 if on else 0
+
+
+# Block indices to dump around failing block i
+def window(i):
+    return range(max(0, i - DUMP_WINDOW), i + DUMP_WINDOW + 1)
+
+
+# Assertion failure which remembers which block in a sequence failed
+class BlockFailure(AssertionError):
+    def __init__(self, index, error):
+        super().__init__(f"block {index}: {error}")
+        self.index = index
+        self.error = error
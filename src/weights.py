@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# %%  Block streams for static weights, encoded once and cached
+# In inference B (the weights) stays the same while A changes every call, but
+# gemm.grid_streams rebuilds every block and expected result from FP8 objects
+# and hex strings each time.  Here a weight matrix is encoded once, as numpy
+# arrays, into the (data, ctrl) MAC blocks of every grid row for every panel
+# of columns, along with its decoded values for the expected results.  Each
+# call then only encodes A, and merges it with the cached row streams and the
+# accumulator swaps (same blocks, in the same order, as gemm.grid_streams).
+# WeightCache keeps encoded weights in memory (least recently used go first)
+# and optionally in .npz files, keyed by a hash of their contents.
+#   ./weights.py       # check against gemm.grid_streams and the model, time it
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from emulate import accumulate, decode8, decode16, encode16
+
+# Control bits of the swap blocks, as ints (see gemm.RW0 and gemm.RW1)
+RW_COL, RW_ROW = (0b1000, 0b1100), (0b0100, 0b0000)
+
+
+# Codes and formats (0 = E5M2, 1 = E4M3, or one per element) padded with zeros
+# to a multiple of n along axis
+def pad(x, fmt, n, axis):
+    x = np.asarray(x, dtype=np.uint8)
+    fmt = np.broadcast_to(np.asarray(fmt, dtype=np.uint8), x.shape)
+    width = [(0, 0), (0, 0)]
+    width[axis] = (0, -x.shape[axis] % n)
+    return np.pad(x, width), np.pad(fmt, width)
+
+
+# (data, ctrl) of MAC blocks: pairs of codes along axis (A0 A1 or B0 B1)
+def mac_blocks(x, fmt, mode, axis):
+    x0, x1 = np.take(x, range(0, x.shape[axis], 2), axis), np.take(x, range(1, x.shape[axis], 2), axis)
+    f0, f1 = np.take(fmt, range(0, x.shape[axis], 2), axis), np.take(fmt, range(1, x.shape[axis], 2), axis)
+    return (x0.astype(np.uint16) << 8) | x1, ((mode << 3) | (f0 << 2) | (f1 << 1)).astype(np.uint8)
+
+
+@dataclass
+class WeightStreams:
+    key: str
+    rows: int
+    K: int
+    N: int
+    data: np.ndarray  # panels x K x rows, B0 B1 of each MAC block
+    ctrl: np.ndarray  # panels x K x rows, 1XY0 as ints
+    values: np.ndarray  # K x padded N, float32
+
+    @property
+    def panels(self):
+        return len(self.data)
+
+
+def weight_key(B, b_fmt, rows):
+    B = np.ascontiguousarray(B, dtype=np.uint8)
+    h = hashlib.sha256(f"{B.shape} {rows}".encode())
+    h.update(B)
+    h.update(np.ascontiguousarray(np.broadcast_to(np.asarray(b_fmt, dtype=np.uint8), B.shape)))
+    return h.hexdigest()
+
+
+# Row streams of B (K x N) for a grid with this many rows: panel j is columns
+# 2 * rows * j onwards, grid row r gets columns 2r, 2r+1 of the panel
+def encode_weights(B, b_fmt=0, rows=1, key=None):
+    K, N = np.shape(B)
+    Bp, fp = pad(B, b_fmt, 2 * rows, 1)
+    data, ctrl = mac_blocks(Bp, fp, 1, 1)  # K x (panels * rows)
+    panels = lambda x: x.reshape(K, -1, rows).transpose(1, 0, 2).copy()
+    return WeightStreams(key or weight_key(B, b_fmt, rows), rows, K, N, panels(data), panels(ctrl), decode8(Bp, fp))
+
+
+# Encoded weights by key, least recently used evicted past size, and written
+# to (and read back from) path/<key>.npz if there is a path
+class WeightCache:
+    def __init__(self, size=16, path=None):
+        self.size, self.path = size, path
+        self.entries = OrderedDict()
+        self.hits = self.loads = self.misses = 0
+
+    def get(self, B, b_fmt=0, rows=1):
+        key = weight_key(B, b_fmt, rows)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        file = self.path and os.path.join(self.path, f"{key}.npz")
+        if file and os.path.exists(file):
+            self.loads += 1
+            with np.load(file) as f:
+                w = WeightStreams(key, rows, *np.shape(B), f["data"], f["ctrl"], f["values"])
+        else:
+            self.misses += 1
+            w = encode_weights(B, b_fmt, rows, key)
+            if file:
+                os.makedirs(self.path, exist_ok=True)
+                np.savez(file, data=w.data, ctrl=w.ctrl, values=w.values)
+        self.entries[key] = w
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return w
+
+
+# Where each swap block's values come from, as indices into a panel of C
+# (2 * cols x 2 * rows, flattened) or -1 for zero, see gemm.grid_streams swap:
+# wave w of accumulator part writes in the values for tile row/column
+# t = W - 1 - w and reads out what was in tile row/column W - 1 - w
+def swap_index(rows, cols):
+    W = max(rows, cols)
+    at = lambda i, j, ok: i * 2 * rows + j if ok else -1
+    col_in, col_out, row_in, row_out = [], [], [], []
+    for part in range(2):
+        for w in range(W):
+            t = W - 1 - w
+            col_in.append([at(2 * c, 2 * t + part, t < rows) for c in range(cols)])
+            col_out.append([at(2 * c, 2 * (rows - 1 - w) + part, w < rows) for c in range(cols)])
+            row_in.append([at(2 * t + 1, 2 * r + part, t < cols) for r in range(rows)])
+            row_out.append([at(2 * (cols - 1 - w) + 1, 2 * r + part, w < cols) for r in range(rows)])
+    return [np.array(x) for x in (col_in, col_out, row_in, row_out)]
+
+
+# Values of each panel at idx, zero where idx is -1
+def gather(panels, idx):
+    return np.where(idx >= 0, panels[:, np.maximum(idx, 0)], 0).astype(np.uint16)
+
+
+# Logical block streams, like gemm.GridStreams but as arrays: blocks x cols
+# (or rows) of data and ctrl going in, data expected out (ctrl comes out as it
+# went in), read marks the blocks that read out accumulators, and results is
+# C + A * B as FP16 codes
+@dataclass
+class Streams:
+    rows: int
+    cols: int
+    col_in: np.ndarray
+    col_ctrl: np.ndarray
+    row_in: np.ndarray
+    row_ctrl: np.ndarray
+    col_out: np.ndarray
+    row_out: np.ndarray
+    read: np.ndarray
+    results: np.ndarray
+    macs: int
+
+    @property
+    def blocks(self):
+        return len(self.read)
+
+    # As a gemm.GridStreams (without results), for model.Grid or grid.py
+    def grid_streams(self):
+        from fp import FP16
+        from gemm import GridStreams
+
+        stream = lambda data, ctrl, i: [(int(d), f"{c:04b}") for d, c in zip(data[:, i], ctrl[:, i])]
+        out = lambda data, ctrl, i: [(FP16.fromh(f"{d:04x}") if r else int(d), f"{c:04b}")
+                                     for d, c, r in zip(data[:, i], ctrl[:, i], self.read)]
+        return GridStreams(self.rows, self.cols,
+                           [stream(self.col_in, self.col_ctrl, c) for c in range(self.cols)],
+                           [stream(self.row_in, self.row_ctrl, r) for r in range(self.rows)],
+                           [out(self.col_out, self.col_ctrl, c) for c in range(self.cols)],
+                           [out(self.row_out, self.row_ctrl, r) for r in range(self.rows)], [], self.macs)
+
+
+# Streams for C + A * B on a grid with w.rows rows and cols columns, with B
+# already encoded.  Panels go by rows of C then columns, each one a job of
+# gemm.grid_streams: K MAC blocks, then a swap that reads it out while writing
+# in the next panel's C.  Without expected, only the streams going in are made
+# (the expected outputs and results, from the emulation, are most of the time).
+def gemm_streams(A, a_fmt, w, cols=1, C=None, expected=True):
+    rows, K = w.rows, w.K
+    M = len(A)
+    assert np.shape(A) == (M, K), f"A is {np.shape(A)}, not {M}x{K}"
+    Ap, fp = pad(A, a_fmt, 2 * cols, 0)
+    a_data, a_ctrl = mac_blocks(Ap, fp, 0, 0)  # (panels * cols) x K
+    a_data, a_ctrl = (x.reshape(-1, cols, K).transpose(0, 2, 1) for x in (a_data, a_ctrl))
+    Cp = np.zeros((len(Ap), w.values.shape[1]), dtype=np.uint16)
+    if C is not None:
+        assert np.shape(C) == (M, w.N), f"C is {np.shape(C)}, not {M}x{w.N}"
+        Cp[:M, :w.N] = C
+    # Panel p is rows i, columns j of C, flattened
+    pm, pn = len(a_data), w.panels
+    i, j = np.repeat(np.arange(pm), pn), np.tile(np.arange(pn), pm)
+    panels = lambda x: x.reshape(pm, 2 * cols, pn, 2 * rows).transpose(0, 2, 1, 3).reshape(pm * pn, -1)
+    Cs = panels(Cp)
+    Cnext = np.concatenate([Cs[1:], np.zeros_like(Cs[:1])]) if C is not None else np.zeros_like(Cs)
+    if expected:  # from the cached weight values
+        D = encode16(accumulate(decode16(Cp).copy(), decode8(Ap, fp), w.values)) if K else Cp
+        R = panels(D)
+    col_in, col_out, row_in, row_out = swap_index(rows, cols)
+    W2 = len(col_in)
+    swaps = lambda ctrl, n: np.repeat(np.array(ctrl, dtype=np.uint8), W2 // 2)[:, None].repeat(n, 1)
+
+    # Each panel: K MAC blocks then a swap, with a write-in first if there's C
+    def stream(mac, swap, first):
+        x = np.concatenate([mac, swap], axis=1).reshape(-1, mac.shape[2])
+        return x if C is None else np.concatenate([first, x])
+
+    streams = []
+    for mac, ctrl, into, outof, rw, n in [(a_data[i], a_ctrl[i], col_in, col_out, RW_COL, cols),
+                                           (w.data[j], w.ctrl[j], row_in, row_out, RW_ROW, rows)]:
+        P = len(mac)
+        streams += [stream(mac, gather(Cnext, into), gather(Cs[:1], into)[0]),
+                    stream(ctrl, np.broadcast_to(swaps(rw, n), (P, W2, n)), swaps(rw, n)),
+                    stream(mac, gather(R, outof), np.zeros((W2, n), dtype=np.uint16)) if expected else None]
+    read = np.tile(np.arange(K + W2) >= K, len(i))
+    if C is not None:
+        read = np.concatenate([np.ones(W2, dtype=bool), read])
+    ci, cc, co, ri, rc, ro = streams
+    return Streams(rows, cols, ci, cc, ri, rc, co, ro, read, D[:M, :w.N] if expected else None,
+                   4 * rows * cols * K * len(i))
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from emulate import emulate_matmul, random8
+    from estimate import estimate, measure
+    from fp import FP16
+    from gemm import Job, grid_streams
+    from quant import fp8s
+
+    rs = np.random.default_rng(0)
+    # Same blocks as gemm.grid_streams on the panels, and the same results as
+    # the emulation, and they come out of the model
+    for n in range(100):
+        rows, cols, M, N, K = (int(x) for x in rs.integers(1, [4, 4, 13, 13, 9]))
+        A, a_fmt = random8(rs, (M, K))
+        B, b_fmt = random8(rs, (K, N))
+        C = rs.integers(0, 2**16, size=(M, N), dtype=np.uint16) if n % 2 else None
+        s = gemm_streams(A, a_fmt, encode_weights(B, b_fmt, rows), cols, C)
+        assert (s.results == emulate_matmul(A, B, C, a_fmt, b_fmt)).all()
+        (Ap, fa), (Bp, fb) = pad(A, a_fmt, 2 * cols, 0), pad(B, b_fmt, 2 * rows, 1)
+        Cp = np.zeros((len(Ap), Bp.shape[1]), dtype=np.uint16)
+        if C is not None:
+            Cp[:M, :N] = C
+        fp16 = lambda x: [[FP16.fromh(f"{v:04x}") for v in row] for row in x]
+        jobs = [Job(fp8s(Ap[i:i + 2 * cols], fa[i:i + 2 * cols]), fp8s(Bp[:, j:j + 2 * rows], fb[:, j:j + 2 * rows]),
+                    fp16(Cp[i:i + 2 * cols, j:j + 2 * rows]) if C is not None else None)
+                for i in range(0, len(Ap), 2 * cols) for j in range(0, Bp.shape[1], 2 * rows)]
+        ref, got = grid_streams(jobs, rows, cols), s.grid_streams()
+        code = lambda stream: [(d.h if isinstance(d, FP16) else d, c) for d, c in stream]
+        for x, y in [(ref.col_in, got.col_in), (ref.row_in, got.row_in),
+                     (ref.col_out, got.col_out), (ref.row_out, got.row_out)]:
+            assert [code(a) for a in x] == [code(b) for b in y], n
+        assert got.macs == ref.macs
+        if n < 20:
+            assert measure(got) == estimate(M, N, K, rows, cols, C is not None).cycles
+    print("streams match gemm.grid_streams, the emulation and the model")
+    # Least recently used weights are evicted, and come back from disk the same
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = WeightCache(size=2, path=tmp)
+        Bs = [random8(rs, (16, 8)) for _ in range(3)]
+        ws = [cache.get(B, f, 2) for B, f in Bs]
+        assert cache.get(*Bs[2], 2) is ws[2] and cache.get(*Bs[1], 2) is ws[1]
+        w = cache.get(*Bs[0], 2)
+        assert (cache.misses, cache.loads, cache.hits) == (3, 1, 2) and w is not ws[0]
+        assert all((getattr(w, x) == getattr(ws[0], x)).all() for x in ("data", "ctrl", "values"))
+        assert cache.get(*Bs[0], 1).key != w.key
+    # Per call host time for one layer, encoding the weights every call and
+    # with them cached, and gemm.grid_streams for just one panel of it
+    rows, cols, M, K, N, calls = 4, 4, 64, 512, 512, 10
+    B, b_fmt = random8(rs, (K, N))
+    As = [random8(rs, (M, K)) for _ in range(calls)]
+    times = {}
+    for expected in (False, True):
+        for name, get in [("encoded every call", lambda: encode_weights(B, b_fmt, rows)),
+                          ("cached", lambda c=WeightCache(): c.get(B, b_fmt, rows))]:
+            t = time.perf_counter()
+            for A, a_fmt in As:
+                gemm_streams(A, a_fmt, get(), cols, expected=expected)
+            times[name + (", expected too" if expected else "")] = (time.perf_counter() - t) / calls
+    t = time.perf_counter()
+    w = encode_weights(B, b_fmt, rows)
+    encode = time.perf_counter() - t
+    A, a_fmt = As[0]
+    t = time.perf_counter()
+    grid_streams([Job(fp8s(A[:2 * cols], a_fmt[:2 * cols]), fp8s(B[:, :2 * rows], b_fmt[:, :2 * rows]))], rows, cols)
+    panel = time.perf_counter() - t
+    print(f"{M}x{K} * {K}x{N} on {rows}x{cols}, per call:")
+    for name, t in times.items():
+        print(f"  {name}: {1e3 * t:.1f} ms")
+    print(f"  (weights take {1e3 * encode:.1f} ms to encode,"
+          f" gemm.grid_streams takes {panel:.1f} s for one of {M * N // (4 * rows * cols)} panels)")